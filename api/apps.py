@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'film_library.api'
+
+    def ready(self):
+        from film_library.api.signals import create_extensions
+
+        pre_migrate.connect(create_extensions, sender=self)
@@ -0,0 +1,215 @@
+import asyncio
+import threading
+from functools import update_wrapper
+from queue import Full, Queue
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, connections
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+
+# Методы, которые обрабатываются асинхронно, остальные выполняются синхронным представлением
+ASYNC_METHODS = ('GET', 'HEAD')
+
+# Заголовки условного запроса: если они есть, сначала проверяется версия данных, и только потом
+# выбираются сами данные, иначе оба запроса выполняются одновременно
+CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since')
+
+
+def async_reads_enabled() -> bool:
+    """
+    Асинхронное чтение включается настройкой ASYNC_READ_VIEWS = True для запуска под ASGI.
+    Под WSGI асинхронное представление выполнялось бы через async_to_sync в каждом запросе,
+    поэтому по умолчанию представления синхронные.
+    """
+
+    return getattr(settings, 'ASYNC_READ_VIEWS', False)
+
+
+def database_sync_to_async(func):
+    """
+    Выполнение синхронной функции с запросами к БД в пуле потоков.
+    У каждого потока пула своё соединение с БД, поэтому несколько таких вызовов выполняются одновременно.
+    Устаревшие соединения закрываются до и после вызова так же, как в начале и в конце синхронного запроса.
+    Соединения потоков пула переиспользуются только при CONN_MAX_AGE > 0 (в settings.py так и задано),
+    при CONN_MAX_AGE = 0 каждый вызов открывал бы новое соединение.
+    """
+
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(call, thread_sensitive=False)
+
+
+def iterate_in_thread(iterable, buffer: int = 4):
+    """
+    Перебор генератора, который обращается к БД, для потокового ответа.
+    Django 4.0 под ASGI перебирает StreamingHttpResponse в потоке цикла событий, где запросы к БД запрещены,
+    поэтому там генератор выполняется в отдельном потоке со своим соединением, а части ответа передаются
+    через очередь не больше buffer частей. Вне цикла событий (WSGI) генератор перебирается напрямую.
+    """
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        yield from iterable
+        return
+
+    queue = Queue(maxsize=buffer)
+    stopped = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    break
+        except Exception as exc:
+            put(exc)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+            connections.close_all()
+            put(end)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = queue.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+def is_conditional(request) -> bool:
+    return any(header in request.headers for header in CONDITIONAL_HEADERS)
+
+
+class AsyncReadMixin:
+    """
+    Асинхронное чтение для представлений DRF под ASGI.
+    as_view() возвращает асинхронное представление: GET и HEAD из ASGI-запросов обрабатываются adispatch,
+    который не занимает поток на время ожидания БД - запросы выполняются в пуле потоков через
+    database_sync_to_async, независимые запросы одновременно. Остальные методы, а также запросы WSGI
+    и тестового клиента обрабатываются синхронным представлением, как и без этого класса.
+    Сам ответ строится методом aget представления. Если при загрузке URL не задано ASYNC_READ_VIEWS = True,
+    as_view() возвращает обычное синхронное представление (для развёртывания под WSGI).
+    """
+
+    @classmethod
+    def use_async(cls, request) -> bool:
+        return request.method in ASYNC_METHODS and isinstance(request, ASGIRequest) and async_reads_enabled()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        sync_view = super(AsyncReadMixin, cls).as_view(**initkwargs)
+        if not async_reads_enabled():
+            return sync_view
+        run_sync = sync_to_async(sync_view)
+
+        async def view(request, *args, **kwargs):
+            if not cls.use_async(request):
+                return await run_sync(request, *args, **kwargs)
+
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            return await self.adispatch(request, *args, **kwargs)
+
+        return update_wrapper(view, sync_view)
+
+    async def adispatch(self, request, *args, **kwargs):
+        """
+        Аналог APIView.dispatch для GET и HEAD. Аутентификация, проверка прав и выбор формата ответа
+        выполняются в пуле потоков, так как могут читать сессию и пользователя из БД.
+        """
+
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await database_sync_to_async(self.initial)(request, *args, **kwargs)
+            response = await self.aget(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aget(self, request, *args, **kwargs):
+        return await database_sync_to_async(self.get)(request, *args, **kwargs)
+
+
+class AsyncListMixin(AsyncReadMixin):
+    """
+    Асинхронный список с условным GET (вместе с ConditionalListMixin).
+    Количество записей и записи страницы выбираются одновременно, ETag строится по выбранной странице,
+    и при совпадении с If-None-Match страница не сериализуется.
+    Для быстрого пути FastListMixin должен стоять в списке базовых классов раньше этого класса.
+    """
+
+    async def apaginate_queryset(self, queryset):
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+    async def aget(self, request, *args, **kwargs):
+        if self.paginator is None:
+            return await super(AsyncListMixin, self).aget(request, *args, **kwargs)
+
+        queryset, fast = await database_sync_to_async(self.prepare_list)()
+        page = await self.apaginate_queryset(queryset)
+        return await database_sync_to_async(self.conditional_list)(queryset, page, fast)
+
+
+class AsyncDetailMixin(AsyncReadMixin):
+    """
+    Асинхронное чтение отдельной записи с условным GET (вместе с ConditionalDetailMixin).
+    Время изменения записи для ETag и сама запись выбираются одновременно,
+    для условного запроса сначала проверяется время изменения.
+    """
+
+    def detail_response(self, instance):
+        return Response(self.get_serializer(instance).data)
+
+    async def aget(self, request, *args, **kwargs):
+        last_modified = database_sync_to_async(self.get_last_modified)
+        get_object = database_sync_to_async(self.get_object)
+
+        if is_conditional(request):
+            last_modified, instance = await last_modified(), None
+        else:
+            last_modified, instance = await asyncio.gather(last_modified(), get_object(), return_exceptions=True)
+            if isinstance(last_modified, Exception):
+                raise last_modified
+
+        if last_modified is None:
+            return await super(AsyncDetailMixin, self).aget(request, *args, **kwargs)
+
+        etag, timestamp = self.get_validators(last_modified)
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            if instance is None:
+                instance = await get_object()
+            elif isinstance(instance, Exception):
+                raise instance
+            response = await database_sync_to_async(self.detail_response)(instance)
+        return self.set_validators(response, etag, timestamp)
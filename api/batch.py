@@ -0,0 +1,74 @@
+from django.db import router, transaction
+from film_library.api.models import FilmsWatched, FilmsToWatch
+
+
+def write_manager(model):
+    """
+    Менеджер модели для БД записи. Пакетные методы менеджеров выполняют запросы в self.db,
+    который без явного алиаса выбирается роутером как для чтения
+    """
+
+    return model.objects.db_manager(router.db_for_write(model))
+
+
+def add_watched(user, items) -> int:
+    """
+    Добавляет в список просмотренного пачку фильмов и сериалов.
+    items - список словарей с ключом movie или tv (id) и необязательными score и review.
+    Правила FilmsWatched.save выполняются над всей пачкой сразу одним запросом на тип
+    (FilmsWatchedQuerySet.watch): удаление из списка желаемого к просмотру, INSERT ... ON CONFLICT
+    и изменение рейтинга. Уже просмотренные записи обновляются, незаполненные score и review
+    не затирают старые значения. Возвращает количество добавленных или обновлённых записей.
+    """
+
+    rows = 0
+    watched = write_manager(FilmsWatched)
+    with transaction.atomic(using=watched.db):
+        for column, key in (('movie_id', 'movie'), ('tv_id', 'tv')):
+            films = {
+                item[key]: (item.get('score'), item.get('review'))
+                for item in items if item.get(key) is not None
+            }
+            rows += len(watched.watch(user.pk, column, films, keep_existing=True))
+    return rows
+
+
+def remove_watched(user, movie_ids, tv_ids) -> int:
+    """
+    Удаляет из списка просмотренного пачку фильмов и сериалов одним запросом на тип,
+    в котором же вычитаются удалённые оценки из рейтинга. Возвращает количество удалённых записей.
+    """
+
+    watched = write_manager(FilmsWatched)
+    with transaction.atomic(using=watched.db):
+        return watched.unwatch(user.pk, 'movie_id', set(movie_ids)) + watched.unwatch(user.pk, 'tv_id', set(tv_ids))
+
+
+def add_to_watch(user, movie_ids, tv_ids) -> tuple:
+    """
+    Добавляет в список желаемого к просмотру пачку фильмов и сериалов одним запросом на тип
+    (FilmsToWatchQuerySet.want). Как и в FilmsToWatch.save, уже просмотренные фильмы и сериалы не добавляются.
+    Записи, которые уже есть в списке, пропускаются.
+    Возвращает количество добавленных записей и список отклонённых (уже просмотренных).
+    """
+
+    rows = 0
+    rejected = []
+    to_watch = write_manager(FilmsToWatch)
+    with transaction.atomic(using=to_watch.db):
+        for column, key, ids in (('movie_id', 'movie', movie_ids), ('tv_id', 'tv', tv_ids)):
+            _, created, watched = to_watch.want(user.pk, column, ids)
+            rows += len(created)
+            rejected += [{key: film_id} for film_id in watched]
+    return rows, rejected
+
+
+def remove_to_watch(user, movie_ids, tv_ids) -> int:
+    """
+    Удаляет из списка желаемого к просмотру пачку фильмов и сериалов одним запросом на тип,
+    в котором же вычитаются удалённые записи из счётчиков пользователя. Возвращает количество удалённых записей.
+    """
+
+    to_watch = write_manager(FilmsToWatch)
+    with transaction.atomic(using=to_watch.db):
+        return to_watch.unwant(user.pk, 'movie_id', set(movie_ids)) + to_watch.unwant(user.pk, 'tv_id', set(tv_ids))
@@ -0,0 +1,248 @@
+import json
+import math
+import time
+from contextlib import ExitStack
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import Count
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from film_library.api.models import TV, Movie, FilmsWatched, FilmsToWatch
+from film_library.api.seeding import seed_database
+from film_library.api.fastpath import FastRows
+from film_library.api.recommendations import build_neighbours
+from film_library.api.leaderboards import refresh_leaderboards
+from film_library.api.views import MOVIE_FIELDS, TV_FIELDS, watched_queryset
+import film_library.api.serializers as ser
+
+# Пользователь, от имени которого выполняются запросы бенчмарка
+BENCHMARK_USERNAME = 'benchmark'
+
+
+def seed_dataset(movies: int, tv: int, users: int, watched: int, to_watch: int, seed: int = 0) -> User:
+    """
+    Заполняет БД синтетическим набором данных (seeding.seed_database) и строит таблицы лидербордов
+    и рекомендаций. watched и to_watch - средний размер списков пользователя. Набор данных детерминирован
+    параметром seed. Возвращает пользователя с самым длинным списком просмотренного: он становится
+    суперпользователем, и от его имени выполняются запросы.
+    """
+
+    seed_database(users=users, movies=movies, tv=tv, watched=watched, to_watch=to_watch, seed=seed)
+    heaviest = FilmsWatched.objects.values('user').annotate(rows=Count('pk')).order_by('-rows', 'user')[0]['user']
+    User.objects.filter(pk=heaviest).update(username=BENCHMARK_USERNAME, is_superuser=True, is_staff=True)
+
+    refresh_leaderboards()
+    try:
+        build_neighbours(full=True)
+    except ImproperlyConfigured:
+        pass
+    return User.objects.get(pk=heaviest)
+
+
+def endpoint_cases(user) -> list:
+    """
+    Запросы бенчмарка: по одному на каждый маршрут api/urls.py и на основные изменяющие запросы.
+    Возвращает список кортежей (имя, метод, адрес, тело запроса, тип содержимого).
+    """
+
+    movie = Movie.objects.order_by('pk').first()
+    tv = TV.objects.order_by('pk').first()
+    watched = FilmsWatched.objects.filter(user=user).order_by('pk').first()
+    to_watch = FilmsToWatch.objects.filter(user=user).order_by('pk').first()
+    word = movie.title.split()[0]
+    last_page = max(1, math.ceil(Movie.objects.count() / api_settings.PAGE_SIZE))
+
+    get = [
+        ('api-root', reverse('api-root')),
+        ('admin', reverse('admin:index')),
+        ('user-list', reverse('user-list')),
+        ('user-list-summary', reverse('user-list') + '?summary=true'),
+        ('user-detail', reverse('user-detail', kwargs={'pk': user.pk})),
+        ('user-stats', reverse('user-stats', kwargs={'pk': user.pk})),
+        ('user-watched-list', reverse('user-watched-list', kwargs={'pk': user.pk})),
+        ('user-to-watch-list', reverse('user-to-watch-list', kwargs={'pk': user.pk})),
+        ('movie-list', reverse('movie-list')),
+        ('movie-list-cursor', reverse('movie-list') + '?pagination=cursor'),
+        ('movie-list-last-page', reverse('movie-list') + f'?page={last_page}'),
+        ('movie-list-genre', reverse('movie-list') + '?genre=drama&genre=comedy'),
+        ('movie-list-search', reverse('movie-list') + f'?search={word}'),
+        ('movie-detail', reverse('movie-detail', kwargs={'pk': movie.pk})),
+        ('movie-stats', reverse('movie-stats', kwargs={'pk': movie.pk})),
+        ('tv-list', reverse('tv-list')),
+        ('tv-detail', reverse('tv-detail', kwargs={'pk': tv.pk})),
+        ('search', reverse('search') + f'?search={word}'),
+        ('genre-facets', reverse('genre-facets')),
+        ('watched-list', reverse('watched-list')),
+        ('movie-watched-list', reverse('movie-watched-list')),
+        ('tv-watched-list', reverse('tv-watched-list')),
+        ('to-watch-list', reverse('to-watch-list')),
+        ('movie-to-watch-list', reverse('movie-to-watch-list')),
+        ('tv-to-watch-list', reverse('tv-to-watch-list')),
+        ('watched-export', reverse('watched-export')),
+        ('watched-export-csv', reverse('watched-export') + '?format=csv'),
+        ('to-watch-export', reverse('to-watch-export')),
+        ('recommendations', reverse('recommendations')),
+        ('leaderboard-top-rated', reverse('leaderboard', args=['top-rated'])),
+        ('leaderboard-most-watched', reverse('leaderboard', args=['most-watched']) + '?type=movie&genre=drama'),
+    ]
+    if watched is not None:
+        get.append(('watched-detail', reverse('watched-detail', kwargs={'pk': watched.pk})))
+    if to_watch is not None:
+        get.append(('to-watch-detail', reverse('to-watch-detail', kwargs={'pk': to_watch.pk})))
+
+    film = {'title': 'benchmark', 'year': 2000, 'genre': ['drama']}
+    imported = '\n'.join(json.dumps({**film, 'title': f'benchmark {i}', 'duration': 100}) for i in range(100))
+    post = [
+        ('movie-create', reverse('movie-list'), json.dumps({**film, 'duration': 100}), 'application/json'),
+        ('tv-create', reverse('tv-list'), json.dumps({**film, 'number_of_episodes': 10, 'avg_episode_duration': 40}),
+         'application/json'),
+        ('movie-import', reverse('movie-import'), imported, 'application/x-ndjson'),
+        ('watched-batch', reverse('watched-batch'),
+         json.dumps({'add': [{'movie': movie.pk, 'score': 8.5}, {'tv': tv.pk}], 'remove': []}), 'application/json'),
+        ('to-watch-batch', reverse('to-watch-batch'),
+         json.dumps({'add': [{'movie': movie.pk}, {'tv': tv.pk}], 'remove': []}), 'application/json'),
+    ]
+
+    return ([(name, 'GET', url, None, None) for name, url in get]
+            + [(name, 'POST', url, data, content_type) for name, url, data, content_type in post])
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Перцентиль по методу ближайшего ранга
+    """
+
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def measure(client: Client, method: str, url: str, data, content_type, iterations: int, warmup: int) -> dict:
+    """
+    Выполняет запрос warmup + iterations раз и возвращает p50/p95 времени ответа, количество SQL-запросов
+    и суммарное время SQL (медиана по итерациям) по всем алиасам БД, в том числе репликам.
+    Изменяющие запросы выполняются в транзакции,
+    которая откатывается, поэтому каждая итерация работает с одним и тем же набором данных.
+    """
+
+    latencies, queries, sql_times, status = [], [], [], None
+    for i in range(warmup + iterations):
+        with transaction.atomic(), ExitStack() as stack:
+            contexts = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            started = time.perf_counter()
+            if method == 'GET':
+                response = client.get(url)
+            else:
+                response = client.generic(method, url, data, content_type=content_type)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        status = response.status_code
+        if i >= warmup:
+            captured = [query for context in contexts for query in context.captured_queries]
+            latencies.append(elapsed * 1000)
+            queries.append(len(captured))
+            sql_times.append(sum(float(query['time']) for query in captured) * 1000)
+
+    return {
+        'method': method,
+        'url': url,
+        'status': status,
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'queries': max(queries),
+        'sql_ms': round(percentile(sql_times, 0.5), 3),
+    }
+
+
+def run_benchmark(user, iterations: int, warmup: int, only=None) -> dict:
+    """
+    Замеры всех запросов endpoint_cases от имени пользователя user.
+    only - необязательный список имён запросов, которые нужно замерить.
+    """
+
+    client = Client()
+    client.force_login(user)
+    results = {}
+    for name, method, url, data, content_type in endpoint_cases(user):
+        if only and name not in only:
+            continue
+        results[name] = measure(client, method, url, data, content_type, iterations, warmup)
+    return results
+
+
+def serialization_cost(rows: int, repeat: int = 5) -> dict:
+    """
+    Процессорное время на одну запись (мкс) при построении списков фильмов, сериалов и просмотренного
+    обычным путём (объекты моделей, сериализатор DRF, JSONRenderer) и быстрым путём (FastRows, orjson).
+    Время считается по time.process_time, поэтому ожидание ответа БД в него не входит.
+    Берётся минимум из repeat повторов.
+    """
+
+    request = Request(RequestFactory().get('/'))
+    cases = {
+        'movie-list': (ser.MovieSerializerList, Movie.objects.select_related('added_by').only(*MOVIE_FIELDS)),
+        'tv-list': (ser.TVSerializerList, TV.objects.select_related('added_by').only(*TV_FIELDS)),
+        'watched-list': (ser.WatchedSerializer, watched_queryset()),
+    }
+
+    def cpu_time(action) -> float:
+        best = None
+        for _ in range(repeat):
+            started = time.process_time()
+            action()
+            elapsed = time.process_time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    results = {}
+    for name, (serializer_class, queryset) in cases.items():
+        count = len(queryset[:rows])
+        if not count:
+            continue
+
+        def drf():
+            data = serializer_class(queryset[:rows], many=True, context={'request': request}).data
+            JSONRenderer().render(data)
+
+        def fast():
+            fast_rows = FastRows(serializer_class, request)
+            fast_rows.render(fast_rows.rows(queryset.values(*fast_rows.columns)[:rows]))
+
+        drf_us, fast_us = cpu_time(drf) / count * 1e6, cpu_time(fast) / count * 1e6
+        results[name] = {
+            'rows': count,
+            'drf_us_per_row': round(drf_us, 2),
+            'fast_us_per_row': round(fast_us, 2),
+            'speedup': round(drf_us / fast_us, 2) if fast_us else None,
+        }
+    return results
+
+
+def compare(report: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    """
+    Сравнение отчёта с сохранённым базовым отчётом.
+    Регрессия - рост количества SQL-запросов, ошибочный код ответа или рост p95 больше чем на tolerance
+    (доля базового значения) и одновременно больше чем на min_delta_ms, чтобы не реагировать на шум.
+    Возвращает список описаний регрессий.
+    """
+
+    regressions = []
+    for name, base in baseline['endpoints'].items():
+        current = report['endpoints'].get(name)
+        if current is None:
+            continue
+        if current['status'] >= 400 > base['status']:
+            regressions.append(f'{name}: код ответа {base["status"]} -> {current["status"]}')
+        if current['queries'] > base['queries']:
+            regressions.append(f'{name}: SQL-запросов {base["queries"]} -> {current["queries"]}')
+        delta = current['p95_ms'] - base['p95_ms']
+        if delta > base['p95_ms'] * tolerance and delta > min_delta_ms:
+            regressions.append(f'{name}: p95 {base["p95_ms"]} мс -> {current["p95_ms"]} мс')
+    return regressions
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import uuid
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+# Кэш ответов на чтение каталога. Алиас задаётся настройкой RESPONSE_CACHE_ALIAS,
+# сам бэкенд (локальная память, Redis) и время жизни записей - настройкой CACHES.
+RESPONSE_CACHE_ALIAS = getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')
+
+# Заголовки ответа, которые сохраняются вместе с телом
+CACHED_HEADERS = ('Content-Type', 'Vary', 'Allow', 'ETag', 'Last-Modified')
+
+
+def get_cache():
+    return caches[RESPONSE_CACHE_ALIAS]
+
+
+def namespace_token(namespace: str) -> str:
+    """
+    Текущая версия группы ответов. Ключи ответов содержат версию, поэтому смена версии
+    делает недействительными все ответы группы без перебора ключей.
+    Если версия вытеснена из кэша, создаётся новая, и старые ответы больше не используются.
+    """
+
+    cache = get_cache()
+    key = f'response-namespace:{namespace}'
+    token = cache.get(key)
+    if token is None:
+        token = uuid.uuid4().hex
+        if not cache.add(key, token, timeout=None):
+            token = cache.get(key, token)
+    return token
+
+
+def invalidate_responses(*namespaces) -> None:
+    """
+    Делает недействительными закэшированные ответы указанных групп после фиксации текущей транзакции
+    """
+
+    def invalidate():
+        get_cache().set_many(
+            {f'response-namespace:{namespace}': uuid.uuid4().hex for namespace in namespaces},
+            timeout=None
+        )
+
+    transaction.on_commit(invalidate)
+
+
+def invalidate_films(model_name: str, *pks) -> None:
+    """
+    Делает недействительными ответы со списком фильмов или сериалов (model_name - 'movie' или 'tv')
+    и с указанными записями
+    """
+
+    invalidate_responses(f'{model_name}-list', *[f'{model_name}:{pk}' for pk in pks])
+
+
+def invalidate_catalog(model_name: str) -> None:
+    """
+    Делает недействительными все ответы каталога фильмов или сериалов, используется при массовых изменениях
+    """
+
+    invalidate_responses(f'{model_name}-list', f'{model_name}-all')
+
+
+def cached_response(request, namespaces, kwargs) -> tuple:
+    """
+    Ключ ответа в кэше и сам ответ, если он есть в кэше (иначе None)
+    """
+
+    tokens = [namespace_token(namespace.format(**kwargs)) for namespace in namespaces]
+    raw_key = '|'.join([request.build_absolute_uri(), request.headers.get('Accept', ''), *tokens])
+    key = 'response:' + hashlib.md5(raw_key.encode('utf-8')).hexdigest()
+
+    cached = get_cache().get(key)
+    if cached is None:
+        return key, None
+
+    content, headers = cached
+    last_modified = headers.get('Last-Modified')
+    return key, get_conditional_response(
+        request,
+        etag=headers.get('ETag'),
+        last_modified=parse_http_date_safe(last_modified) if last_modified else None,
+        response=HttpResponse(content, headers=headers),
+    )
+
+
+def save_response(key: str, response) -> None:
+    if response.status_code == 200 and not response.get('Content-Type', '').startswith('text/html'):
+        headers = {header: response[header] for header in CACHED_HEADERS if response.has_header(header)}
+        get_cache().set(key, (response.content, headers))
+
+
+def store_response(key: str, response) -> None:
+    """
+    Сохраняет ответ в кэш. Ответ DRF сохраняется после рендера, когда известны формат и заголовки ответа
+    """
+
+    if hasattr(response, 'render') and callable(response.render) and not response.is_rendered:
+        response.add_post_render_callback(lambda rendered: save_response(key, rendered))
+    else:
+        save_response(key, response)
+
+
+def cache_response(*namespaces):
+    """
+    Декоратор обработчика GET-запросов, кэширующий ответы на GET и HEAD запросы.
+    Ключ строится по адресу (схема, хост, путь), параметрам запроса, заголовку Accept и версиям групп namespaces.
+    Имена групп могут содержать параметры из URL, например 'movie:{pk}'.
+    Кэшируются только успешные ответы, не зависящие от пользователя (HTML-страницы browsable API не кэшируются).
+    Декорируется обработчик, а не всё представление: он вызывается после аутентификации, проверки прав
+    и ограничения частоты запросов, поэтому ответ из кэша получают только клиенты, прошедшие эти проверки.
+    У функций-представлений декоратор ставится под @api_view.
+    Асинхронные обработчики тоже поддерживаются, обращения к кэшу выполняются в пуле потоков.
+    """
+
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+
+                key, response = await sync_to_async(cached_response, thread_sensitive=False)(
+                    request, namespaces, kwargs
+                )
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    await sync_to_async(store_response, thread_sensitive=False)(key, response)
+                return response
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            key, response = cached_response(request, namespaces, kwargs)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                store_response(key, response)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def cache_view(*namespaces):
+    """
+    Декоратор класса представления: кэширует ответы обработчика get и, у асинхронных представлений, aget
+    """
+
+    def decorator(cls):
+        for name in ('get', 'aget'):
+            if hasattr(cls, name):
+                cls = method_decorator(cache_response(*namespaces), name=name)(cls)
+        return cls
+
+    return decorator
@@ -0,0 +1,134 @@
+import hashlib
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+def make_etag(*parts) -> str:
+    """
+    Строгий ETag из версии данных и параметров, от которых зависит представление ответа
+    """
+
+    raw = '|'.join(str(part) for part in parts)
+    return '"%s"' % hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+class ConditionalListMixin:
+    """
+    Условные GET-запросы для списков.
+    ETag строится по выбранной странице: ключам и времени изменения её записей, состоянию пагинации
+    (количеству записей или ключам соседних страниц) и адресу запроса со всеми параметрами, от которых
+    зависит представление (?fields=, ?omit=, ?expand=, номер страницы, курсор). Весь отфильтрованный список
+    не агрегируется, версия читается тем же запросом, что и записи страницы.
+    При совпадении с If-None-Match возвращается 304 без сериализации.
+    Last-Modified для списков не отдаётся: удаление записи не меняет время последнего изменения.
+    """
+
+    # Поля записи, из которых строится её версия
+    version_fields = ('pk', 'updated_at')
+
+    def get_fast_rows(self):
+        return None
+
+    def prepare_list(self):
+        """
+        Queryset списка и построитель записей быстрого пути (или None)
+        """
+
+        fast = self.get_fast_rows()
+        queryset = self.filter_queryset(self.get_queryset())
+        if fast is not None:
+            queryset = queryset.values(*fast.columns, *[
+                field for field in self.version_fields if field not in fast.columns
+            ])
+        return queryset, fast
+
+    def get_row_version(self, row) -> tuple:
+        """
+        Версия записи страницы (объекта модели или словаря из .values())
+        """
+
+        if isinstance(row, dict):
+            return tuple(row[field] for field in self.version_fields)
+        return tuple(getattr(row, field) for field in self.version_fields)
+
+    def get_version(self, rows, paginated: bool) -> tuple:
+        state = self.paginator.get_page_state() if paginated else None
+        return state, [self.get_row_version(row) for row in rows]
+
+    def get_etag(self, version: tuple) -> str:
+        state, rows = version
+        return make_etag(
+            type(self).__name__, self.request.accepted_media_type, self.request.build_absolute_uri(), state, rows
+        )
+
+    def list_response(self, queryset, page, fast):
+        """
+        Ответ со страницей page или, если пагинация не выполнялась, со всеми записями queryset
+        """
+
+        rows = queryset if page is None else page
+        if fast is not None:
+            return self.fast_response(fast, rows, paginated=page is not None)
+        data = self.get_serializer(rows, many=True).data
+        return Response(data) if page is None else self.get_paginated_response(data)
+
+    def conditional_list(self, queryset, page, fast):
+        """
+        Ответ 304, если ETag выбранной страницы совпадает с If-None-Match, иначе ответ со страницей
+        """
+
+        etag = self.get_etag(self.get_version(queryset if page is None else page, paginated=page is not None))
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            response = self.list_response(queryset, page, fast)
+        response['ETag'] = etag
+        return response
+
+    def get(self, request, *args, **kwargs):
+        queryset, fast = self.prepare_list()
+        return self.conditional_list(queryset, self.paginate_queryset(queryset), fast)
+
+
+class ConditionalDetailMixin:
+    """
+    Условные GET-запросы для отдельных записей.
+    ETag и Last-Modified строятся по полю updated_at записи, которое читается по первичному ключу,
+    ETag зависит также от адреса запроса (?fields=, ?omit=), при совпадении с If-None-Match или If-Modified-Since возвращается 304.
+    """
+
+    def get_last_modified(self):
+        try:
+            return self.get_queryset().filter(
+                pk=self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            ).values_list('updated_at', flat=True).first()
+        except (TypeError, ValueError):
+            return None
+
+    def get_validators(self, last_modified) -> tuple:
+        """
+        ETag и Last-Modified (timestamp) записи
+        """
+
+        etag = make_etag(
+            type(self).__name__, self.request.accepted_media_type, self.request.build_absolute_uri(),
+            last_modified.isoformat()
+        )
+        return etag, int(last_modified.timestamp())
+
+    @staticmethod
+    def set_validators(response, etag: str, timestamp: int):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def get(self, request, *args, **kwargs):
+        last_modified = self.get_last_modified()
+        if last_modified is None:
+            return super(ConditionalDetailMixin, self).get(request, *args, **kwargs)
+
+        etag, timestamp = self.get_validators(last_modified)
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super(ConditionalDetailMixin, self).get(request, *args, **kwargs)
+        return self.set_validators(response, etag, timestamp)
@@ -0,0 +1,41 @@
+import csv
+import io
+
+
+class IteratorFile(io.TextIOBase):
+    """
+    Файл только для чтения поверх генератора строк, для потоковой передачи данных в COPY
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ''
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def csv_lines(rows):
+    """
+    Преобразует последовательность кортежей в строки CSV. None записывается как пустое значение без кавычек,
+    что COPY в формате CSV читает как NULL.
+    """
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
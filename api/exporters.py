@@ -0,0 +1,102 @@
+import json
+from django.db import transaction
+from rest_framework import renderers
+from rest_framework.fields import DateTimeField
+from film_library.api.csvutils import csv_lines
+
+# Количество строк, которые читаются из серверного курсора за одно обращение к БД
+EXPORT_CHUNK_SIZE = 2000
+
+# Количество строк в одной части потокового ответа
+EXPORT_PART_ROWS = 500
+
+WATCHED_COLUMNS = ['id', 'type', 'film', 'title', 'year', 'score', 'review', 'updated_at']
+TO_WATCH_COLUMNS = ['id', 'type', 'film', 'title', 'year', 'updated_at']
+
+# Столбцы фильма и сериала, которые выбираются тем же запросом через JOIN
+FILM_COLUMNS = ['movie_id', 'tv_id', 'movie__title', 'movie__year', 'tv__title', 'tv__year']
+
+
+def export_rows(queryset, columns: list):
+    """
+    Строки выгрузки списка просмотренного или желаемого к просмотру в порядке добавления.
+    Записи читаются серверным курсором (iterator(chunk_size)), поэтому в памяти одновременно находится
+    не больше EXPORT_CHUNK_SIZE записей. Название и год фильма или сериала выбираются тем же запросом.
+    Значения приводятся к тому же виду, что и в ответах API.
+    Курсор открывается в транзакции: вне транзакции PostgreSQL создаёт курсор WITH HOLD и вычисляет
+    весь результат до выдачи первой строки, а в транзакции выбирает план, отдающий первые строки сразу
+    (проход по индексу (user, id) и поиск фильмов по первичному ключу).
+    """
+
+    own = [column for column in columns if column not in ('type', 'film', 'title', 'year')]
+    to_datetime = DateTimeField().to_representation
+    rows = queryset.order_by('pk').values(*own, *FILM_COLUMNS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    def convert(row) -> list:
+        kind = 'movie' if row['movie_id'] is not None else 'tv'
+        row['type'] = kind
+        row['film'] = row[f'{kind}_id']
+        row['title'] = row[f'{kind}__title']
+        row['year'] = row[f'{kind}__year']
+        row['updated_at'] = to_datetime(row['updated_at'])
+        if row.get('score') is not None:
+            row['score'] = str(row['score'])
+        return [row[column] for column in columns]
+
+    with transaction.atomic(using=queryset.db):
+        try:
+            yield from map(convert, rows)
+        finally:
+            rows.close()
+
+
+def parts(lines):
+    """
+    Объединение строк ответа в части по EXPORT_PART_ROWS строк
+    """
+
+    part = []
+    for line in lines:
+        part.append(line)
+        if len(part) >= EXPORT_PART_ROWS:
+            yield ''.join(part).encode('utf-8')
+            part = []
+    if part:
+        yield ''.join(part).encode('utf-8')
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    NDJSON: по объекту JSON на строку. stream() используется для потоковой выгрузки,
+    render() - для остальных ответов (например ошибок), которые выводятся одной строкой.
+    """
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data, ensure_ascii=False) + '\n').encode('utf-8')
+
+    def stream(self, columns: list, rows):
+        return parts(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+
+
+class CSVRenderer(renderers.BaseRenderer):
+    """
+    CSV с заголовком. Заголовок отправляется сразу, до выполнения запроса к БД.
+    Ответы-словари (например ошибки) выводятся как заголовок и одна строка значений.
+    """
+
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict):
+            data = {'detail': data}
+        return ''.join(csv_lines([list(data), list(data.values())])).encode('utf-8')
+
+    def stream(self, columns: list, rows):
+        yield ','.join(columns).encode('utf-8') + b'\n'
+        yield from parts(csv_lines(rows))
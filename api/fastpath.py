@@ -0,0 +1,166 @@
+import functools
+from types import SimpleNamespace
+from django.conf import settings
+from django.urls import get_script_prefix, reverse
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Подстановка вместо первичного ключа при построении шаблона ссылки
+PK_PLACEHOLDER = '__pk__'
+
+# Поля, значения которых из .values() выводятся без преобразования
+PASSTHROUGH_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+# Диапазон, в котором orjson и json записывают float одинаково (без экспоненты)
+FLOAT_SAFE_RANGE = (1e-4, 1e16)
+
+
+def fast_path_enabled() -> bool:
+    """
+    Быстрый путь можно отключить настройкой FAST_READ_PATH = False, например для сравнения ответов
+    """
+
+    return getattr(settings, 'FAST_READ_PATH', True)
+
+
+@functools.lru_cache(maxsize=None)
+def url_template(view_name: str, script_prefix: str) -> tuple:
+    """
+    Относительная ссылка на запись view_name, разделённая на части до и после первичного ключа.
+    reverse() выполняется один раз на маршрут, далее ссылка собирается конкатенацией строк.
+    """
+
+    url = reverse(view_name, kwargs={'pk': PK_PLACEHOLDER})
+    prefix, suffix = url.split(PK_PLACEHOLDER)
+    return prefix, suffix
+
+
+def absolute_url_builder(request, view_name: str):
+    """
+    Функция pk -> абсолютная ссылка, совпадающая с результатом HyperlinkedIdentityField
+    """
+
+    prefix, suffix = url_template(view_name, get_script_prefix())
+    prefix = request.build_absolute_uri(prefix)
+
+    def build(pk):
+        return None if pk is None else f'{prefix}{pk}{suffix}'
+
+    return build
+
+
+def float_is_safe(value) -> bool:
+    value = abs(float(value))
+    return value == 0 or FLOAT_SAFE_RANGE[0] <= value < FLOAT_SAFE_RANGE[1]
+
+
+def render_json(data, fast: bool = True) -> bytes:
+    """
+    JSON в том же виде, что и JSONRenderer с настройками по умолчанию (компактный, без экранирования Unicode).
+    Если установлен orjson и fast=True, используется он, типы, которые orjson не знает, преобразуются
+    так же, как в JSONEncoder DRF.
+    """
+
+    if orjson is None or not fast or not (api_settings.COMPACT_JSON and api_settings.UNICODE_JSON):
+        return JSONRenderer().render(data)
+
+    content = orjson.dumps(
+        data, default=JSONEncoder().default,
+        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+    return content.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class FastRows:
+    """
+    Построение записей ответа напрямую из .values() без создания объектов моделей и вызова сериализатора.
+    Для каждого поля сериализатора один раз при создании выбирается способ получения значения:
+    ссылка по шаблону, значение столбца как есть, to_representation поля сериализатора или
+    свойство модели (например rating), вычисляемое из столбцов computed_sources.
+    Вывод совпадает с выводом сериализатора побайтно. Поля, для которых способ не определён,
+    делают быстрый путь недоступным (supported=False).
+    """
+
+    computed_sources = {'rating': ('score_sum', 'score_count')}
+
+    def __init__(self, serializer_class, request):
+        serializer = serializer_class(context={'request': request})
+        model = serializer_class.Meta.model
+        self.columns = [model._meta.pk.name]
+        self.accessors = []
+        self.unsafe_floats = []
+        self.supported = True
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            accessor = self.compile(name, field, model, request)
+            if accessor is None:
+                self.supported = False
+                return
+            self.accessors.append((name, accessor))
+
+    def column(self, name: str) -> str:
+        if name not in self.columns:
+            self.columns.append(name)
+        return name
+
+    def compile(self, name: str, field, model, request):
+        pk = model._meta.pk.name
+
+        if isinstance(field, serializers.HyperlinkedIdentityField):
+            build = absolute_url_builder(request, field.view_name)
+            return lambda row: build(row[pk])
+
+        if isinstance(field, serializers.HyperlinkedRelatedField):
+            build = absolute_url_builder(request, field.view_name)
+            key = self.column(field.source)
+            return lambda row: build(row[key])
+
+        if name in self.computed_sources and isinstance(field, serializers.ReadOnlyField):
+            getter = getattr(model, field.source).fget
+            keys = [self.column(source) for source in self.computed_sources[name]]
+
+            def computed(row):
+                value = getter(SimpleNamespace(**{key: row[key] for key in keys}))
+                if value is not None and not float_is_safe(value):
+                    self.unsafe_floats.append(value)
+                return value
+
+            return computed
+
+        if isinstance(field, serializers.ReadOnlyField):
+            key = self.column(field.source.replace('.', '__'))
+            return lambda row: row[key]
+
+        key = self.column(field.source)
+        child = getattr(field, 'child', None)
+        if isinstance(field, PASSTHROUGH_FIELDS) or (
+            isinstance(field, serializers.ListField) and isinstance(child, PASSTHROUGH_FIELDS)
+        ):
+            return lambda row: row[key]
+
+        if isinstance(field, (serializers.DecimalField, serializers.DateTimeField)):
+            represent = field.to_representation
+            return lambda row: None if row[key] is None else represent(row[key])
+
+        return None
+
+    def rows(self, values) -> list:
+        accessors = self.accessors
+        return [{name: accessor(row) for name, accessor in accessors} for row in values]
+
+    def render(self, data) -> bytes:
+        """
+        Рендер ответа. Если среди вычисленных float есть значения, которые orjson записал бы
+        не так, как json (в экспоненциальной записи), используется JSONRenderer.
+        """
+
+        return render_json(data, fast=not self.unsafe_floats)
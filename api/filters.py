@@ -0,0 +1,77 @@
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+
+class TitleSearchFilter(filters.BaseFilterBackend):
+    """
+    Поиск фильмов и сериалов по названию параметром ?search=
+    """
+
+    search_param = 'search'
+
+    def get_search_text(self, request) -> str:
+        return request.query_params.get(self.search_param, '').strip()
+
+    def filter_queryset(self, request, queryset, view):
+        text = self.get_search_text(request)
+        if not text:
+            return queryset
+
+        # Результаты поиска упорядочены по релевантности, пагинация по ключу (title, id) к ним неприменима
+        if view is not None:
+            view.keyset_ordering = None
+        return queryset.search(text)
+
+
+class GenreFilter(filters.BaseFilterBackend):
+    """
+    Фильтрация фильмов и сериалов по жанрам: ?genre=drama&genre=comedy.
+    По умолчанию выбираются записи, у которых есть хотя бы один из жанров (оператор &&),
+    с параметром ?genre_match=all - записи со всеми указанными жанрами (оператор @>).
+    Оба оператора используют GIN-индекс по полю genre.
+    """
+
+    genre_param = 'genre'
+    match_param = 'genre_match'
+
+    def filter_queryset(self, request, queryset, view):
+        genres = [genre for genre in request.query_params.getlist(self.genre_param) if genre]
+        if not genres:
+            return queryset
+
+        if request.query_params.get(self.match_param) == 'all':
+            return queryset.filter(genre__contains=genres)
+        return queryset.filter(genre__overlap=genres)
+
+
+class YearRangeFilter(filters.BaseFilterBackend):
+    """
+    Фильтрация по году выпуска: ?year_min=1990&year_max=1999, границы включаются
+    """
+
+    bounds = {'year_min': 'year__gte', 'year_max': 'year__lte'}
+
+    def filter_queryset(self, request, queryset, view):
+        for param, lookup in self.bounds.items():
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                queryset = queryset.filter(**{lookup: int(value)})
+            except ValueError:
+                raise ValidationError({param: 'Ожидается целое число'})
+        return queryset
+
+
+class FilmTypeFilter(filters.BaseFilterBackend):
+    """
+    Выбор только фильмов (?type=movie) или только сериалов (?type=tv) в записях, ссылающихся на movie или tv
+    """
+
+    type_param = 'type'
+
+    def filter_queryset(self, request, queryset, view):
+        selected = request.query_params.get(self.type_param)
+        if selected in ('movie', 'tv'):
+            return queryset.filter(**{f'{selected}__isnull': False})
+        return queryset
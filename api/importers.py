@@ -0,0 +1,166 @@
+import csv
+import json
+from itertools import islice
+from django.contrib.postgres.fields import ArrayField
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from film_library.api.cache import invalidate_catalog
+
+# Количество строк, которые проверяются и добавляются в БД в одной транзакции
+IMPORT_BATCH_SIZE = 1000
+
+# Разделитель жанров в CSV
+CSV_GENRE_SEPARATOR = ';'
+
+
+def import_fields(model) -> list:
+    """
+    Поля модели Movie или TV, которые можно заполнить при импорте
+    """
+
+    return [
+        field.name for field in model._meta.concrete_fields
+        if field.editable and not field.primary_key and field.name != 'added_by'
+    ]
+
+
+def read_ndjson(lines):
+    """
+    Читает строки NDJSON, по одному объекту на строку.
+    Возвращает тройки (номер строки, данные, ошибки), ошибки заполнены только для некорректных строк.
+    """
+
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, {'row': ['Некорректный JSON']}
+            continue
+        if not isinstance(row, dict):
+            yield number, None, {'row': ['Ожидается объект JSON']}
+            continue
+        yield number, row, None
+
+
+def read_csv(lines):
+    """
+    Читает строки CSV с заголовком. Пустые значения считаются незаполненными,
+    жанры перечисляются через CSV_GENRE_SEPARATOR.
+    Возвращает тройки (номер строки, данные, ошибки).
+    """
+
+    reader = csv.DictReader(lines)
+    for row in reader:
+        values = {key: value if value != '' else None for key, value in row.items() if key}
+        if values.get('genre') is not None:
+            values['genre'] = [genre.strip() for genre in values['genre'].split(CSV_GENRE_SEPARATOR) if genre.strip()]
+        yield reader.line_num, values, None
+
+
+def type_errors(model, data: dict, fields: list) -> dict:
+    """
+    Ошибки типов значений строки, которые не обрабатываются валидаторами модели:
+    строка или число вместо списка жанров, объект или список вместо строки или числа
+    """
+
+    errors = {}
+    for name in fields:
+        value = data.get(name)
+        if value is None:
+            continue
+        if isinstance(model._meta.get_field(name), ArrayField):
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                errors[name] = ['Ожидается список строк']
+        elif not isinstance(value, (str, int, float)):
+            errors[name] = ['Ожидается строка или число']
+    return errors
+
+
+def build_row(model, data: dict, fields: list, added_by) -> tuple:
+    """
+    Объект модели из строки импорта и ошибки строки (None, если строка корректна)
+    """
+
+    errors = type_errors(model, data, fields)
+    if errors:
+        return None, errors
+
+    obj = model(added_by=added_by, **{name: data.get(name) for name in fields})
+    try:
+        obj.full_clean(exclude=['added_by'], validate_unique=False)
+    except ValidationError as error:
+        return None, error.message_dict
+    except (TypeError, ValueError):
+        return None, {'row': ['Некорректные значения полей']}
+    return obj, None
+
+
+def insert_rows(model, rows: list) -> tuple:
+    """
+    Добавляет пачку [(номер строки, объект)] в точке сохранения. Если БД отклонила пачку, строки добавляются
+    по одной, чтобы сохранить корректные и сообщить об ошибочных.
+    Возвращает количество добавленных строк и отчёты об ошибочных строках.
+    """
+
+    try:
+        with transaction.atomic():
+            objs = model.objects.bulk_create([obj for _, obj in rows])
+            model.objects.filter(pk__in=[obj.pk for obj in objs]).refresh_search_vectors()
+        return len(objs), []
+    except (DatabaseError, ValueError) as error:
+        if len(rows) == 1:
+            number, _ = rows[0]
+            message = str(error).strip().split('\n')[0] or type(error).__name__
+            return 0, [{'line': number, 'errors': {'row': [f'Строка не сохранена: {message}']}}]
+
+    created, reports = 0, []
+    for row in rows:
+        row_created, row_reports = insert_rows(model, [row])
+        created += row_created
+        reports += row_reports
+    return created, reports
+
+
+def import_films(model, rows, added_by, batch_size: int = IMPORT_BATCH_SIZE):
+    """
+    Импорт фильмов или сериалов из последовательности строк, полученной из read_ndjson или read_csv.
+    Строки обрабатываются пачками по batch_size: каждая строка проверяется по типам значений и валидаторами
+    модели (диапазон года, длина жанра и т.д.), корректные строки добавляются через bulk_create в точке
+    сохранения. Ошибочная строка, в том числе отклонённая БД, не прерывает импорт остальных.
+    Функция-генератор возвращает по одному отчёту на каждую ошибочную строку и итоговый отчёт в конце,
+    поэтому расход памяти не зависит от размера файла.
+    """
+
+    fields = import_fields(model)
+    rows = iter(rows)
+    created = failed = 0
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+
+        valid = []
+        for number, data, errors in batch:
+            if errors is None:
+                obj, errors = build_row(model, data, fields, added_by)
+                if obj is not None:
+                    valid.append((number, obj))
+
+            if errors:
+                failed += 1
+                yield {'line': number, 'errors': errors}
+
+        if valid:
+            batch_created, reports = insert_rows(model, valid)
+            created += batch_created
+            failed += len(reports)
+            yield from reports
+
+    if created:
+        invalidate_catalog(model._meta.model_name)
+
+    yield {'created': created, 'failed': failed}
@@ -0,0 +1,158 @@
+from datetime import timedelta
+from functools import partial
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.functions import Now
+from film_library.api.models import JOB_PENDING_SQL, RANKING_JOBS, TV, Movie, Job
+from film_library.api.leaderboards import refresh_rankings
+from film_library.api.recommendations import build_neighbours, recommendations_available
+
+# Количество попыток выполнить задание, после которого оно помечается неудавшимся (failed_at)
+JOB_MAX_ATTEMPTS = getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+
+# Задержка перед повторной попыткой в секундах, удваивается с каждой попыткой
+JOB_RETRY_SECONDS = getattr(settings, 'JOB_RETRY_SECONDS', 10)
+
+# Время аренды взятого задания в секундах: если обработчик не завершил задание за это время
+# (например, процесс был остановлен), задание снова может взять любой обработчик
+JOB_LEASE_SECONDS = getattr(settings, 'JOB_LEASE_SECONDS', 300)
+
+# Количество дней, в течение которых неудавшиеся задания хранятся для разбора ошибок, затем удаляются prune_jobs
+JOB_FAILED_RETENTION_DAYS = getattr(settings, 'JOB_FAILED_RETENTION_DAYS', 30)
+
+# Вид задания обновления таблицы соседей для рекомендаций, у него один ключ
+RECOMMENDATIONS_JOB = 'recommendations'
+
+# Задержка обновления таблицы соседей в секундах после изменения оценок: изменения за это время
+# объединяются, и таблица обновляется не чаще одного раза за это время
+RECOMMENDATIONS_DELAY_SECONDS = getattr(settings, 'RECOMMENDATIONS_DELAY_SECONDS', 600)
+
+
+def refresh_film_rankings(model, ids) -> None:
+    """
+    Обработчик заданий пересчёта рейтингов, которые ставятся при изменении списков и оценок:
+    пересчитывает строки таблицы рейтингов и ставит в очередь обновление таблицы соседей
+    """
+
+    refresh_rankings(model, ids)
+    if RECOMMENDATIONS_JOB in JOB_HANDLERS:
+        Job.objects.enqueue(RECOMMENDATIONS_JOB, [RECOMMENDATIONS_JOB], delay=RECOMMENDATIONS_DELAY_SECONDS)
+
+
+def refresh_recommendations(keys) -> None:
+    """
+    Обработчик задания обновления таблицы соседей: пересчитываются только фильмы и сериалы,
+    изменённые после предыдущего построения (см. recommendations.build_neighbours)
+    """
+
+    build_neighbours()
+
+
+# Обработчики заданий по виду задания. Обработчик получает список ключей всех взятых заданий этого вида
+# без повторов и должен быть идемпотентным: задание может быть выполнено повторно после ошибки или аренды
+JOB_HANDLERS = {
+    RANKING_JOBS['movie_id']: partial(refresh_film_rankings, Movie),
+    RANKING_JOBS['tv_id']: partial(refresh_film_rankings, TV),
+}
+
+# Без numpy и scipy таблица соседей не строится, и задания её обновления не ставятся
+if recommendations_available():
+    JOB_HANDLERS[RECOMMENDATIONS_JOB] = refresh_recommendations
+
+
+def claim_jobs(limit: int) -> list:
+    """
+    Берёт до limit заданий, время которых наступило, отдельной короткой транзакцией.
+    Задания, заблокированные другими обработчиками или ещё не зафиксированными транзакциями,
+    пропускаются (FOR UPDATE SKIP LOCKED), поэтому обработчики в разных процессах не ждут друг друга
+    и не берут одни и те же задания. Задание, которое уже брали JOB_MAX_ATTEMPTS раз (аренда последней
+    попытки истекла, например, обработчик каждый раз останавливается на нём), помечается неудавшимся
+    и не возвращается. Возвращает список (id, kind, key, attempts).
+    """
+
+    jobs = Job._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE {jobs} AS jobs
+            SET claimed_at = now(), run_after = now() + make_interval(secs => %(lease)s),
+                attempts = jobs.attempts + (jobs.attempts < %(attempts)s)::int,
+                failed_at = CASE WHEN jobs.attempts >= %(attempts)s THEN now() END,
+                last_error = CASE WHEN jobs.attempts >= %(attempts)s THEN %(error)s ELSE jobs.last_error END
+            FROM (
+                SELECT id FROM {jobs}
+                WHERE failed_at IS NULL AND run_after <= now()
+                ORDER BY run_after, id
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            ) AS due
+            WHERE jobs.id = due.id
+            RETURNING jobs.id, jobs.kind, jobs.key, jobs.attempts, jobs.failed_at IS NULL
+        """, {'lease': JOB_LEASE_SECONDS, 'limit': limit, 'attempts': JOB_MAX_ATTEMPTS,
+              'error': 'Время аренды последней попытки истекло'})
+        return [row[:4] for row in cursor.fetchall() if row[4]]
+
+
+def fail_jobs(ids: list, error: Exception) -> None:
+    """
+    Откладывает задания ids до повторной попытки с экспоненциальной задержкой
+    или помечает неудавшимися, если попытки закончились. Отложенное задание снова становится ожидающим
+    (claimed_at сбрасывается), поэтому задания вставляются заново: если пока задание выполнялось, в очередь
+    встало такое же, ON CONFLICT объединяет их в ожидающее задание, которое выполняется сразу.
+    """
+
+    jobs = Job._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH claimed AS (
+                DELETE FROM {jobs} WHERE id = ANY(%(ids)s)
+                RETURNING kind, key, attempts, created_at
+            )
+            INSERT INTO {jobs} AS job (kind, key, run_after, attempts, last_error, failed_at, created_at)
+            SELECT DISTINCT ON (kind, key)
+                   kind, key, now() + make_interval(secs => %(delay)s * power(2, attempts - 1)), attempts,
+                   %(error)s, CASE WHEN attempts >= %(attempts)s THEN now() END, created_at
+            FROM claimed
+            ORDER BY kind, key, attempts DESC
+            ON CONFLICT (kind, key) WHERE {JOB_PENDING_SQL}
+            DO UPDATE SET attempts = GREATEST(job.attempts, EXCLUDED.attempts), last_error = EXCLUDED.last_error
+        """, {'delay': JOB_RETRY_SECONDS, 'error': f'{type(error).__name__}: {error}',
+              'attempts': JOB_MAX_ATTEMPTS, 'ids': ids})
+
+
+def prune_jobs(days: int = JOB_FAILED_RETENTION_DAYS) -> int:
+    """
+    Удаляет задания, попытки которых закончились больше days дней назад.
+    Возвращает количество удалённых заданий.
+    """
+
+    deleted, _ = Job.objects.filter(failed_at__lt=Now() - timedelta(days=days)).delete()
+    return deleted
+
+
+def run_jobs(limit: int = 100) -> tuple:
+    """
+    Берёт до limit заданий и выполняет их: задания одного вида объединяются, и обработчик вызывается
+    один раз со всеми ключами. Обработчик и удаление выполненных заданий выполняются в одной транзакции,
+    ошибка обработчика откладывает задания этого вида до повторной попытки и не мешает остальным.
+    Возвращает количество выполненных и отложенных заданий.
+    """
+
+    batches = {}
+    for pk, kind, key, _ in claim_jobs(limit):
+        ids, keys = batches.setdefault(kind, ([], {}))
+        ids.append(pk)
+        keys[key] = None
+
+    done = failed = 0
+    for kind, (ids, keys) in batches.items():
+        try:
+            with transaction.atomic():
+                if kind not in JOB_HANDLERS:
+                    raise LookupError(f'Неизвестный вид задания {kind}')
+                JOB_HANDLERS[kind](list(keys))
+                Job.objects.filter(pk__in=ids).delete()
+            done += len(ids)
+        except Exception as error:
+            fail_jobs(ids, error)
+            failed += len(ids)
+    return done, failed
@@ -0,0 +1,97 @@
+from django.db import connection, transaction
+from film_library.api.models import LEADERBOARD_MIN_VOTES, TV, Movie, FilmRanking, FilmsToWatch, FilmsWatched
+from film_library.api.cache import invalidate_responses
+
+# LEADERBOARD_MIN_VOTES (минимальное количество оценок для попадания в лидерборд по оценке) используется и
+# как вес средней оценки по всем фильмам в байесовской средней: (C * m + сумма оценок) / (C + количество оценок)
+
+# Лидерборды: порядок записей и условие попадания в лидерборд
+BOARDS = {
+    'top-rated': (('-bayesian_rating', 'id'), {'votes__gte': LEADERBOARD_MIN_VOTES}),
+    'most-watched': (('-watched_count', 'id'), {'watched_count__gt': 0}),
+    'most-wanted': (('-to_watch_count', 'id'), {'to_watch_count__gt': 0}),
+}
+
+RANKING_COLUMNS = ['year', 'genre', 'votes', 'rating', 'bayesian_rating', 'watched_count', 'to_watch_count']
+
+
+def mean_score() -> float:
+    """
+    Средняя оценка по всем фильмам и сериалам, по суммам и количествам оценок в записях Movie и TV
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT COALESCE(SUM(score_sum) / NULLIF(SUM(score_count), 0), 0)::float8 FROM ('
+            f'SELECT score_sum, score_count FROM {Movie._meta.db_table} UNION ALL '
+            f'SELECT score_sum, score_count FROM {TV._meta.db_table}) AS films'
+        )
+        return cursor.fetchone()[0]
+
+
+def refresh_sql(model, only_ids: bool = False) -> str:
+    """
+    Один INSERT ... ON CONFLICT DO UPDATE, который пересчитывает рейтинги всех фильмов или сериалов model
+    (при only_ids=True - только с id из параметра %(ids)s).
+    Оценки берутся из score_sum и score_count, количество записей в списках - группировкой по внешнему ключу.
+    Записи, показатели которых не изменились, не перезаписываются.
+    """
+
+    column = f'{model._meta.model_name}_id'
+    subset = f'AND {column} = ANY(%(ids)s::bigint[])' if only_ids else ''
+    films = 'WHERE films.id = ANY(%(ids)s::bigint[])' if only_ids else ''
+    ranking = FilmRanking._meta.db_table
+    updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in RANKING_COLUMNS + ['refreshed_at'])
+    current = ', '.join(f'ranking.{name}' for name in RANKING_COLUMNS)
+    excluded = ', '.join(f'EXCLUDED.{name}' for name in RANKING_COLUMNS)
+    return f"""
+        INSERT INTO {ranking} AS ranking ({column}, {', '.join(RANKING_COLUMNS)}, refreshed_at)
+        SELECT films.id, films.year, films.genre, films.score_count,
+               (films.score_sum / NULLIF(films.score_count, 0))::float8,
+               ((%(prior)s * %(mean)s + films.score_sum) / (%(prior)s + films.score_count))::float8,
+               COALESCE(watched.total, 0), COALESCE(wanted.total, 0), now()
+        FROM {model._meta.db_table} AS films
+        LEFT JOIN (
+            SELECT {column}, COUNT(*) AS total FROM {FilmsWatched._meta.db_table}
+            WHERE {column} IS NOT NULL {subset} GROUP BY {column}
+        ) AS watched ON watched.{column} = films.id
+        LEFT JOIN (
+            SELECT {column}, COUNT(*) AS total FROM {FilmsToWatch._meta.db_table}
+            WHERE {column} IS NOT NULL {subset} GROUP BY {column}
+        ) AS wanted ON wanted.{column} = films.id
+        {films}
+        ON CONFLICT ({column}) DO UPDATE SET {updates}
+        WHERE ({current}) IS DISTINCT FROM ({excluded})
+    """
+
+
+def refresh_leaderboards() -> int:
+    """
+    Пересчёт таблицы FilmRanking для всех фильмов и сериалов двумя запросами в одной транзакции.
+    Удалённые фильмы и сериалы удаляются из таблицы каскадно. Возвращает количество изменённых записей.
+    """
+
+    params = {'prior': LEADERBOARD_MIN_VOTES, 'mean': mean_score()}
+    changed = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in (Movie, TV):
+            cursor.execute(refresh_sql(model), params)
+            changed += cursor.rowcount
+        invalidate_responses('leaderboard')
+    return changed
+
+
+def refresh_rankings(model, ids) -> int:
+    """
+    Пересчёт строк таблицы FilmRanking для фильмов или сериалов model с указанными id,
+    обработчик заданий очереди, которые ставятся при изменении списков. Средняя оценка по всем фильмам
+    берётся текущая, поэтому байесовская оценка остальных записей уточняется полным пересчётом refresh_leaderboards.
+    Возвращает количество изменённых записей.
+    """
+
+    params = {'prior': LEADERBOARD_MIN_VOTES, 'mean': mean_score(), 'ids': [int(pk) for pk in ids]}
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(refresh_sql(model, only_ids=True), params)
+        if cursor.rowcount:
+            invalidate_responses('leaderboard')
+        return cursor.rowcount
@@ -0,0 +1,97 @@
+import json
+import platform
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from film_library.api.benchmark import compare, run_benchmark, seed_dataset, serialization_cost
+
+
+class Command(BaseCommand):
+    """
+    Команда для замера времени ответа и количества SQL-запросов всех маршрутов API.
+    Создаёт тестовую БД так же, как тестовый раннер (реплики с TEST MIRROR подключаются к ней же),
+    заполняет её синтетическим набором данных, выполняет запросы через тестовый клиент
+    и сохраняет отчёт в JSON. Если указан базовый отчёт, при регрессии команда завершается с ошибкой.
+    """
+
+    help = 'Замеряет p50/p95 времени ответа, количество и время SQL-запросов для всех маршрутов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=2000)
+        parser.add_argument('--tv', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--watched', type=int, default=50,
+                            help='среднее количество записей в списке просмотренного на пользователя')
+        parser.add_argument('--to-watch', type=int, default=20,
+                            help='среднее количество записей в списке желаемого на пользователя')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--only', nargs='*', help='имена замеряемых запросов')
+        parser.add_argument('--cache', action='store_true', help='не отключать кэш ответов')
+        parser.add_argument('--keepdb', action='store_true', help='не удалять тестовую БД')
+        parser.add_argument('--serialization-rows', type=int, default=1000,
+                            help='количество записей для замера процессорного времени сериализации, 0 - не замерять')
+        parser.add_argument('--report', default='benchmark.json', help='путь к файлу отчёта')
+        parser.add_argument('--baseline', help='путь к базовому отчёту для сравнения')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='допустимый рост p95, доля базового значения')
+        parser.add_argument('--min-delta', type=float, default=2.0, help='допустимый рост p95 в мс')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f'Не удалось прочитать базовый отчёт: {error}')
+
+        dataset = {name: options[name] for name in ('movies', 'tv', 'users', 'watched', 'to_watch', 'seed')}
+        caches = None if options['cache'] else {
+            'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+        }
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'], serialized_aliases=set())
+        try:
+            with override_settings(**({'CACHES': caches} if caches else {})):
+                user = seed_dataset(**dataset)
+                endpoints = run_benchmark(user, options['iterations'], options['warmup'], options['only'])
+                rows = options['serialization_rows']
+                serialization = serialization_cost(rows) if rows else {}
+        finally:
+            # Соединения реплик подключены к той же тестовой БД, их нужно закрыть до её удаления
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        report = {
+            'dataset': dataset,
+            'iterations': options['iterations'],
+            'python': platform.python_version(),
+            'endpoints': endpoints,
+            'serialization': serialization,
+        }
+        with open(options['report'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+        for name, result in endpoints.items():
+            self.stdout.write(
+                f'{name:24} {result["method"]:4} {result["status"]} '
+                f'p50 {result["p50_ms"]:8.2f} мс  p95 {result["p95_ms"]:8.2f} мс  '
+                f'SQL {result["queries"]:3} / {result["sql_ms"]:7.2f} мс'
+            )
+
+        for name, result in serialization.items():
+            self.stdout.write(
+                f'{name:24} сериализация {result["rows"]} записей: DRF {result["drf_us_per_row"]:7.2f} мкс/запись, '
+                f'быстрый путь {result["fast_us_per_row"]:7.2f} мкс/запись (x{result["speedup"]})'
+            )
+
+        if baseline is not None:
+            regressions = compare(report, baseline, options['tolerance'], options['min_delta'])
+            if regressions:
+                raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from film_library.api.recommendations import build_neighbours
+
+
+class Command(BaseCommand):
+    """
+    Команда для построения таблицы похожих фильмов и сериалов, по которой выдаются рекомендации.
+    Без --full пересчитываются только фильмы и сериалы, оценки которых изменились после предыдущего построения,
+    команду можно запускать по расписанию.
+    """
+
+    help = 'Строит таблицу похожих фильмов и сериалов по оценкам пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='пересчитать всех соседей')
+
+    def handle(self, *args, **options):
+        build = build_neighbours(full=options['full'])
+        kind = 'Полное построение' if build.full else 'Обновление'
+        self.stdout.write(self.style.SUCCESS(
+            f'{kind}: пересчитано фильмов и сериалов - {build.items}, записано соседей - {build.neighbours}, '
+            f'{(build.finished_at - build.started_at).total_seconds():.1f} с'
+        ))
@@ -0,0 +1,42 @@
+import json
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from film_library.api.models import TV, Movie
+from film_library.api.importers import IMPORT_BATCH_SIZE, import_films, read_csv, read_ndjson
+
+
+class Command(BaseCommand):
+    """
+    Команда для массового импорта фильмов или сериалов из файла NDJSON или CSV.
+    """
+
+    help = 'Импортирует фильмы или сериалы из файла NDJSON или CSV'
+
+    models = {'movie': Movie, 'tv': TV}
+
+    def add_arguments(self, parser):
+        parser.add_argument('type', choices=self.models.keys(), help='movie или tv')
+        parser.add_argument('path', help='путь к файлу')
+        parser.add_argument('--user', required=True, help='имя пользователя, от имени которого добавляются записи')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help='формат файла, по умолчанию по расширению')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'Пользователь {options["user"]} не найден')
+
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'ndjson')
+        reader = read_csv if file_format == 'csv' else read_ndjson
+
+        with open(options['path'], encoding='utf-8', newline='') as file:
+            reports = import_films(
+                self.models[options['type']], reader(file), added_by=user, batch_size=options['batch_size']
+            )
+            for report in reports:
+                line = json.dumps(report, ensure_ascii=False)
+                if 'line' in report:
+                    self.stderr.write(line)
+                else:
+                    self.stdout.write(self.style.SUCCESS(line))
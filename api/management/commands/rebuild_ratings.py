@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from film_library.api.models import TV, Movie, refresh_user_stats
+from film_library.api.cache import invalidate_catalog
+
+
+class Command(BaseCommand):
+    """
+    Команда для полного пересчёта рейтинга, гистограммы оценок и количества отзывов фильмов и сериалов
+    по таблице FilmsWatched и счётчиков пользователей по таблицам FilmsWatched и FilmsToWatch.
+    """
+
+    help = ('Пересчитывает сумму, количество и гистограмму оценок и количество отзывов для всех фильмов и сериалов '
+            'и счётчики списков всех пользователей')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            movies = Movie.objects.all().refresh_ratings()
+            tv = TV.objects.all().refresh_ratings()
+            invalidate_catalog('movie')
+            invalidate_catalog('tv')
+            users = refresh_user_stats()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитан рейтинг: фильмов - {movies}, сериалов - {tv}; счётчики пользователей - {users}'
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from film_library.api.models import TV, Movie
+from film_library.api.cache import invalidate_catalog
+
+
+class Command(BaseCommand):
+    """
+    Команда для заполнения поля search_vector у всех фильмов и сериалов.
+    """
+
+    help = 'Пересчитывает векторы полнотекстового поиска для всех фильмов и сериалов'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            movies = Movie.objects.all().refresh_search_vectors()
+            tv = TV.objects.all().refresh_search_vectors()
+            invalidate_catalog('movie')
+            invalidate_catalog('tv')
+
+        self.stdout.write(self.style.SUCCESS(f'Пересчитаны векторы поиска: фильмов - {movies}, сериалов - {tv}'))
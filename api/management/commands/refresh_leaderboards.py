@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from film_library.api.leaderboards import refresh_leaderboards
+
+
+class Command(BaseCommand):
+    """
+    Команда для обновления таблицы рейтингов, из которой читаются лидерборды. Запускается по расписанию.
+    """
+
+    help = 'Пересчитывает байесовскую оценку, количество просмотревших и желающих посмотреть для лидербордов'
+
+    def handle(self, *args, **options):
+        changed = refresh_leaderboards()
+        self.stdout.write(self.style.SUCCESS(f'Обновлено записей в таблице рейтингов: {changed}'))
@@ -0,0 +1,47 @@
+import time
+from django.core.management.base import BaseCommand
+from film_library.api.jobs import JOB_FAILED_RETENTION_DAYS, prune_jobs, run_jobs
+
+
+class Command(BaseCommand):
+    """
+    Обработчик очереди фоновых заданий Job. Можно запускать несколько процессов одновременно,
+    каждый берёт свои задания. Без --once работает постоянно и проверяет очередь каждые --interval секунд,
+    пока она пуста. Когда очередь пуста, но не чаще раза в prune_interval секунд, удаляет задания,
+    попытки которых закончились больше --prune-days дней назад.
+    """
+
+    help = 'Выполняет фоновые задания из очереди в БД'
+
+    prune_interval = 3600
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='количество заданий, которые берутся за раз')
+        parser.add_argument('--interval', type=float, default=1.0, help='пауза в секундах, если очередь пуста')
+        parser.add_argument('--once', action='store_true', help='выполнить доступные задания и завершиться')
+        parser.add_argument('--prune-days', type=int, default=JOB_FAILED_RETENTION_DAYS,
+                            help='сколько дней хранить неудавшиеся задания')
+
+    def handle(self, *args, **options):
+        total_done = total_failed = 0
+        pruned_at = None
+        while True:
+            done, failed = run_jobs(options['batch_size'])
+            total_done += done
+            total_failed += failed
+            if failed:
+                self.stderr.write(f'Отложено до повторной попытки заданий: {failed}')
+            if done or failed:
+                continue
+            if pruned_at is None or time.monotonic() - pruned_at >= self.prune_interval:
+                pruned_at = time.monotonic()
+                pruned = prune_jobs(options['prune_days'])
+                if pruned:
+                    self.stdout.write(f'Удалено неудавшихся заданий: {pruned}')
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Выполнено заданий: {total_done}, отложено после ошибки: {total_failed}'
+        ))
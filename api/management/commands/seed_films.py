@@ -0,0 +1,35 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from film_library.api.seeding import seed_database
+
+
+class Command(BaseCommand):
+    """
+    Команда для заполнения БД большим синтетическим набором данных через COPY.
+    """
+
+    help = 'Заполняет БД детерминированным синтетическим набором пользователей, фильмов, сериалов и списков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--movies', type=int, default=50000)
+        parser.add_argument('--tv', type=int, default=20000)
+        parser.add_argument('--watched', type=int, default=100, help='среднее количество просмотренных на пользователя')
+        parser.add_argument('--to-watch', type=int, default=20, help='среднее количество желаемых на пользователя')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep-indexes', action='store_true', help='не удалять индексы на время загрузки')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь')
+        if min(options['movies'], options['tv'], options['watched'], options['to_watch']) < 0:
+            raise CommandError('Размеры набора данных не могут быть отрицательными')
+
+        started = time.perf_counter()
+        counts = seed_database(
+            users=options['users'], movies=options['movies'], tv=options['tv'], watched=options['watched'],
+            to_watch=options['to_watch'], seed=options['seed'], drop_indexes=not options['keep_indexes'],
+        )
+        counts['seconds'] = round(time.perf_counter() - started, 1)
+        self.stdout.write(self.style.SUCCESS(json.dumps(counts)))
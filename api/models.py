@@ -1,7 +1,129 @@
-from django.db import models
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection, connections, models, router, transaction
+from django.db.models import F, Sum, Count, Value, Subquery, OuterRef
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Now
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorField, TrigramSimilarity
 from django.core.validators import MaxValueValidator, MinValueValidator
 from rest_framework.serializers import ValidationError
+from film_library.api.cache import invalidate_films
+
+
+# Конфигурация полнотекстового поиска. Названия бывают на разных языках, поэтому используется
+# конфигурация без стемминга, опечатки и словоформы покрываются поиском по триграммам.
+SEARCH_CONFIG = 'simple'
+
+# Количество интервалов гистограммы оценок: оценки от 0 до 10 с шагом 0.1
+SCORE_BUCKETS = 101
+
+# Счётчики записи UserStats
+USER_STATS_COUNTERS = ['movies_watched', 'tv_watched', 'score_sum', 'score_count', 'movies_to_watch', 'tv_to_watch']
+
+# Минимальное количество оценок для попадания в лидерборд по оценке. Значение входит в условие
+# частичного индекса FilmRanking, поэтому после изменения настройки нужна новая миграция
+LEADERBOARD_MIN_VOTES = getattr(settings, 'LEADERBOARD_MIN_VOTES', 10)
+
+# Виды заданий очереди Job, пересчитывающих строки таблицы рейтингов FilmRanking, по столбцу внешнего ключа.
+# Ключ задания - id фильма или сериала
+RANKING_JOBS = {'movie_id': 'ranking:movie', 'tv_id': 'ranking:tv'}
+
+# Условие ожидающего задания Job: ещё не взято обработчиком и не помечено неудавшимся
+JOB_PENDING_SQL = 'claimed_at IS NULL AND failed_at IS NULL'
+
+
+def histogram_sql(films: str, column: str) -> str:
+    """
+    SQL-выражение: гистограмма оценок записи таблицы films по FilmsWatched,
+    column - столбец внешнего ключа FilmsWatched на эту таблицу
+    """
+
+    return (
+        f'(SELECT array_agg(COALESCE(counts.total, 0) ORDER BY buckets.bucket) '
+        f'FROM generate_series(0, {SCORE_BUCKETS - 1}) AS buckets(bucket) LEFT JOIN ('
+        f'SELECT (score * 10)::int AS bucket, COUNT(*) AS total FROM {FilmsWatched._meta.db_table} '
+        f'WHERE {column} = {films}.id AND score IS NOT NULL GROUP BY 1'
+        f') AS counts ON counts.bucket = buckets.bucket)'
+    )
+
+
+def histogram_delta_sql(histogram: str, deltas: str) -> str:
+    """
+    SQL-выражение: гистограмма histogram, к интервалам которой прибавлены изменения из подзапроса deltas
+    со столбцами bucket (номер интервала, оценка * 10) и delta, не больше одной строки на интервал.
+    Пустая гистограмма (NULL) считается нулевой.
+    """
+
+    return (
+        f'(SELECT array_agg(counts.total + COALESCE(changes.delta, 0) ORDER BY counts.position) '
+        f'FROM unnest(COALESCE({histogram}, array_fill(0, ARRAY[{SCORE_BUCKETS}]))) '
+        f'WITH ORDINALITY AS counts(total, position) '
+        f'LEFT JOIN ({deltas}) AS changes ON changes.bucket = counts.position - 1)'
+    )
+
+
+class FilmsQuerySet(models.QuerySet):
+    """
+    QuerySet для моделей Movie и TV
+    """
+
+    def search(self, text: str):
+        """
+        Поиск по названию: полнотекстовый по search_vector или по сходству триграмм с title.
+        Оба условия проверяются по GIN-индексам, результаты упорядочены по релевантности.
+        """
+
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+        return self.filter(
+            models.Q(search_vector=query) | models.Q(title__trigram_similar=text)
+        ).annotate(
+            rank=SearchRank(F('search_vector'), query),
+            similarity=TrigramSimilarity('title', text),
+        ).order_by('-rank', '-similarity', 'title', 'id')
+
+    def refresh_search_vectors(self) -> int:
+        """
+        Пересчитывает поле search_vector для всех записей queryset
+        """
+
+        return self.update(search_vector=SearchVector('title', config=SEARCH_CONFIG))
+
+    def refresh_ratings(self) -> int:
+        """
+        Пересчитывает сумму и количество оценок, гистограмму оценок и количество отзывов
+        для всех записей queryset по таблице FilmsWatched одним UPDATE-запросом.
+        Возвращает количество обновлённых записей.
+        """
+
+        field = self.model._meta.model_name
+        scores = FilmsWatched.objects.filter(
+            **{field: OuterRef('pk')}, score__isnull=False
+        ).order_by().values(field)
+        reviews = FilmsWatched.objects.filter(
+            **{field: OuterRef('pk')}, review__gt=''
+        ).order_by().values(field)
+
+        return self.update(
+            score_sum=Coalesce(
+                Subquery(scores.annotate(total=Sum('score')).values('total')),
+                Value(Decimal(0))
+            ),
+            score_count=Coalesce(
+                Subquery(scores.annotate(total=Count('pk')).values('total')),
+                Value(0)
+            ),
+            score_histogram=RawSQL(
+                histogram_sql(self.model._meta.db_table, f'{field}_id'), [],
+                output_field=self.model._meta.get_field('score_histogram')
+            ),
+            review_count=Coalesce(
+                Subquery(reviews.annotate(total=Count('pk')).values('total')),
+                Value(0)
+            ),
+            updated_at=Now(),
+        )
 
 
 class Films(models.Model):
@@ -9,8 +131,15 @@ class Films(models.Model):
     Абстрактный класс для моделей Movie и TV
     title - название фильма или сериала
     year - год выпуска
-    rating - оценка
     genre - жанры
+    score_sum - сумма оценок пользователей из FilmsWatched
+    score_count - количество оценок пользователей из FilmsWatched
+    score_histogram - количество оценок 0.0, 0.1, ..., 10.0 (SCORE_BUCKETS элементов), NULL если оценок не было
+    review_count - количество непустых отзывов пользователей из FilmsWatched
+    search_vector - tsvector названия для полнотекстового поиска
+    updated_at - время последнего изменения записи, включая изменение рейтинга
+    Поля score_sum, score_count, score_histogram и review_count поддерживаются в актуальном состоянии
+    при изменении FilmsWatched, из них вычисляются оценка rating и медиана оценок score_median.
     """
 
     title = models.CharField(max_length=200)
@@ -25,13 +154,82 @@ class Films(models.Model):
         blank=True,
         null=True
     )
+    score_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0, editable=False)
+    score_count = models.PositiveIntegerField(default=0, editable=False)
+    score_histogram = ArrayField(
+        models.PositiveIntegerField(), size=SCORE_BUCKETS, blank=True, null=True, editable=False
+    )
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = FilmsQuerySet.as_manager()
+
+    @property
+    def rating(self):
+        """
+        Средняя оценка пользователей, None если оценок нет
+        """
+
+        if self.score_count:
+            return self.score_sum / self.score_count
+        return None
+
+    @property
+    def score_median(self):
+        """
+        Медиана оценок по гистограмме, None если оценок нет
+        """
+
+        histogram = self.score_histogram or []
+        total = sum(histogram)
+        if not total:
+            return None
+
+        middle, seen = [], 0
+        positions = [(total - 1) // 2, total // 2]
+        for bucket, count in enumerate(histogram):
+            while positions and positions[0] < seen + count:
+                middle.append(Decimal(bucket) / 10)
+                positions.pop(0)
+            seen += count
+        return sum(middle) / 2
+
+    def save(self, *args, **kwargs):
+        """
+        При изменении существующей записи поля score_sum и score_count не перезаписываются,
+        чтобы не затереть оценки, добавленные параллельно с редактированием.
+        После сохранения пересчитывается search_vector и ставится в очередь пересчёт строки таблицы рейтингов
+        (в ней хранятся копии года и жанров).
+        """
+
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in ('score_sum', 'score_count', 'score_histogram', 'review_count', 'search_vector')
+                and field.attname not in deferred
+            ]
+        using = kwargs['using'] = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super(Films, self).save(*args, **kwargs)
+            type(self).objects.db_manager(using).filter(pk=self.pk).refresh_search_vectors()
+            Job.objects.db_manager(using).enqueue(RANKING_JOBS[f'{self._meta.model_name}_id'], [self.pk])
 
     def __str__(self) -> str:
         return f'{self.pk}, {self.title}'
 
     class Meta:
         abstract = True
-        ordering = ['title']
+        ordering = ['title', 'id']
+        indexes = [
+            models.Index(fields=['title', 'id'], name='%(class)s_title_id_idx'),
+            GinIndex(fields=['search_vector'], name='%(class)s_search_vector_idx'),
+            GinIndex(fields=['title'], name='%(class)s_title_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['genre'], name='%(class)s_genre_idx'),
+            models.Index(fields=['updated_at'], name='%(class)s_updated_at_idx'),
+        ]
 
 
 class TV(Films):
@@ -70,12 +268,14 @@ class FilmsWatchedAndFilmsToWatchAbstractClass(models.Model):
     user - пользователь, который добавил запись в БД, внешний ключ
     tv - сериал, который был добавлен в список, внешний ключ
     movie - фильм, который был добавлен в список, внешний ключ
+    updated_at - время последнего изменения записи
     Одновременно запись может содержать не пустое поле либо фильма, либо сериала.
     """
 
-    user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
-    tv = models.ForeignKey(TV, null=True, blank=True, on_delete=models.CASCADE)
-    movie = models.ForeignKey(Movie, null=True, blank=True, on_delete=models.CASCADE)
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, db_index=False)
+    tv = models.ForeignKey(TV, null=True, blank=True, on_delete=models.CASCADE, db_index=False)
+    movie = models.ForeignKey(Movie, null=True, blank=True, on_delete=models.CASCADE, db_index=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def is_movie(self) -> bool:
         """
@@ -97,6 +297,20 @@ class FilmsWatchedAndFilmsToWatchAbstractClass(models.Model):
         else:
             return False
 
+    def delete(self, using=None, keep_parents=False):
+        """
+        Запись удаляется через QuerySet.delete модели, который обновляет производные данные тем же запросом
+        """
+
+        if self.pk is None:
+            raise ValueError(
+                f"{self._meta.object_name} object can't be deleted because its id attribute is set to None."
+            )
+        using = using or router.db_for_write(type(self), instance=self)
+        deleted = type(self).objects.db_manager(using).filter(pk=self.pk).delete()
+        self.pk = None
+        return deleted
+
     def __str__(self) -> str:
         if self.tv is not None:
             return f'{self.user}, {self.tv}'
@@ -105,8 +319,536 @@ class FilmsWatchedAndFilmsToWatchAbstractClass(models.Model):
 
     class Meta:
         abstract = True
-        ordering = ['user']
+        ordering = ['user', 'id']
         unique_together = [['user', 'tv'], ['user', 'movie']]
+        # Отдельные индексы внешних ключей не создаются: запросы по пользователю покрываются индексами ниже
+        # и индексами ограничений уникальности, по фильму и сериалу - частичными индексами моделей-наследников.
+        # Списки пользователя (все записи, только фильмы, только сериалы) читаются проходом по индексу (user, id),
+        # updated_at включён в индексы: он читается вместе с ключами записей страницы для ETag.
+        indexes = [
+            models.Index(fields=['user', 'id'], include=['updated_at'], name='%(class)s_user_id_idx'),
+            models.Index(fields=['user', 'id'], include=['updated_at'], condition=models.Q(movie__isnull=False),
+                         name='%(class)s_user_movie_idx'),
+            models.Index(fields=['user', 'id'], include=['updated_at'], condition=models.Q(tv__isnull=False),
+                         name='%(class)s_user_tv_idx'),
+        ]
+
+
+def genre_counts(*querysets) -> list:
+    """
+    Количество фильмов и сериалов по каждому жанру для объединения querysets
+    одним запросом с unnest и GROUP BY.
+    Возвращает список пар (жанр, количество), упорядоченный по убыванию количества.
+    """
+
+    parts, params = [], []
+    for queryset in querysets:
+        sql, queryset_params = queryset.order_by().values('genre').query.sql_with_params()
+        parts.append(f'SELECT unnest(films.genre) AS genre FROM ({sql}) AS films')
+        params.extend(queryset_params)
+
+    with connections[querysets[0].db].cursor() as cursor:
+        cursor.execute(
+            f'SELECT genre, COUNT(*) FROM ({" UNION ALL ".join(parts)}) AS genres '
+            f'GROUP BY genre ORDER BY COUNT(*) DESC, genre',
+            params
+        )
+        return cursor.fetchall()
+
+
+def update_rating(tv_id, movie_id, score, review, sign: int, using=None) -> None:
+    """
+    Атомарно добавляет (sign=1) или вычитает (sign=-1) оценку score из суммы и количества оценок
+    и из гистограммы оценок сериала tv_id или фильма movie_id, а непустой отзыв review - из количества отзывов.
+    Записи без оценки и отзыва на рейтинг не влияют. using - алиас БД (по умолчанию выбирает роутер).
+    """
+
+    if score is None and not review:
+        return
+
+    model, pk = (TV, tv_id) if tv_id is not None else (Movie, movie_id)
+    if pk is None:
+        return
+
+    changes = {
+        'review_count': F('review_count') + (sign if review else 0),
+        'updated_at': Now(),
+    }
+    if score is not None:
+        score = Decimal(str(score))
+        changes.update(
+            score_sum=F('score_sum') + sign * score,
+            score_count=F('score_count') + sign,
+            score_histogram=RawSQL(
+                histogram_delta_sql(f'{model._meta.db_table}.score_histogram', 'SELECT %s AS bucket, %s AS delta'),
+                [int(score * 10), sign], output_field=model._meta.get_field('score_histogram')
+            ),
+        )
+    model.objects.db_manager(using).filter(pk=pk).update(**changes)
+    invalidate_films(model._meta.model_name, pk)
+
+
+def refresh_ratings(tv_ids, movie_ids) -> None:
+    """
+    Пересчитывает рейтинг указанных сериалов и фильмов по таблице FilmsWatched
+    и ставит в очередь пересчёт их строк таблицы рейтингов
+    """
+
+    if tv_ids:
+        TV.objects.filter(pk__in=tv_ids).refresh_ratings()
+        invalidate_films('tv', *tv_ids)
+    if movie_ids:
+        Movie.objects.filter(pk__in=movie_ids).refresh_ratings()
+        invalidate_films('movie', *movie_ids)
+    enqueue_rankings(tv_ids, movie_ids)
+
+
+def stats_counters(column: str) -> tuple:
+    """
+    Счётчики UserStats для списков просмотренного и желаемого к просмотру
+    по имени столбца внешнего ключа на фильм (movie_id) или сериал (tv_id)
+    """
+
+    return ('movies_watched', 'movies_to_watch') if column == 'movie_id' else ('tv_watched', 'tv_to_watch')
+
+
+def user_stats_sql(column: str, watched: str = '0', to_watch: str = '0', score_sum: str = '0',
+                   score_count: str = '0') -> str:
+    """
+    SQL, который атомарно прибавляет к счётчикам пользователя %(user)s значения SQL-выражений:
+    watched и to_watch - к количеству фильмов (column='movie_id') или сериалов в списках,
+    score_sum и score_count - к сумме и количеству оценок. Запись UserStats создаётся при первом изменении.
+    """
+
+    watched_field, to_watch_field = stats_counters(column)
+    values = dict.fromkeys(USER_STATS_COUNTERS, '0')
+    values.update({watched_field: watched, to_watch_field: to_watch, 'score_sum': score_sum,
+                   'score_count': score_count})
+    updates = ', '.join(f'{name} = stats.{name} + EXCLUDED.{name}' for name in USER_STATS_COUNTERS)
+    return f"""
+        INSERT INTO {UserStats._meta.db_table} AS stats (user_id, {', '.join(values)}, updated_at)
+        VALUES (%(user)s, {', '.join(values.values())}, now())
+        ON CONFLICT (user_id) DO UPDATE SET {updates}, updated_at = EXCLUDED.updated_at
+    """
+
+
+def update_user_stats(user_id, tv_id, movie_id, sign: int, watched: bool = True, score=None, using=None) -> None:
+    """
+    Атомарно добавляет (sign=1) или вычитает (sign=-1) запись списка просмотренного (watched=True) с оценкой score
+    или списка желаемого к просмотру из счётчиков пользователя. Запись UserStats не создаётся.
+    using - алиас БД (по умолчанию выбирает роутер).
+    """
+
+    if tv_id is None and movie_id is None:
+        return
+
+    watched_field, to_watch_field = stats_counters('tv_id' if tv_id is not None else 'movie_id')
+    field = watched_field if watched else to_watch_field
+    changes = {field: F(field) + sign, 'updated_at': Now()}
+    if score is not None:
+        changes.update(score_sum=F('score_sum') + sign * Decimal(str(score)), score_count=F('score_count') + sign)
+    UserStats.objects.db_manager(using).filter(user_id=user_id).update(**changes)
+
+
+def refresh_user_stats(user_ids=None) -> int:
+    """
+    Пересчитывает счётчики пользователей user_ids (всех, если не указаны) по таблицам FilmsWatched
+    и FilmsToWatch одним INSERT ... ON CONFLICT DO UPDATE. Возвращает количество записей.
+    """
+
+    condition = 'WHERE user_id = ANY(%(users)s)' if user_ids is not None else ''
+    users = 'WHERE users.id = ANY(%(users)s)' if user_ids is not None else ''
+    updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in USER_STATS_COUNTERS)
+    sql = f"""
+        INSERT INTO {UserStats._meta.db_table} AS stats (user_id, {', '.join(USER_STATS_COUNTERS)}, updated_at)
+        SELECT users.id, COALESCE(watched.movies, 0), COALESCE(watched.tv, 0),
+               COALESCE(watched.score_sum, 0), COALESCE(watched.score_count, 0),
+               COALESCE(wanted.movies, 0), COALESCE(wanted.tv, 0), now()
+        FROM {UserStats._meta.get_field('user').related_model._meta.db_table} AS users
+        LEFT JOIN (
+            SELECT user_id, COUNT(movie_id) AS movies, COUNT(tv_id) AS tv,
+                   SUM(score) AS score_sum, COUNT(score) AS score_count
+            FROM {FilmsWatched._meta.db_table} {condition} GROUP BY user_id
+        ) AS watched ON watched.user_id = users.id
+        LEFT JOIN (
+            SELECT user_id, COUNT(movie_id) AS movies, COUNT(tv_id) AS tv
+            FROM {FilmsToWatch._meta.db_table} {condition} GROUP BY user_id
+        ) AS wanted ON wanted.user_id = users.id
+        {users}
+        ON CONFLICT (user_id) DO UPDATE SET {updates}, updated_at = EXCLUDED.updated_at
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'users': list(user_ids) if user_ids is not None else None})
+        return cursor.rowcount
+
+
+def lock_films_sql(user_id, column: str, ids) -> tuple:
+    """
+    SQL, который берёт транзакционные advisory-блокировки на пары (пользователь, фильм или сериал).
+    Все операции, переносящие запись между списками просмотренного и желаемого к просмотру,
+    берут одни и те же блокировки, поэтому параллельные запросы по одной паре выполняются по очереди.
+    Ключи сортируются, чтобы пакетные операции не блокировали друг друга взаимно.
+    Следующий за блокировкой запрос получает новый снимок данных и видит изменения предыдущего владельца блокировки.
+    """
+
+    keys = sorted(f'{user_id}:{column}:{film_id}' for film_id in ids)
+    return 'SELECT pg_advisory_xact_lock(hashtextextended(key, 0)) FROM unnest(%(locks)s::text[]) AS key;', keys
+
+
+def enqueue_sql(kind: str, keys: str, run_after: str = 'now()') -> str:
+    """
+    SQL, который ставит в очередь Job задания вида kind с ключами keys (SQL-выражения типа text и text[]),
+    которые можно взять после run_after, в той же транзакции, что и изменение данных.
+    Задание с тем же ключом, ещё не взятое обработчиком, не дублируется и при параллельных транзакциях:
+    уникальный индекс ожидающих заданий (job_pending_uniq) превращает вставку в обновление этого задания
+    (ON CONFLICT DO UPDATE), и оно выполняется в наименьшее из двух времён: если оно отложено после ошибки,
+    оно снова выполняется сразу.
+    Обновлённое задание заблокировано, поэтому обработчик пропустит его до фиксации транзакции
+    и увидит её изменения. Уже взятые обработчиком и неудавшиеся задания не учитываются, для них добавляется новое.
+    Ключи вставляются по порядку, чтобы транзакции с пересекающимися ключами не блокировали друг друга взаимно.
+    """
+
+    return f"""
+        INSERT INTO {Job._meta.db_table} AS job (kind, key, run_after, attempts, last_error, created_at)
+        SELECT {kind}, item.key, {run_after}, 0, '', now()
+        FROM (SELECT DISTINCT unnest({keys}) AS key) AS item
+        ORDER BY item.key
+        ON CONFLICT (kind, key) WHERE {JOB_PENDING_SQL}
+        DO UPDATE SET run_after = LEAST(job.run_after, EXCLUDED.run_after)
+    """
+
+
+def enqueue_rankings(tv_ids, movie_ids, using=None) -> None:
+    """
+    Ставит в очередь пересчёт строк таблицы рейтингов для указанных сериалов и фильмов
+    в БД using (по умолчанию в БД для записи)
+    """
+
+    jobs = Job.objects.db_manager(using or router.db_for_write(Job))
+    for column, ids in (('tv_id', tv_ids), ('movie_id', movie_ids)):
+        ids = [film_id for film_id in ids if film_id is not None]
+        if ids:
+            jobs.enqueue(RANKING_JOBS[column], ids)
+
+
+def films_model(column: str):
+    """
+    Модель фильма или сериала по имени столбца внешнего ключа
+    """
+
+    return Movie if column == 'movie_id' else TV
+
+
+def enqueue_removed_sql() -> str:
+    """
+    CTE, которые ставят в очередь пересчёт строк таблицы рейтингов фильмов и сериалов из CTE removed,
+    виды заданий - параметры запроса movie_id_job и tv_id_job
+    """
+
+    return ''.join(
+        f""", {column}_jobs AS ({enqueue_sql(
+            f'%({column}_job)s',
+            f'(SELECT array_agg({column}::text) FILTER (WHERE {column} IS NOT NULL) FROM removed)',
+        )})"""
+        for column in ('movie_id', 'tv_id')
+    )
+
+
+def delete_watched_sql(condition: str, user_stats: str = None) -> str:
+    """
+    SQL, который удаляет записи FilmsWatched, подходящие под SQL-условие condition, и в том же запросе
+    вычитает удалённые оценки и отзывы из рейтинга фильмов и сериалов, записи и оценки - из счётчиков
+    пользователей и ставит в очередь пересчёт строк таблицы рейтингов.
+    user_stats - SQL изменения счётчиков, по умолчанию UPDATE счётчиков всех пользователей удалённых записей
+    (запись UserStats не создаётся). Возвращает (tv_id, movie_id) удалённых записей.
+    """
+
+    ratings = ''
+    for column in ('movie_id', 'tv_id'):
+        histogram = histogram_delta_sql(
+            'films.score_histogram', f'SELECT bucket, delta FROM buckets WHERE buckets.{column} = films.id'
+        )
+        ratings += f""", {column}_rating AS (
+                UPDATE {films_model(column)._meta.db_table} AS films
+                SET score_sum = films.score_sum - delta.score_sum,
+                    score_count = films.score_count - delta.score_count,
+                    score_histogram = {histogram},
+                    review_count = films.review_count - delta.review_count,
+                    updated_at = now()
+                FROM (
+                    SELECT {column} AS film, COALESCE(SUM(score), 0) AS score_sum, COUNT(score) AS score_count,
+                           COUNT(*) FILTER (WHERE review <> '') AS review_count
+                    FROM removed WHERE {column} IS NOT NULL AND (score IS NOT NULL OR review <> '')
+                    GROUP BY {column}
+                ) AS delta
+                WHERE films.id = delta.film
+            )"""
+
+    if user_stats is None:
+        user_stats = f"""
+            UPDATE {UserStats._meta.db_table} AS stats
+            SET movies_watched = stats.movies_watched - delta.movies, tv_watched = stats.tv_watched - delta.tv,
+                score_sum = stats.score_sum - delta.score_sum, score_count = stats.score_count - delta.score_count,
+                updated_at = now()
+            FROM (
+                SELECT user_id, COUNT(movie_id) AS movies, COUNT(tv_id) AS tv,
+                       COALESCE(SUM(score), 0) AS score_sum, COUNT(score) AS score_count
+                FROM removed GROUP BY user_id
+            ) AS delta
+            WHERE stats.user_id = delta.user_id
+        """
+    return f"""
+        WITH removed AS (
+            DELETE FROM {FilmsWatched._meta.db_table} WHERE {condition}
+            RETURNING user_id, tv_id, movie_id, score, review
+        ), buckets AS (
+            SELECT tv_id, movie_id, (score * 10)::int AS bucket, -COUNT(*) AS delta
+            FROM removed WHERE score IS NOT NULL
+            GROUP BY tv_id, movie_id, bucket
+        ){ratings}, user_stats AS ({user_stats}){enqueue_removed_sql()}
+        SELECT tv_id, movie_id FROM removed
+    """
+
+
+def delete_to_watch_sql(condition: str, user_stats: str = None) -> str:
+    """
+    SQL, который удаляет записи FilmsToWatch, подходящие под SQL-условие condition, и в том же запросе
+    вычитает их из счётчиков пользователей и ставит в очередь пересчёт строк таблицы рейтингов.
+    user_stats - как в delete_watched_sql. Возвращает (tv_id, movie_id) удалённых записей.
+    """
+
+    if user_stats is None:
+        user_stats = f"""
+            UPDATE {UserStats._meta.db_table} AS stats
+            SET movies_to_watch = stats.movies_to_watch - delta.movies, tv_to_watch = stats.tv_to_watch - delta.tv,
+                updated_at = now()
+            FROM (
+                SELECT user_id, COUNT(movie_id) AS movies, COUNT(tv_id) AS tv FROM removed GROUP BY user_id
+            ) AS delta
+            WHERE stats.user_id = delta.user_id
+        """
+    return f"""
+        WITH removed AS (
+            DELETE FROM {FilmsToWatch._meta.db_table} WHERE {condition}
+            RETURNING user_id, tv_id, movie_id
+        ), user_stats AS ({user_stats}){enqueue_removed_sql()}
+        SELECT tv_id, movie_id FROM removed
+    """
+
+
+class ListQuerySet(models.QuerySet):
+    """
+    Общий QuerySet моделей списков FilmsWatched и FilmsToWatch.
+    Удаление записей через QuerySet, экземпляр модели и каскадное удаление пользователя или фильма
+    (сигнал pre_delete) выполняется одним запросом delete_sql, в котором же обновляются производные данные.
+    Сигналов удаления у моделей списков нет, поэтому Django не загружает удаляемые записи по одной.
+    """
+
+    delete_sql = None
+
+    def delete_where(self, condition: str, params: dict, user_stats: str = None) -> list:
+        """
+        Удаляет записи, подходящие под SQL-условие condition с параметрами params (см. delete_sql).
+        Возвращает список (tv_id, movie_id) удалённых записей.
+        """
+
+        params = dict(params, movie_id_job=RANKING_JOBS['movie_id'], tv_id_job=RANKING_JOBS['tv_id'])
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            cursor.execute(self.delete_sql(condition, user_stats), params)
+            removed = cursor.fetchall()
+            self.removed(removed)
+        return removed
+
+    def removed(self, rows) -> None:
+        """
+        Вызывается в транзакции удаления со списком (tv_id, movie_id) удалённых записей
+        """
+
+    def delete(self):
+        if self.query.is_sliced:
+            raise TypeError("Cannot use 'limit' or 'offset' with delete().")
+
+        query = self._chain()
+        query._for_write = True
+        with transaction.atomic(using=query.db):
+            ids = list(query.values_list('pk', flat=True))
+            rows = len(query.delete_where('id = ANY(%(ids)s::bigint[])', {'ids': ids})) if ids else 0
+        return rows, {self.model._meta.label: rows}
+
+
+class FilmsWatchedQuerySet(ListQuerySet):
+    """
+    QuerySet для модели FilmsWatched.
+    Массовые операции, которые обходят метод save, пересчитывают рейтинг затронутых фильмов и сериалов
+    и счётчики затронутых пользователей. Удаление записей - см. ListQuerySet.
+    """
+
+    delete_sql = staticmethod(delete_watched_sql)
+
+    rating_fields = {'score', 'review', 'tv', 'tv_id', 'movie', 'movie_id', 'user', 'user_id'}
+
+    def films_ids(self) -> tuple:
+        """
+        Возвращает множества id сериалов и фильмов, на которые ссылаются записи queryset
+        """
+
+        tv_ids, movie_ids = set(), set()
+        for tv_id, movie_id in self.order_by().values_list('tv_id', 'movie_id').distinct():
+            if tv_id is not None:
+                tv_ids.add(tv_id)
+            if movie_id is not None:
+                movie_ids.add(movie_id)
+        return tv_ids, movie_ids
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super(FilmsWatchedQuerySet, self).bulk_create(objs, *args, **kwargs)
+            refresh_ratings(
+                {obj.tv_id for obj in objs if obj.tv_id is not None},
+                {obj.movie_id for obj in objs if obj.movie_id is not None}
+            )
+            if objs:
+                refresh_user_stats({obj.user_id for obj in objs})
+        return objs
+
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', Now())
+        if not self.rating_fields.intersection(kwargs):
+            return super(FilmsWatchedQuerySet, self).update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            affected = self.model.objects.filter(pk__in=list(self.values_list('pk', flat=True)))
+            tv_ids, movie_ids = affected.films_ids()
+            user_ids = set(affected.values_list('user_id', flat=True))
+            rows = super(FilmsWatchedQuerySet, self).update(**kwargs)
+            new_tv_ids, new_movie_ids = affected.films_ids()
+            refresh_ratings(tv_ids | new_tv_ids, movie_ids | new_movie_ids)
+            refresh_user_stats(user_ids | set(affected.values_list('user_id', flat=True)))
+        return rows
+
+    def watch(self, user_id, column: str, items: dict, keep_existing: bool = False) -> dict:
+        """
+        Добавляет фильмы (column='movie_id') или сериалы (column='tv_id') в список просмотренного одним запросом.
+        items - словарь {id: (score, review)}. В одном запросе к БД выполняются:
+        удаление из списка желаемого к просмотру, вставка с ON CONFLICT DO UPDATE для уже просмотренных,
+        изменение суммы, количества и гистограммы оценок и количества отзывов фильмов
+        на разницу между новыми и старыми оценками и отзывами, изменение счётчиков пользователя
+        и постановка в очередь пересчёта строк таблицы рейтингов.
+        Старые оценки читаются с FOR UPDATE, поэтому параллельное изменение той же записи не теряется.
+        При keep_existing=True незаполненные score и review не затирают старые значения.
+        Возвращает словарь {id фильма или сериала: id записи}.
+        """
+
+        if not items:
+            return {}
+
+        watched = self.model._meta.db_table
+        to_watch = FilmsToWatch._meta.db_table
+        films = films_model(column)
+        if keep_existing:
+            score, review = 'COALESCE(EXCLUDED.score, watched.score)', 'COALESCE(EXCLUDED.review, watched.review)'
+        else:
+            score, review = 'EXCLUDED.score', 'EXCLUDED.review'
+
+        histogram = histogram_delta_sql(
+            'films.score_histogram', 'SELECT bucket, delta FROM buckets WHERE buckets.film = films.id'
+        )
+        user_stats = user_stats_sql(
+            column,
+            watched='(SELECT COUNT(*) FROM saved) - (SELECT COUNT(*) FROM previous)',
+            to_watch='-(SELECT COUNT(*) FROM removed)',
+            score_sum='(SELECT COALESCE(SUM(sign * score), 0) FROM changes)',
+            score_count='(SELECT COALESCE(SUM(sign) FILTER (WHERE score IS NOT NULL), 0) FROM changes)',
+        )
+        lock_sql, locks = lock_films_sql(user_id, column, items)
+        sql = lock_sql + f"""
+            WITH removed AS (
+                DELETE FROM {to_watch} WHERE user_id = %(user)s AND {column} = ANY(%(ids)s::bigint[])
+                RETURNING id
+            ), previous AS (
+                SELECT {column} AS film, score, review FROM {watched}
+                WHERE user_id = %(user)s AND {column} = ANY(%(ids)s::bigint[])
+                FOR UPDATE
+            ), saved AS (
+                INSERT INTO {watched} AS watched (user_id, {column}, score, review, updated_at)
+                SELECT %(user)s, item.film, item.score, item.review, now()
+                FROM unnest(%(ids)s::bigint[], %(scores)s::numeric[], %(reviews)s::text[]) AS item(film, score, review),
+                     (SELECT COUNT(*) FROM previous) AS locked
+                ON CONFLICT (user_id, {column}) DO UPDATE
+                SET score = {score}, review = {review}, updated_at = EXCLUDED.updated_at
+                RETURNING id, {column} AS film, score, review
+            ), changes AS (
+                SELECT film, score, review, 1 AS sign FROM saved
+                UNION ALL
+                SELECT film, score, review, -1 FROM previous
+            ), delta AS (
+                SELECT film,
+                       COALESCE(SUM(sign * score), 0) AS score_sum,
+                       COALESCE(SUM(sign) FILTER (WHERE score IS NOT NULL), 0) AS score_count,
+                       COALESCE(SUM(sign) FILTER (WHERE review <> ''), 0) AS review_count
+                FROM changes
+                GROUP BY film
+            ), buckets AS (
+                SELECT film, (score * 10)::int AS bucket, SUM(sign) AS delta
+                FROM changes WHERE score IS NOT NULL
+                GROUP BY film, bucket
+            ), rating AS (
+                UPDATE {films._meta.db_table} AS films
+                SET score_sum = films.score_sum + delta.score_sum,
+                    score_count = films.score_count + delta.score_count,
+                    score_histogram = {histogram},
+                    review_count = films.review_count + delta.review_count,
+                    updated_at = now()
+                FROM delta
+                WHERE films.id = delta.film
+                  AND (delta.score_sum <> 0 OR delta.score_count <> 0 OR delta.review_count <> 0)
+            ), user_stats AS ({user_stats}
+            ), jobs AS ({enqueue_sql('%(job)s', '%(ids)s::text[]')})
+            SELECT film, id FROM saved
+        """
+        params = {
+            'locks': locks,
+            'user': user_id,
+            'job': RANKING_JOBS[column],
+            'ids': list(items),
+            'scores': [score for score, _ in items.values()],
+            'reviews': [review for _, review in items.values()],
+        }
+
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(sql, params)
+                saved = dict(cursor.fetchall())
+            invalidate_films(films._meta.model_name, *items)
+        return saved
+
+    def removed(self, rows) -> None:
+        for name, ids in (('tv', {tv_id for tv_id, _ in rows}), ('movie', {movie_id for _, movie_id in rows})):
+            ids.discard(None)
+            if ids:
+                invalidate_films(name, *ids)
+
+    def unwatch(self, user_id, column: str, ids) -> int:
+        """
+        Удаляет фильмы или сериалы из списка просмотренного одним запросом, в котором же
+        вычитаются удалённые оценки и отзывы из рейтинга и записи из счётчиков пользователя
+        и ставится в очередь пересчёт строк таблицы рейтингов. Возвращает количество удалённых записей.
+        """
+
+        ids = list(ids)
+        if not ids:
+            return 0
+        # Счётчики пользователя изменяются INSERT ... ON CONFLICT и блокируются, даже если ничего не удалено,
+        # как в watch и want: пакетные операции одного пользователя выполняются по очереди
+        user_stats = user_stats_sql(
+            column,
+            watched='-(SELECT COUNT(*) FROM removed)',
+            score_sum='-(SELECT COALESCE(SUM(score), 0) FROM removed)',
+            score_count='-(SELECT COUNT(score) FROM removed)',
+        )
+        condition = f'user_id = %(user)s AND {column} = ANY(%(ids)s::bigint[])'
+        return len(self.delete_where(condition, {'user': user_id, 'ids': ids}, user_stats))
 
 
 class FilmsWatched(FilmsWatchedAndFilmsToWatchAbstractClass):
@@ -117,7 +859,7 @@ class FilmsWatched(FilmsWatchedAndFilmsToWatchAbstractClass):
     review - обзор пользователя
     """
 
-    user = models.ForeignKey('auth.User', related_name='films_watched', on_delete=models.CASCADE)
+    user = models.ForeignKey('auth.User', related_name='films_watched', on_delete=models.CASCADE, db_index=False)
     score = models.DecimalField(
         max_digits=3,
         decimal_places=1,
@@ -130,26 +872,154 @@ class FilmsWatched(FilmsWatchedAndFilmsToWatchAbstractClass):
     )
     review = models.TextField(blank=True, null=True)
 
+    objects = FilmsWatchedQuerySet.as_manager()
+
+    class Meta(FilmsWatchedAndFilmsToWatchAbstractClass.Meta):
+        # Оценки фильма или сериала (пересчёт рейтинга, лидерборды) читаются только по индексу
+        indexes = FilmsWatchedAndFilmsToWatchAbstractClass.Meta.indexes + [
+            models.Index(fields=['movie'], include=['score'], condition=models.Q(movie__isnull=False),
+                         name='filmswatched_movie_score_idx'),
+            models.Index(fields=['tv'], include=['score'], condition=models.Q(tv__isnull=False),
+                         name='filmswatched_tv_score_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         """
         На всякий случай перед сохранением записи в БД добавлена проверка, что поля и фильма и сериала
-        не были выбраны одновременно, а также что оба этих поля не пусты
+        не были выбраны одновременно, а также что оба этих поля не пусты.
+        Новая запись добавляется одним запросом FilmsWatchedQuerySet.watch: удаление из списка желаемого
+        к просмотру, вставка (или обновление, если фильм уже в списке) и изменение рейтинга и счётчиков пользователя.
+        При изменении существующей записи рейтинг и счётчики обновляются в той же транзакции, удаление
+        из списка желаемого к просмотру вычитается из счётчиков запросом удаления (ListQuerySet.delete).
         """
 
         if self.tv is None and self.movie is None:
             raise ValidationError('Укажите фильм или сериал')
         elif self.tv is not None and self.movie is not None:
             raise ValidationError('Укажите или фильм или сериал')
+
+        using = kwargs['using'] = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        if self.pk is None and not kwargs.get('update_fields'):
+            column, film_id = ('tv_id', self.tv_id) if self.tv_id is not None else ('movie_id', self.movie_id)
+            self.pk = FilmsWatched.objects.db_manager(using).watch(
+                self.user_id, column, {film_id: (self.score, self.review)}
+            )[film_id]
+            self._state.adding = False
+            self._state.db = using
         else:
-            if self.tv is not None:
-                obj = FilmsToWatch.objects.filter(tv=self.tv, user=self.user)
-                if obj:
-                    obj.delete()
-            elif self.movie is not None:
-                obj = FilmsToWatch.objects.filter(movie=self.movie, user=self.user)
-                if obj:
-                    obj.delete()
-            super(FilmsWatched, self).save(*args, **kwargs)
+            column, film_id = ('tv_id', self.tv_id) if self.tv_id is not None else ('movie_id', self.movie_id)
+            lock_sql, locks = lock_films_sql(self.user_id, column, [film_id])
+            with transaction.atomic(using=using):
+                with connections[using].cursor() as cursor:
+                    cursor.execute(lock_sql, {'locks': locks})
+                FilmsToWatch.objects.db_manager(using).filter(tv=self.tv, movie=self.movie, user=self.user).delete()
+
+                previous = FilmsWatched.objects.db_manager(using).select_for_update().filter(
+                    pk=self.pk
+                ).values_list('user_id', 'tv_id', 'movie_id', 'score', 'review').first()
+
+                super(FilmsWatched, self).save(*args, **kwargs)
+
+                tv_ids, movie_ids = {self.tv_id}, {self.movie_id}
+                if previous is not None:
+                    user_id, tv_id, movie_id, score, review = previous
+                    update_rating(tv_id, movie_id, score, review, sign=-1, using=using)
+                    update_user_stats(user_id, tv_id, movie_id, sign=-1, score=score, using=using)
+                    tv_ids.add(tv_id)
+                    movie_ids.add(movie_id)
+                update_rating(self.tv_id, self.movie_id, self.score, self.review, sign=1, using=using)
+                update_user_stats(self.user_id, self.tv_id, self.movie_id, sign=1, score=self.score, using=using)
+                enqueue_rankings(tv_ids, movie_ids, using=using)
+
+
+class FilmsToWatchQuerySet(ListQuerySet):
+    """
+    QuerySet для модели FilmsToWatch.
+    Массовые операции, которые обходят метод save, пересчитывают счётчики затронутых пользователей
+    и ставят в очередь пересчёт строк таблицы рейтингов затронутых фильмов и сериалов.
+    Удаление записей - см. ListQuerySet.
+    """
+
+    delete_sql = staticmethod(delete_to_watch_sql)
+
+    stats_fields = {'tv', 'tv_id', 'movie', 'movie_id', 'user', 'user_id'}
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super(FilmsToWatchQuerySet, self).bulk_create(objs, *args, **kwargs)
+            if objs:
+                refresh_user_stats({obj.user_id for obj in objs})
+                enqueue_rankings({obj.tv_id for obj in objs}, {obj.movie_id for obj in objs})
+        return objs
+
+    def update(self, **kwargs):
+        if not self.stats_fields.intersection(kwargs):
+            return super(FilmsToWatchQuerySet, self).update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            affected = self.model.objects.filter(pk__in=list(self.values_list('pk', flat=True)))
+            before = list(affected.values_list('user_id', 'tv_id', 'movie_id'))
+            rows = super(FilmsToWatchQuerySet, self).update(**kwargs)
+            records = before + list(affected.values_list('user_id', 'tv_id', 'movie_id'))
+            refresh_user_stats({user_id for user_id, _, _ in records})
+            enqueue_rankings({tv_id for _, tv_id, _ in records}, {movie_id for _, _, movie_id in records})
+        return rows
+
+    def unwant(self, user_id, column: str, ids) -> int:
+        """
+        Удаляет фильмы или сериалы из списка желаемого к просмотру одним запросом, в котором же
+        вычитаются удалённые записи из счётчиков пользователя и ставится в очередь пересчёт строк таблицы рейтингов.
+        Возвращает количество удалённых записей.
+        """
+
+        ids = list(ids)
+        if not ids:
+            return 0
+        user_stats = user_stats_sql(column, to_watch='-(SELECT COUNT(*) FROM removed)')
+        condition = f'user_id = %(user)s AND {column} = ANY(%(ids)s::bigint[])'
+        return len(self.delete_where(condition, {'user': user_id, 'ids': ids}, user_stats))
+
+    def want(self, user_id, column: str, ids) -> tuple:
+        """
+        Добавляет фильмы (column='movie_id') или сериалы (column='tv_id') в список желаемого к просмотру одним запросом.
+        Уже просмотренные фильмы и сериалы не добавляются, проверка и вставка выполняются в одном запросе
+        под теми же блокировками, что и FilmsWatchedQuerySet.watch, поэтому запись не может оказаться в обоих списках.
+        Добавленные записи в том же запросе прибавляются к счётчикам пользователя, пересчёт строк таблицы рейтингов
+        ставится в очередь.
+        Возвращает словарь {id фильма или сериала: id записи} для добавленных или уже бывших в списке,
+        множество id добавленных этим запросом и список id отклонённых (уже просмотренных).
+        """
+
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {}, set(), []
+
+        to_watch = self.model._meta.db_table
+        lock_sql, locks = lock_films_sql(user_id, column, ids)
+        sql = lock_sql + f"""
+            WITH watched AS (
+                SELECT {column} AS film FROM {FilmsWatched._meta.db_table}
+                WHERE user_id = %(user)s AND {column} = ANY(%(ids)s::bigint[])
+            ), saved AS (
+                INSERT INTO {to_watch} AS to_watch (user_id, {column}, updated_at)
+                SELECT %(user)s, item.film, now() FROM unnest(%(ids)s::bigint[]) AS item(film)
+                WHERE item.film NOT IN (SELECT film FROM watched)
+                ON CONFLICT (user_id, {column}) DO UPDATE SET updated_at = to_watch.updated_at
+                RETURNING {column} AS film, id, xmax = 0 AS created
+            ), user_stats AS ({user_stats_sql(column, to_watch='(SELECT COUNT(*) FROM saved WHERE created)')}
+            ), jobs AS ({enqueue_sql('%(job)s', '%(ids)s::text[]')})
+            SELECT film, id, created FROM saved
+            UNION ALL
+            SELECT film, NULL, false FROM watched
+        """
+
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(sql, {'locks': locks, 'user': user_id, 'ids': ids, 'job': RANKING_JOBS[column]})
+                rows = cursor.fetchall()
+        saved = {film: pk for film, pk, _ in rows if pk is not None}
+        created = {film for film, _, is_created in rows if is_created}
+        return saved, created, [film for film, pk, _ in rows if pk is None]
 
 
 class FilmsToWatch(FilmsWatchedAndFilmsToWatchAbstractClass):
@@ -158,23 +1028,228 @@ class FilmsToWatch(FilmsWatchedAndFilmsToWatchAbstractClass):
     user - пользователь, который добавил запись, внешний ключ
     """
 
-    user = models.ForeignKey('auth.User', related_name='films_to_watch', on_delete=models.CASCADE)
+    user = models.ForeignKey('auth.User', related_name='films_to_watch', on_delete=models.CASCADE, db_index=False)
+
+    objects = FilmsToWatchQuerySet.as_manager()
+
+    class Meta(FilmsWatchedAndFilmsToWatchAbstractClass.Meta):
+        indexes = FilmsWatchedAndFilmsToWatchAbstractClass.Meta.indexes + [
+            models.Index(fields=['movie'], condition=models.Q(movie__isnull=False), name='filmstowatch_movie_idx'),
+            models.Index(fields=['tv'], condition=models.Q(tv__isnull=False), name='filmstowatch_tv_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         """
         На всякий случай перед сохранением записи в БД добавлена проверка, что поля и фильма и сериала
-        не были выбраны одновременно, а также что оба этих поля не пусты
+        не были выбраны одновременно, а также что оба этих поля не пусты.
+        Новая запись добавляется одним запросом FilmsToWatchQuerySet.want вместе с проверкой,
+        что фильм или сериал ещё не просмотрен.
         """
 
         if self.tv is None and self.movie is None:
             raise ValidationError('Укажите фильм или сериал')
         elif self.tv is not None and self.movie is not None:
             raise ValidationError('Укажите или фильм или сериал')
+
+        using = kwargs['using'] = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        if self.pk is None and not kwargs.get('update_fields'):
+            column, film_id = ('tv_id', self.tv_id) if self.tv_id is not None else ('movie_id', self.movie_id)
+            saved, _, rejected = FilmsToWatch.objects.db_manager(using).want(self.user_id, column, [film_id])
+            if rejected:
+                raise ValidationError('Вы уже посмотрели данный сериал' if self.tv_id is not None
+                                      else 'Вы уже посмотрели данный фильм')
+            self.pk = saved[film_id]
+            self._state.adding = False
+            self._state.db = using
         else:
+            watched = FilmsWatched.objects.db_manager(using)
             if self.tv is not None:
-                if FilmsWatched.objects.filter(tv=self.tv, user=self.user):
+                if watched.filter(tv=self.tv, user=self.user):
                     raise ValidationError('Вы уже посмотрели данный сериал')
             elif self.movie is not None:
-                if FilmsWatched.objects.filter(movie=self.movie, user=self.user):
+                if watched.filter(movie=self.movie, user=self.user):
                     raise ValidationError('Вы уже посмотрели данный фильм')
-            super(FilmsToWatch, self).save(*args, **kwargs)
+            with transaction.atomic(using=using):
+                previous = FilmsToWatch.objects.db_manager(using).select_for_update().filter(
+                    pk=self.pk
+                ).values_list('user_id', 'tv_id', 'movie_id').first()
+                super(FilmsToWatch, self).save(*args, **kwargs)
+                if previous != (self.user_id, self.tv_id, self.movie_id):
+                    if previous is not None:
+                        update_user_stats(*previous, sign=-1, watched=False, using=using)
+                    update_user_stats(self.user_id, self.tv_id, self.movie_id, sign=1, watched=False, using=using)
+                    _, tv_id, movie_id = previous or (None, None, None)
+                    enqueue_rankings({self.tv_id, tv_id}, {self.movie_id, movie_id}, using=using)
+
+
+class FilmNeighbour(models.Model):
+    """
+    Таблица ближайших соседей модели рекомендаций: для каждого фильма или сериала item хранится
+    не больше RECOMMENDATION_NEIGHBOURS самых похожих neighbour со сходством similarity.
+    Фильм и сериал кодируются одним числом (ключом): id фильма или минус id сериала.
+    Таблица заполняется командой build_recommendations.
+    """
+
+    item = models.BigIntegerField()
+    neighbour = models.BigIntegerField()
+    similarity = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'neighbour'], name='filmneighbour_item_neighbour_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['neighbour'], name='filmneighbour_neighbour_idx'),
+        ]
+
+
+class SimilarityBuild(models.Model):
+    """
+    Журнал построений таблицы FilmNeighbour.
+    started_at - время начала построения, изменения оценок после него учитываются следующим построением
+    full - полное построение или обновление только изменившихся фильмов и сериалов
+    items - количество пересчитанных фильмов и сериалов, neighbours - количество записанных соседей
+    """
+
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    full = models.BooleanField()
+    items = models.PositiveIntegerField()
+    neighbours = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['-started_at']
+
+
+class FilmRanking(models.Model):
+    """
+    Таблица рейтингов фильмов и сериалов для лидербордов, заполняется refresh_leaderboards.
+    Для каждого фильма или сериала (заполнено ровно одно из movie и tv) хранятся копии year и genre
+    для фильтрации и показатели, по которым упорядочиваются лидерборды:
+    votes - количество оценок, rating - средняя оценка, bayesian_rating - байесовская средняя оценка,
+    watched_count - количество пользователей, посмотревших фильм, to_watch_count - желающих посмотреть.
+    Для каждого показателя есть частичный индекс по записям, попадающим в лидерборд, поэтому лидерборд
+    и количество записей в нём читаются по индексу.
+    """
+
+    movie = models.OneToOneField(Movie, null=True, on_delete=models.CASCADE, related_name='ranking')
+    tv = models.OneToOneField(TV, null=True, on_delete=models.CASCADE, related_name='ranking')
+    year = models.IntegerField()
+    genre = ArrayField(models.CharField(max_length=50), null=True)
+    votes = models.PositiveIntegerField()
+    rating = models.FloatField(null=True)
+    bayesian_rating = models.FloatField()
+    watched_count = models.PositiveIntegerField()
+    to_watch_count = models.PositiveIntegerField()
+    refreshed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-bayesian_rating', 'id'], condition=models.Q(votes__gte=LEADERBOARD_MIN_VOTES),
+                         name='filmranking_bayesian_idx'),
+            models.Index(fields=['-watched_count', 'id'], condition=models.Q(watched_count__gt=0),
+                         name='filmranking_watched_idx'),
+            models.Index(fields=['-to_watch_count', 'id'], condition=models.Q(to_watch_count__gt=0),
+                         name='filmranking_to_watch_idx'),
+            GinIndex(fields=['genre'], name='filmranking_genre_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    """
+    Счётчики списков пользователя для страницы статистики:
+    movies_watched, tv_watched - количество просмотренных фильмов и сериалов,
+    score_sum, score_count - сумма и количество оценок пользователя,
+    movies_to_watch, tv_to_watch - количество фильмов и сериалов в списке желаемого к просмотру.
+    Запись создаётся при первом изменении списков пользователя и обновляется теми же запросами, что и списки,
+    поэтому статистика читается одной записью. Полный пересчёт - refresh_user_stats.
+    """
+
+    user = models.OneToOneField('auth.User', primary_key=True, on_delete=models.CASCADE, related_name='stats')
+    movies_watched = models.IntegerField(default=0)
+    tv_watched = models.IntegerField(default=0)
+    score_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    score_count = models.IntegerField(default=0)
+    movies_to_watch = models.IntegerField(default=0)
+    tv_to_watch = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_score(self):
+        """
+        Средняя оценка пользователя, None если оценок нет
+        """
+
+        if self.score_count:
+            return self.score_sum / self.score_count
+        return None
+
+    def top_genres(self, limit: int) -> list:
+        """
+        limit самых частых жанров просмотренных фильмов и сериалов одним запросом с GROUP BY
+        """
+
+        return genre_counts(
+            Movie.objects.filter(filmswatched__user=self.user_id),
+            TV.objects.filter(filmswatched__user=self.user_id),
+        )[:limit]
+
+
+class JobQuerySet(models.QuerySet):
+    """
+    QuerySet для модели Job
+    """
+
+    def enqueue(self, kind: str, keys, delay: float = 0) -> int:
+        """
+        Ставит в очередь задания вида kind с ключами keys в текущей транзакции (см. enqueue_sql),
+        задания можно взять через delay секунд. Ожидающее задание с тем же ключом выполняется
+        в наименьшее из двух времён, поэтому задержка ограничивает частоту выполнения задания.
+        Возвращает количество добавленных и объединённых с ними заданий.
+        """
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(enqueue_sql('%(kind)s', '%(keys)s::text[]', 'now() + make_interval(secs => %(delay)s)'),
+                           {'kind': kind, 'keys': sorted({str(key) for key in keys}), 'delay': delay})
+            return cursor.rowcount
+
+
+class Job(models.Model):
+    """
+    Очередь фоновых заданий (outbox): производные данные пересчитываются не в запросе пользователя,
+    а командой run_jobs. Задание записывается в той же транзакции, что и изменение данных, поэтому
+    не теряется при откате и не выполняется раньше фиксации изменения.
+    kind - вид задания (обработчик в jobs.JOB_HANDLERS), key - ключ, например id фильма;
+    задания одного вида с одинаковым ключом, ещё не взятые обработчиком, объединяются в одно.
+    run_after - время, после которого задание можно взять: при взятии сдвигается на время аренды,
+    при ошибке - на время до повторной попытки.
+    claimed_at - время взятия обработчиком, сбрасывается при откладывании после ошибки, attempts - количество взятий,
+    last_error - текст последней ошибки, failed_at - время, когда попытки закончились.
+    Выполненные задания удаляются, неудавшиеся хранятся JOB_FAILED_RETENTION_DAYS дней (jobs.prune_jobs).
+    """
+
+    kind = models.CharField(max_length=50)
+    key = models.CharField(max_length=200)
+    run_after = models.DateTimeField()
+    claimed_at = models.DateTimeField(null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = JobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_after', 'id'], condition=models.Q(failed_at__isnull=True), name='job_due_idx'),
+            models.Index(fields=['failed_at'], condition=models.Q(failed_at__isnull=False), name='job_failed_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'key'], condition=models.Q(claimed_at__isnull=True, failed_at__isnull=True),
+                name='job_pending_uniq',
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.kind}:{self.key}'
@@ -0,0 +1,191 @@
+import asyncio
+import json
+from base64 import b64decode, b64encode
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage, Page
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from film_library.api.asynchronous import database_sync_to_async
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Пагинация по составному ключу (keyset), например (title, id).
+    Вместо OFFSET и COUNT(*) следующая страница выбирается условием "ключ больше последнего ключа страницы",
+    поэтому любая страница стоит столько же, сколько первая, при наличии индекса по полям ключа.
+    Поля ключа задаются атрибутом keyset_ordering представления, последнее поле должно быть уникальным.
+    """
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+    page_size = api_settings.PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = view.keyset_ordering
+        self.base_url = request.build_absolute_uri()
+        values, reverse = self.decode_cursor(request)
+
+        if values is not None:
+            try:
+                queryset = queryset.filter(self.keyset_filter(values, reverse))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        order = [f'-{field}' if reverse else field for field in self.ordering]
+        results = list(queryset.order_by(*order)[:self.page_size + 1])
+
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        # При движении вперёд следующая страница есть, если выбрана лишняя запись, а предыдущая -
+        # если был передан курсор. При движении назад наоборот.
+        has_next, has_previous = (values is not None, has_more) if reverse else (has_more, values is not None)
+
+        self.next_values = self.previous_values = None
+        if results:
+            if has_next:
+                self.next_values = self.get_values(results[-1])
+            if has_previous:
+                self.previous_values = self.get_values(results[0])
+
+        return results
+
+    def keyset_filter(self, values, reverse: bool) -> Q:
+        """
+        Условие (f1, f2, ...) > (v1, v2, ...) в лексикографическом порядке.
+        Условие на первое поле вынесено отдельно, чтобы PostgreSQL мог использовать его как границу индекса.
+        """
+
+        lookup = 'lt' if reverse else 'gt'
+        condition = Q()
+        for i in range(len(self.ordering)):
+            term = Q(**{f'{self.ordering[i]}__{lookup}': values[i]})
+            for field, value in zip(self.ordering[:i], values[:i]):
+                term &= Q(**{field: value})
+            condition |= term
+
+        first_bound = Q(**{f'{self.ordering[0]}__{lookup}e': values[0]})
+        return first_bound & condition
+
+    def get_values(self, obj) -> list:
+        if isinstance(obj, dict):
+            return [obj[field] for field in self.ordering]
+        return [getattr(obj, field) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            data = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values, reverse = data['v'], bool(data['r'])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        # Значения ключа - только строки и числа. Значение, не подходящее к полю (например строка для id),
+        # отклоняется при построении условия в paginate_queryset
+        if (not isinstance(values, list) or len(values) != len(self.ordering)
+                or not all(isinstance(value, (str, int, float)) for value in values)):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, values, reverse: bool) -> str:
+        data = json.dumps({'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = b64encode(data.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        return self.encode_cursor(self.next_values, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_values is None:
+            return None
+        return self.encode_cursor(self.previous_values, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class PageNumberOrKeysetPagination(pagination.PageNumberPagination):
+    """
+    Пагинация по умолчанию: по номеру страницы.
+    Клиент может выбрать пагинацию по ключу параметром ?pagination=cursor, если представление
+    задаёт атрибут keyset_ordering. Ссылки на следующие страницы содержат параметр cursor.
+    """
+
+    mode_query_param = 'pagination'
+
+    keyset = None
+
+    def use_keyset(self, request, view) -> bool:
+        if getattr(view, 'keyset_ordering', None) is None:
+            return False
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or KeysetPagination.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request, view):
+            self.keyset = KeysetPagination()
+            self.keyset.page_size = self.get_page_size(request) or self.page_size
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super(PageNumberOrKeysetPagination, self).paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Пагинация для асинхронных представлений. Для страницы с номером количество записей и записи
+        страницы выбираются одновременно, номер страницы проверяется после. Пагинация по ключу и страница
+        'last' (её смещение зависит от количества записей) выполняются синхронной пагинацией в пуле потоков.
+        """
+
+        page_size = self.get_page_size(request)
+        number = request.query_params.get(self.page_query_param) or 1
+        if not page_size or self.use_keyset(request, view) or not str(number).isdigit() or int(number) < 1:
+            return await database_sync_to_async(self.paginate_queryset)(queryset, request, view)
+
+        number = int(number)
+        bottom = (number - 1) * page_size
+        count, rows = await asyncio.gather(
+            database_sync_to_async(queryset.count)(),
+            database_sync_to_async(list)(queryset[bottom:bottom + page_size]),
+        )
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = count
+        try:
+            paginator.validate_number(number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=number, message=str(exc)))
+
+        self.page = Page(rows, number, paginator)
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        self.request = request
+        return list(self.page)
+
+    def get_page_state(self) -> tuple:
+        """
+        Состояние выбранной страницы, от которого кроме её записей зависит ответ:
+        ключи соседних страниц при пагинации по ключу или количество записей при пагинации по номеру
+        """
+
+        if self.keyset is not None:
+            return self.keyset.next_values, self.keyset.previous_values
+        return self.page.paginator.count,
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super(PageNumberOrKeysetPagination, self).get_paginated_response(data)
@@ -25,6 +25,15 @@ class IsSuperuserOrReadOnly(permissions.BasePermission):
             return True
 
 
+class IsSelfOrSuperuser(permissions.BasePermission):
+    """
+    Разрешение для самого пользователя и суперпользователей
+    """
+
+    def has_object_permission(self, request, view, obj):
+        return obj == request.user or request.user.is_superuser
+
+
 class IsCreatorOrReadOnly(permissions.BasePermission):
     """
     Разрешение для создателей на чтение/запись.
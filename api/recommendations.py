@@ -0,0 +1,276 @@
+from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.utils import timezone
+from film_library.api.models import TV, Movie, FilmNeighbour, FilmsToWatch, FilmsWatched, SimilarityBuild
+from film_library.api.seeding import copy_rows
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+# Количество соседей, которое хранится для каждого фильма и сериала
+RECOMMENDATION_NEIGHBOURS = 50
+
+# Минимальное количество пользователей, оценивших оба фильма, при котором сходство учитывается
+MIN_COMMON_USERS = 2
+
+# Сходство умножается на n / (n + SIMILARITY_SHRINKAGE), где n - количество общих оценок,
+# чтобы сходство по нескольким случайно совпавшим оценкам не вытесняло надёжное
+SIMILARITY_SHRINKAGE = 10
+
+# Количество фильмов и сериалов, сходство с которыми вычисляется за один шаг
+SIMILARITY_BLOCK = 1000
+
+# Количество оценок, которые читаются из серверного курсора за одно обращение к БД
+SCORES_CHUNK_SIZE = 50000
+
+# Изменения, попавшие в транзакции, которые начались до построения, а завершились после,
+# учитываются следующим построением: окно изменённых фильмов начинается немного раньше
+DIRTY_OVERLAP = timedelta(minutes=1)
+
+# Добавка к сумме сходства в знаменателе предсказанной оценки: оценка, предсказанная по нескольким
+# слабо похожим фильмам, приближается к средней оценке пользователя
+PREDICTION_DAMPING = 1.0
+
+# Ключ фильма или сериала в FilmNeighbour: id фильма или минус id сериала
+FILM_KEY_SQL = 'COALESCE({table}.movie_id, -{table}.tv_id)'
+
+NEIGHBOUR_COLUMNS = ['item', 'neighbour', 'similarity']
+
+
+def recommendations_available() -> bool:
+    return np is not None
+
+
+def film_key(kind: str, pk: int) -> int:
+    return pk if kind == 'movie' else -pk
+
+
+def load_scores():
+    """
+    Все оценки из FilmsWatched в виде трёх массивов: пользователь, ключ фильма или сериала, оценка.
+    Оценки читаются серверным курсором частями по SCORES_CHUNK_SIZE.
+    """
+
+    table = FilmsWatched._meta.db_table
+    chunks = []
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.execute(
+            f'SELECT user_id, {FILM_KEY_SQL.format(table=table)}, score::float8 FROM {table} '
+            f'WHERE score IS NOT NULL'
+        )
+        while True:
+            rows = cursor.fetchmany(SCORES_CHUNK_SIZE)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+
+    scores = np.concatenate(chunks) if chunks else np.empty((0, 3))
+    return scores[:, 0].astype(np.int64), scores[:, 1].astype(np.int64), scores[:, 2]
+
+
+class SimilarityModel:
+    """
+    Сходство фильмов и сериалов по оценкам пользователей: косинусное сходство столбцов матрицы
+    пользователь x фильм, в которой из каждой оценки вычтена средняя оценка пользователя
+    (adjusted cosine). Сходство уменьшается для пар с малым количеством общих оценок.
+    keys - ключи фильмов и сериалов, соответствующие столбцам матрицы.
+    """
+
+    def __init__(self, users, items, scores):
+        user_ids, user_index = np.unique(users, return_inverse=True)
+        self.keys, item_index = np.unique(items, return_inverse=True)
+        shape = (len(user_ids), len(self.keys))
+
+        means = np.bincount(user_index, weights=scores) / np.bincount(user_index)
+        centered = sparse.csc_matrix((scores - means[user_index], (user_index, item_index)), shape=shape)
+        norms = np.sqrt(np.asarray(centered.multiply(centered).sum(axis=0)).ravel())
+        norms[norms == 0] = 1
+        self.normalized = (centered @ sparse.diags(1 / norms)).tocsc()
+        self.rated = sparse.csc_matrix((np.ones(len(scores)), (user_index, item_index)), shape=shape)
+
+    def similarity(self, columns):
+        """
+        Разреженная матрица сходства всех фильмов и сериалов (строки) с фильмами и сериалами
+        с индексами columns (столбцы)
+        """
+
+        common = (self.rated.T @ self.rated[:, columns]).tocsc()
+        common.data = np.where(
+            common.data >= MIN_COMMON_USERS, common.data / (common.data + SIMILARITY_SHRINKAGE), 0
+        )
+        return (self.normalized.T @ self.normalized[:, columns]).multiply(common).tocsc()
+
+    def blocks(self, columns):
+        """
+        Матрицы сходства для columns частями по SIMILARITY_BLOCK столбцов.
+        Возвращает пары (индексы столбцов части, матрица сходства).
+        """
+
+        for start in range(0, len(columns), SIMILARITY_BLOCK):
+            block = columns[start:start + SIMILARITY_BLOCK]
+            yield block, self.similarity(block)
+
+
+def top_neighbours(similarity, column_keys, row_keys, limit: int = RECOMMENDATION_NEIGHBOURS):
+    """
+    Для каждого столбца CSC-матрицы similarity не больше limit строк с наибольшим положительным сходством.
+    column_keys и row_keys - ключи фильмов и сериалов столбцов и строк.
+    Возвращает строки (item, neighbour, similarity) для FilmNeighbour.
+    """
+
+    for column, key in enumerate(column_keys):
+        start, end = similarity.indptr[column], similarity.indptr[column + 1]
+        neighbours, values = row_keys[similarity.indices[start:end]], similarity.data[start:end]
+        keep = (values > 0) & (neighbours != key)
+        neighbours, values = neighbours[keep], values[keep]
+        if len(values) > limit:
+            top = np.argpartition(-values, limit)[:limit]
+            neighbours, values = neighbours[top], values[top]
+        for neighbour, value in zip(neighbours.tolist(), values.tolist()):
+            yield key, neighbour, value
+
+
+def dirty_keys(since) -> list:
+    """
+    Ключи фильмов и сериалов, изменённых после since. Изменение оценки обновляет updated_at
+    фильма или сериала вместе с рейтингом, поэтому сюда попадают все фильмы с новыми оценками.
+    """
+
+    movies = Movie.objects.filter(updated_at__gte=since).values_list('pk', flat=True)
+    tv = TV.objects.filter(updated_at__gte=since).values_list('pk', flat=True)
+    return [film_key('movie', pk) for pk in movies] + [film_key('tv', pk) for pk in tv]
+
+
+def write_full(cursor, model: SimilarityModel) -> tuple:
+    cursor.execute(f'DELETE FROM {FilmNeighbour._meta.db_table}')
+
+    def neighbours():
+        for block, similarity in model.blocks(np.arange(len(model.keys))):
+            yield from top_neighbours(similarity, model.keys[block].tolist(), model.keys)
+
+    copy_rows(cursor, FilmNeighbour, NEIGHBOUR_COLUMNS, neighbours())
+    return len(model.keys), cursor.rowcount
+
+
+def write_incremental(cursor, model: SimilarityModel, dirty: list) -> tuple:
+    """
+    Пересчёт соседей изменённых фильмов и сериалов dirty. Для них соседи вычисляются заново,
+    у остальных из списка соседей удаляются изменённые и добавляются изменённые с новым сходством,
+    после чего список снова обрезается до RECOMMENDATION_NEIGHBOURS.
+    """
+
+    table = FilmNeighbour._meta.db_table
+    cursor.execute(f'DELETE FROM {table} WHERE item = ANY(%s) OR neighbour = ANY(%s)', [dirty, dirty])
+
+    columns = np.flatnonzero(np.isin(model.keys, dirty))
+    is_dirty = np.zeros(len(model.keys), dtype=bool)
+    is_dirty[columns] = True
+    touched = set()
+
+    def neighbours():
+        for block, similarity in model.blocks(columns):
+            yield from top_neighbours(similarity, model.keys[block].tolist(), model.keys)
+            transposed = similarity[~is_dirty].T.tocsc()
+            for row in top_neighbours(transposed, model.keys[~is_dirty].tolist(), model.keys[block]):
+                touched.add(row[0])
+                yield row
+
+    copy_rows(cursor, FilmNeighbour, NEIGHBOUR_COLUMNS, neighbours())
+    written = cursor.rowcount
+    if touched:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN (SELECT id FROM ('
+            f'SELECT id, row_number() OVER (PARTITION BY item ORDER BY similarity DESC, neighbour) AS position '
+            f'FROM {table} WHERE item = ANY(%s)) AS ranked WHERE position > %s)',
+            [sorted(touched), RECOMMENDATION_NEIGHBOURS]
+        )
+        written -= cursor.rowcount
+    return len(columns), written
+
+
+def build_neighbours(full: bool = False) -> SimilarityBuild:
+    """
+    Построение таблицы соседей FilmNeighbour по всем оценкам FilmsWatched.
+    Полное построение пересчитывает всех соседей. Без full пересчитываются только фильмы и сериалы,
+    изменённые после предыдущего построения. Изменение оценок пользователя сдвигает его среднюю оценку
+    и сходство остальных пар, поэтому обновление приближённое и полное построение нужно выполнять периодически.
+    Таблица заменяется в одной транзакции, чтение рекомендаций во время построения не блокируется,
+    параллельные построения выполняются по очереди.
+    """
+
+    if np is None:
+        raise ImproperlyConfigured('Для построения рекомендаций нужны пакеты numpy и scipy')
+
+    started_at = timezone.now()
+    last = SimilarityBuild.objects.first()
+    full = full or last is None
+    dirty = [] if full else dirty_keys(last.started_at - DIRTY_OVERLAP)
+
+    model = SimilarityModel(*load_scores())
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {FilmNeighbour._meta.db_table} IN EXCLUSIVE MODE')
+        if full:
+            items, neighbours = write_full(cursor, model)
+        elif dirty:
+            items, neighbours = write_incremental(cursor, model, dirty)
+        else:
+            items, neighbours = 0, 0
+        return SimilarityBuild.objects.create(
+            started_at=started_at, finished_at=timezone.now(), full=full, items=items, neighbours=neighbours
+        )
+
+
+def recommendations(user_id: int, limit: int) -> list:
+    """
+    Рекомендации пользователю одним запросом по таблице соседей: для каждого соседа фильмов,
+    оценённых пользователем, предсказанная оценка - средняя оценка пользователя плюс средневзвешенное
+    по сходству отклонение его оценок от средней (с PREDICTION_DAMPING, в пределах шкалы 0-10).
+    Фильмы и сериалы из списков просмотренного и желаемого к просмотру исключаются.
+    Возвращает список троек (ключ фильма или сериала, предсказанная оценка, сумма сходства).
+    """
+
+    watched, to_watch = FilmsWatched._meta.db_table, FilmsToWatch._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH rated AS ('
+            f'SELECT {FILM_KEY_SQL.format(table=watched)} AS film, score::float8 AS score FROM {watched} '
+            f'WHERE user_id = %(user)s AND score IS NOT NULL'
+            f'), mean AS (SELECT AVG(score) AS score FROM rated), '
+            f'excluded AS ('
+            f'SELECT {FILM_KEY_SQL.format(table=watched)} AS film FROM {watched} WHERE user_id = %(user)s '
+            f'UNION ALL '
+            f'SELECT {FILM_KEY_SQL.format(table=to_watch)} FROM {to_watch} WHERE user_id = %(user)s'
+            f') '
+            f'SELECT n.neighbour, LEAST(10, GREATEST(0, MAX(mean.score) '
+            f'+ SUM(n.similarity * (rated.score - mean.score)) / (SUM(n.similarity) + %(damping)s))) AS predicted, '
+            f'SUM(n.similarity) AS weight '
+            f'FROM rated JOIN {FilmNeighbour._meta.db_table} AS n ON n.item = rated.film CROSS JOIN mean '
+            f'WHERE NOT EXISTS (SELECT 1 FROM excluded WHERE excluded.film = n.neighbour) '
+            f'GROUP BY n.neighbour ORDER BY predicted DESC, weight DESC, n.neighbour LIMIT %(limit)s',
+            {'user': user_id, 'limit': limit, 'damping': PREDICTION_DAMPING}
+        )
+        return cursor.fetchall()
+
+
+def recommended_films(user_id: int, limit: int) -> list:
+    """
+    Рекомендованные фильмы и сериалы: список троек (тип, объект Movie или TV, предсказанная оценка)
+    в порядке recommendations. Фильмы и сериалы выбираются двумя запросами по первичному ключу.
+    """
+
+    rows = recommendations(user_id, limit)
+    films = {
+        'movie': Movie.objects.in_bulk([key for key, _, _ in rows if key > 0]),
+        'tv': TV.objects.in_bulk([-key for key, _, _ in rows if key < 0]),
+    }
+    result = []
+    for key, predicted, _ in rows:
+        kind = 'movie' if key > 0 else 'tv'
+        film = films[kind].get(abs(key))
+        if film is not None:
+            result.append((kind, film, predicted))
+    return result
@@ -0,0 +1,91 @@
+import hashlib
+import random
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.deprecation import MiddlewareMixin
+
+# Методы запросов, которые читают с реплик
+REPLICA_METHODS = ('GET', 'HEAD')
+
+# Приложения, модели которых всегда читаются с основной БД: сессия должна быть видна сразу после входа
+PRIMARY_APPS = ('sessions',)
+
+# Реплика, с которой читает текущий запрос, None - основная БД
+read_alias = ContextVar('read_alias', default=None)
+
+
+def replica_databases() -> list:
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+def sticky_seconds() -> int:
+    """
+    Время (с), в течение которого после изменяющего запроса клиент читает с основной БД,
+    настройка REPLICA_STICKY_SECONDS
+    """
+
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+
+
+def pin_key(request):
+    """
+    Ключ кэша, по которому отмечается недавняя запись клиента. Клиент определяется по заголовку Authorization
+    или по cookie сессии без обращения к БД, анонимные клиенты без сессии не отмечаются.
+    """
+
+    credentials = request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return 'primary-pin:' + hashlib.sha256(credentials.encode('utf-8')).hexdigest()
+
+
+class PrimaryReplicaRouter:
+    """
+    Маршрутизатор БД: запись всегда в основную БД (default), чтение - с реплики, выбранной
+    ReplicaRoutingMiddleware для текущего запроса, иначе тоже с основной БД.
+    Реплики содержат те же данные, что и основная БД, поэтому связи между объектами разрешены,
+    а миграции применяются только к основной БД.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return DEFAULT_DB_ALIAS
+        return read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    """
+    Чтение с реплик для GET и HEAD. Реплика выбирается случайно один раз на запрос, поэтому все запросы
+    к БД одного ответа (например количество записей и страница) читают одни и те же данные.
+    После успешного изменяющего запроса клиент в течение sticky_seconds() читает с основной БД,
+    чтобы сразу видеть свои изменения, которые ещё не дошли до реплик.
+    Запросы к БД при переборе потокового ответа выполняются после process_response и читают с основной БД.
+    """
+
+    def process_request(self, request):
+        replicas = replica_databases()
+        if request.method not in REPLICA_METHODS or not replicas:
+            read_alias.set(None)
+            return
+
+        key = pin_key(request)
+        read_alias.set(None if key is not None and cache.get(key) else random.choice(replicas))
+
+    def process_response(self, request, response):
+        read_alias.set(None)
+        if request.method not in REPLICA_METHODS and response.status_code < 400 and replica_databases():
+            key = pin_key(request)
+            if key is not None:
+                cache.set(key, True, timeout=sticky_seconds())
+        return response
@@ -0,0 +1,231 @@
+import csv
+import math
+import random
+import tempfile
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from film_library.api.csvutils import IteratorFile, csv_lines
+from film_library.api.models import TV, Movie, FilmsWatched, FilmsToWatch, UserStats, refresh_user_stats
+
+# Слова, из которых составляются названия фильмов и сериалов синтетического набора данных
+TITLE_WORDS = [
+    'star', 'night', 'city', 'river', 'dark', 'light', 'last', 'first', 'winter', 'summer',
+    'king', 'queen', 'road', 'ghost', 'house', 'war', 'love', 'secret', 'silent', 'lost',
+]
+
+GENRES = ['drama', 'comedy', 'thriller', 'horror', 'fantasy', 'action', 'crime', 'documentary']
+
+# Доля записей списка просмотренного без оценки
+UNSCORED_SHARE = 0.15
+
+# Показатель степени в распределении популярности фильмов (закон Ципфа)
+POPULARITY_EXPONENT = 0.8
+
+# Время создания и изменения записей набора данных выбирается случайно в интервале DATASET_DAYS дней
+# от DATASET_EPOCH, поэтому набор данных с одним seed не зависит от времени заполнения
+DATASET_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+DATASET_DAYS = 3 * 365
+
+
+def copy_rows(cursor, model, columns: list, rows, not_null=()) -> None:
+    """
+    Загружает строки в таблицу модели одной командой COPY, данные передаются потоково.
+    not_null - столбцы, в которых пустое значение означает пустую строку, а не NULL.
+    """
+
+    options = 'FORMAT csv' + (f', FORCE_NOT_NULL ({", ".join(not_null)})' if not_null else '')
+    sql = f'COPY {model._meta.db_table} ({", ".join(columns)}) FROM STDIN WITH ({options})'
+    cursor.copy_expert(sql, IteratorFile(csv_lines(rows)))
+
+
+def secondary_indexes(cursor, models) -> list:
+    """
+    Определения индексов таблиц моделей, кроме индексов первичных ключей и ограничений уникальности
+    """
+
+    cursor.execute(
+        'SELECT indexname, indexdef FROM pg_indexes AS i WHERE tablename = ANY(%s) '
+        'AND NOT EXISTS (SELECT 1 FROM pg_constraint AS c WHERE c.conname = i.indexname)',
+        [[model._meta.db_table for model in models]]
+    )
+    return cursor.fetchall()
+
+
+def next_id(cursor, model) -> int:
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {model._meta.db_table}')
+    return cursor.fetchone()[0]
+
+
+def reset_sequence(cursor, model) -> None:
+    table = model._meta.db_table
+    cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))")
+
+
+class Dataset:
+    """
+    Детерминированный синтетический набор данных: пользователи, фильмы, сериалы и их списки.
+    Строки создаются генераторами, поэтому в памяти хранятся только характеристики фильмов.
+    Популярность фильмов распределена по закону Ципфа, оценка складывается из качества фильма,
+    строгости пользователя и случайного разброса. Записи пользователя в списках просмотренного
+    и желаемого к просмотру не пересекаются, в каждой записи заполнен ровно один из фильма или сериала.
+    """
+
+    def __init__(self, users: int, movies: int, tv: int, watched: int, to_watch: int, seed: int, first_ids: dict):
+        self.rnd = random.Random(seed)
+        self.seed = seed
+        self.users, self.movies, self.tv = users, movies, tv
+        self.watched, self.to_watch = watched, to_watch
+        self.first_ids = first_ids
+
+        # Индекс в списке films - ссылка (поле, id), у каждого фильма своё качество
+        self.films = (
+            [('movie_id', first_ids['movie'] + i) for i in range(movies)]
+            + [('tv_id', first_ids['tv'] + i) for i in range(tv)]
+        )
+        self.quality = [self.rnd.gauss(6.5, 1.2) for _ in self.films]
+        ranks = list(range(len(self.films)))
+        self.rnd.shuffle(ranks)
+        self.cum_weights = list(accumulate(1 / (rank + 1) ** POPULARITY_EXPONENT for rank in ranks))
+
+    def user_rows(self):
+        for i in range(self.users):
+            yield (self.first_ids['user'] + i, f'seed{self.seed}_{self.first_ids["user"] + i}', '!', False, False,
+                   True, '', '', '', self.timestamp())
+
+    def film_rows(self, extra):
+        for i in range(self.movies if extra == 'movie' else self.tv):
+            genre = '{' + ','.join(self.rnd.sample(GENRES, self.rnd.randint(1, 3))) + '}'
+            row = [self.first_ids[extra] + i, ' '.join(self.rnd.sample(TITLE_WORDS, 3)), self.rnd.randint(1950, 2022), genre,
+                   self.first_ids['user'] + self.rnd.randrange(self.users), 0, 0, 0, self.timestamp()]
+            if extra == 'movie':
+                row.append(self.rnd.randint(80, 180))
+            else:
+                row += [self.rnd.randint(6, 100), self.rnd.randint(20, 60)]
+            yield row
+
+    def timestamp(self) -> str:
+        return (DATASET_EPOCH + timedelta(seconds=self.rnd.randrange(DATASET_DAYS * 86400))).isoformat()
+
+    def list_size(self, mean: int, limit: int) -> int:
+        if mean <= 0:
+            return 0
+        # Логнормальное распределение со средним mean: у большинства пользователей списки короткие, у немногих длинные
+        sigma = 0.8
+        return min(limit, max(1, round(self.rnd.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma))))
+
+    def sample_films(self, count: int, exclude: set) -> list:
+        """
+        Выбор count разных фильмов с учётом популярности, кроме exclude
+        """
+
+        chosen = []
+        seen = set(exclude)
+        while len(chosen) < count:
+            for index in self.rnd.choices(range(len(self.films)), cum_weights=self.cum_weights, k=count * 2):
+                if index not in seen:
+                    seen.add(index)
+                    chosen.append(index)
+                    if len(chosen) == count:
+                        break
+        return chosen
+
+    def list_rows(self):
+        """
+        Пары строк (просмотренное, желаемое к просмотру) для каждого пользователя
+        """
+
+        limit = len(self.films) // 2
+        for i in range(self.users):
+            user_id = self.first_ids['user'] + i
+            bias = self.rnd.gauss(0, 0.8)
+            watched = self.sample_films(self.list_size(self.watched, limit), set())
+            to_watch = self.sample_films(self.list_size(self.to_watch, limit), set(watched))
+
+            watched_rows = []
+            for index in watched:
+                score = None
+                if self.rnd.random() >= UNSCORED_SHARE:
+                    score = round(min(10.0, max(0.0, self.quality[index] + bias + self.rnd.gauss(0, 1.2))), 1)
+                watched_rows.append(self.list_row(user_id, index) + [score, None])
+            yield watched_rows, [self.list_row(user_id, index) for index in to_watch]
+
+    def list_row(self, user_id: int, index: int) -> list:
+        field, film_id = self.films[index]
+        return [user_id, film_id if field == 'tv_id' else None, film_id if field == 'movie_id' else None,
+                self.timestamp()]
+
+
+def seed_database(users: int, movies: int, tv: int, watched: int, to_watch: int, seed: int = 0,
+                  drop_indexes: bool = True):
+    """
+    Заполняет БД синтетическим набором данных через COPY в одной транзакции.
+    Вторичные индексы таблиц удаляются перед загрузкой и создаются заново после неё, внешние ключи
+    Django создаёт отложенными (DEFERRABLE INITIALLY DEFERRED), поэтому они проверяются один раз после загрузки.
+    Рейтинг и поисковые векторы новых фильмов заполняются после загрузки одним UPDATE на таблицу,
+    счётчики новых пользователей - одним INSERT.
+    Возвращает количество загруженных записей по таблицам.
+    """
+
+    models = [User, Movie, TV, FilmsWatched, FilmsToWatch, UserStats]
+    counts = {'users': users, 'movies': movies, 'tv': tv, 'watched': 0, 'to_watch': 0}
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f'LOCK TABLE {model._meta.db_table} IN EXCLUSIVE MODE')
+
+        first_ids = {'user': next_id(cursor, User), 'movie': next_id(cursor, Movie), 'tv': next_id(cursor, TV)}
+        dataset = Dataset(users, movies, tv, watched, to_watch, seed, first_ids)
+
+        indexes = secondary_indexes(cursor, models) if drop_indexes else []
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+
+        raw = cursor.cursor
+        copy_rows(raw, User, ['id', 'username', 'password', 'is_superuser', 'is_staff', 'is_active',
+                              'first_name', 'last_name', 'email', 'date_joined'], dataset.user_rows(),
+                  not_null=['first_name', 'last_name', 'email'])
+        films = ['id', 'title', 'year', 'genre', 'added_by_id', 'score_sum', 'score_count', 'review_count', 'updated_at']
+        copy_rows(raw, Movie, films + ['duration'], dataset.film_rows('movie'))
+        copy_rows(raw, TV, films + ['number_of_episodes', 'avg_episode_duration'], dataset.film_rows('tv'))
+
+        # Строки списков создаются одним проходом по пользователям, поэтому записи желаемого к просмотру
+        # сохраняются во временный файл, пока идёт загрузка списка просмотренного
+        pending = tempfile.TemporaryFile(mode='w+', encoding='utf-8', newline='')
+        to_watch_writer = csv.writer(pending, lineterminator='\n')
+
+        def watched_rows():
+            for watched_rows, to_watch_rows in dataset.list_rows():
+                counts['watched'] += len(watched_rows)
+                counts['to_watch'] += len(to_watch_rows)
+                to_watch_writer.writerows(to_watch_rows)
+                yield from watched_rows
+
+        columns = ['user_id', 'tv_id', 'movie_id', 'updated_at']
+        copy_rows(raw, FilmsWatched, columns + ['score', 'review'], watched_rows())
+        with pending:
+            pending.seek(0)
+            raw.copy_expert(
+                f'COPY {FilmsToWatch._meta.db_table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', pending
+            )
+
+        for model in (User, Movie, TV):
+            reset_sequence(cursor, model)
+
+        # Отложенные проверки внешних ключей выполняются до создания индексов:
+        # PostgreSQL не создаёт индекс на таблице с ожидающими проверками
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        for _, definition in indexes:
+            cursor.execute(definition)
+
+        for model, first in ((Movie, first_ids['movie']), (TV, first_ids['tv'])):
+            new_films = model.objects.filter(pk__gte=first)
+            new_films.refresh_search_vectors()
+            new_films.refresh_ratings()
+        refresh_user_stats(range(first_ids['user'], first_ids['user'] + users))
+
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f'ANALYZE {model._meta.db_table}')
+    return counts
@@ -1,11 +1,53 @@
-from rest_framework import serializers
+from decimal import Decimal
+from rest_framework import permissions, serializers
+from rest_framework.reverse import reverse
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password
-from django.db.models import Avg
-from film_library.api.models import TV, Movie, FilmsWatched, FilmsToWatch
+from film_library.api.models import SCORE_BUCKETS, TV, Movie, FilmRanking, FilmsWatched, FilmsToWatch, UserStats
 
+# Наибольшее количество записей в каждом из списков add и remove пакетного изменения списка
+BATCH_MAX_ITEMS = getattr(settings, 'BATCH_MAX_ITEMS', 1000)
 
-class UserSerializerList(serializers.HyperlinkedModelSerializer):
+
+def sparse_field_names(request, names) -> list:
+    """
+    Поля ответа, оставшиеся после параметров ?fields= (перечень выводимых полей через запятую)
+    и ?omit= (перечень исключаемых полей). Параметры действуют только на чтение.
+    """
+
+    names = list(names)
+    if request is None or request.method not in permissions.SAFE_METHODS:
+        return names
+
+    fields = request.query_params.get('fields')
+    if fields:
+        requested = {name.strip() for name in fields.split(',')}
+        names = [name for name in names if name in requested]
+
+    omit = request.query_params.get('omit')
+    if omit:
+        omitted = {name.strip() for name in omit.split(',')}
+        names = [name for name in names if name not in omitted]
+    return names
+
+
+class SparseFieldsMixin:
+    """
+    Выбор полей ответа параметрами ?fields= и ?omit=. Применяется только к записям верхнего уровня,
+    вложенные сериализаторы выводятся полностью.
+    """
+
+    def get_fields(self):
+        fields = super(SparseFieldsMixin, self).get_fields()
+        parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        if parent is not None:
+            return fields
+        names = sparse_field_names(self.context.get('request'), fields)
+        return type(fields)((name, fields[name]) for name in names)
+
+
+class UserSerializerList(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     """
     Сериализатор, используемый для отображения списка пользователей или конкретного пользователя
     """
@@ -22,7 +64,24 @@ class UserSerializerList(serializers.HyperlinkedModelSerializer):
                   'films_watched', 'films_to_watch']
 
 
-class UserSerializerCreateDetail(serializers.ModelSerializer):
+class UserSerializerSummary(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
+    """
+    Сериализатор, используемый для отображения списка пользователей с количеством записей вместо списков ссылок
+    """
+
+    id = serializers.HyperlinkedIdentityField(view_name='user-detail')
+    tv_added = serializers.IntegerField(source='tv_added_count', read_only=True)
+    movies_added = serializers.IntegerField(source='movies_added_count', read_only=True)
+    films_watched = serializers.IntegerField(source='films_watched_count', read_only=True)
+    films_to_watch = serializers.IntegerField(source='films_to_watch_count', read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'is_superuser', 'tv_added', 'movies_added',
+                  'films_watched', 'films_to_watch']
+
+
+class UserSerializerCreateDetail(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор, используемый для добавления и редактирования пользователей
     """
@@ -44,77 +103,170 @@ class UserSerializerCreateDetail(serializers.ModelSerializer):
         return super(UserSerializerCreateDetail, self).create(validated_data)
 
 
-class TVSerializerList(serializers.HyperlinkedModelSerializer):
+class TVSerializerList(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     """
     Сериализатор, используемый для отображения списка сериалов
     """
 
     added_by = serializers.ReadOnlyField(source='added_by.username')
     id = serializers.HyperlinkedIdentityField(view_name='tv-detail')
-    rating = serializers.SerializerMethodField()
+    rating = serializers.ReadOnlyField()
 
     class Meta:
         model = TV
         fields = ['id', 'title', 'year', 'rating', 'genre', 'number_of_episodes', 'avg_episode_duration', 'added_by']
 
-    @staticmethod
-    def get_rating(obj):
-        return FilmsWatched.objects.filter(tv=obj.pk).aggregate(Avg('score'))['score__avg']
-
 
-class TVSerializerDetail(serializers.ModelSerializer):
+class TVSerializerDetail(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор, используемый для отображения конкретного сериала
     """
 
     added_by = serializers.ReadOnlyField(source='added_by.username')
-    rating = serializers.SerializerMethodField()
+    rating = serializers.ReadOnlyField()
 
     class Meta:
         model = TV
         fields = ['id', 'title', 'year', 'rating', 'genre', 'number_of_episodes', 'avg_episode_duration', 'added_by']
 
-    @staticmethod
-    def get_rating(obj):
-        return FilmsWatched.objects.filter(tv=obj.pk).aggregate(Avg('score'))['score__avg']
 
-
-class MovieSerializerList(serializers.HyperlinkedModelSerializer):
+class MovieSerializerList(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     """
     Сериализатор, используемый для отображения списка фильмов
     """
 
     added_by = serializers.ReadOnlyField(source='added_by.username')
     id = serializers.HyperlinkedIdentityField(view_name='movie-detail')
-    rating = serializers.SerializerMethodField()
+    rating = serializers.ReadOnlyField()
 
     class Meta:
         model = Movie
         fields = ['id', 'title', 'year', 'rating', 'genre', 'duration', 'added_by']
 
-    @staticmethod
-    def get_rating(obj):
-        return FilmsWatched.objects.filter(movie=obj.pk).aggregate(Avg('score'))['score__avg']
-
 
-class MovieSerializerDetail(serializers.ModelSerializer):
+class MovieSerializerDetail(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор, используемый для отображения конкретного фильма
     """
 
     added_by = serializers.ReadOnlyField(source='added_by.username')
-    rating = serializers.SerializerMethodField()
+    rating = serializers.ReadOnlyField()
 
     class Meta:
         model = Movie
         fields = ['id', 'title', 'year', 'rating', 'genre', 'duration', 'added_by']
 
-    @staticmethod
-    def get_rating(obj):
-        return FilmsWatched.objects.filter(movie=obj.pk).aggregate(Avg('score'))['score__avg']
+
+class SearchResultSerializer(SparseFieldsMixin, serializers.Serializer):
+    """
+    Сериализатор, используемый для отображения результатов поиска по фильмам и сериалам
+    """
+
+    id = serializers.SerializerMethodField()
+    type = serializers.CharField(source='kind')
+    title = serializers.CharField()
+    year = serializers.IntegerField()
+    genre = serializers.ListField(child=serializers.CharField())
+
+    def get_id(self, obj):
+        return reverse(f"{obj['kind']}-detail", args=[obj['pk']], request=self.context['request'])
+
+
+class TVSummarySerializer(serializers.HyperlinkedModelSerializer):
+    """
+    Сериализатор сериала, встраиваемого в записи списков при ?expand=film
+    """
+
+    id = serializers.HyperlinkedIdentityField(view_name='tv-detail')
+    rating = serializers.ReadOnlyField()
+
+    class Meta:
+        model = TV
+        fields = ['id', 'title', 'year', 'genre', 'rating']
+
+
+class MovieSummarySerializer(serializers.HyperlinkedModelSerializer):
+    """
+    Сериализатор фильма, встраиваемого в записи списков при ?expand=film
+    """
+
+    id = serializers.HyperlinkedIdentityField(view_name='movie-detail')
+    rating = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Movie
+        fields = ['id', 'title', 'year', 'genre', 'rating']
+
+
+class FilmStatsSerializer(SparseFieldsMixin, serializers.Serializer):
+    """
+    Сериализатор статистики оценок фильма или сериала: количество оценок и отзывов, средняя оценка,
+    медиана и количество оценок для каждого значения от 0.0 до 10.0
+    """
+
+    votes = serializers.IntegerField(source='score_count')
+    reviews = serializers.IntegerField(source='review_count')
+    rating = serializers.ReadOnlyField()
+    median = serializers.ReadOnlyField(source='score_median')
+    histogram = serializers.SerializerMethodField()
+
+    def get_histogram(self, obj) -> dict:
+        histogram = obj.score_histogram or [0] * SCORE_BUCKETS
+        return {f'{bucket / 10:.1f}': count for bucket, count in enumerate(histogram)}
 
 
-class WatchedSerializer(serializers.HyperlinkedModelSerializer):
+class UserStatsSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Сериализатор статистики пользователя: количество просмотренных и желаемых к просмотру фильмов и сериалов,
+    средняя оценка и самые частые жанры просмотренного (количество задаётся контекстом top_genres).
+    С ?omit=top_genres запрос жанров не выполняется.
+    """
+
+    username = serializers.ReadOnlyField(source='user.username')
+    average_score = serializers.ReadOnlyField()
+    top_genres = serializers.SerializerMethodField()
+
+    def get_top_genres(self, obj) -> list:
+        return [{'genre': genre, 'count': count} for genre, count in obj.top_genres(self.context['top_genres'])]
+
+    class Meta:
+        model = UserStats
+        fields = ['username', 'movies_watched', 'tv_watched', 'score_count', 'average_score',
+                  'movies_to_watch', 'tv_to_watch', 'top_genres']
+
+
+class LeaderboardSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Сериализатор записи лидерборда: фильм или сериал и его показатели из таблицы рейтингов
+    """
+
+    type = serializers.SerializerMethodField()
+    tv = TVSummarySerializer(read_only=True)
+    movie = MovieSummarySerializer(read_only=True)
+
+    def get_type(self, obj) -> str:
+        return 'movie' if obj.movie_id is not None else 'tv'
+
+    class Meta:
+        model = FilmRanking
+        fields = ['type', 'tv', 'movie', 'votes', 'rating', 'bayesian_rating', 'watched_count', 'to_watch_count']
+
+
+class ExpandFilmMixin:
+    """
+    Если в контексте сериализатора указан expand_film, ссылки tv и movie заменяются данными фильма или сериала
+    """
+
+    def get_fields(self):
+        fields = super(ExpandFilmMixin, self).get_fields()
+        if self.context.get('expand_film'):
+            for name, serializer in (('tv', TVSummarySerializer), ('movie', MovieSummarySerializer)):
+                if name in fields:
+                    fields[name] = serializer(read_only=True)
+        return fields
+
+
+class WatchedSerializer(SparseFieldsMixin, ExpandFilmMixin, serializers.HyperlinkedModelSerializer):
     """
     Сериализатор, используемый для отображения списка просмотренных фильмов и сериалов
     """
@@ -137,7 +289,7 @@ class TVWatchedSerializerList(WatchedSerializer):
         fields = ['id', 'user', 'tv', 'score', 'review']
 
 
-class TVWatchedSerializerDetail(serializers.HyperlinkedModelSerializer):
+class TVWatchedSerializerDetail(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     """
     Сериализатор, используемый для отображения конкретного просмотренного сериала
     """
@@ -159,7 +311,7 @@ class MovieWatchedSerializerList(WatchedSerializer):
         fields = ['id', 'user', 'movie', 'score', 'review']
 
 
-class MovieWatchedSerializerDetail(serializers.HyperlinkedModelSerializer):
+class MovieWatchedSerializerDetail(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     """
     Сериализатор, используемый для отображения конкретного просмотренного фильма
     """
@@ -171,7 +323,7 @@ class MovieWatchedSerializerDetail(serializers.HyperlinkedModelSerializer):
         fields = ['id', 'user', 'movie', 'score', 'review']
 
 
-class ToWatchSerializer(serializers.HyperlinkedModelSerializer):
+class ToWatchSerializer(SparseFieldsMixin, ExpandFilmMixin, serializers.HyperlinkedModelSerializer):
     """
     Сериализатор, используемый для отображения списка фильмов и сериалов желаемых к просмотру
     """
@@ -194,7 +346,7 @@ class TVToWatchSerializerList(ToWatchSerializer):
         fields = ['id', 'user', 'tv']
 
 
-class TVToWatchSerializerDetail(serializers.HyperlinkedModelSerializer):
+class TVToWatchSerializerDetail(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     """
     Сериализатор, используемый для отображения конкретного сериала желаемого к просмотру
     """
@@ -216,7 +368,7 @@ class MovieToWatchSerializerList(ToWatchSerializer):
         fields = ['id', 'user', 'movie']
 
 
-class MovieToWatchSerializerDetail(serializers.HyperlinkedModelSerializer):
+class MovieToWatchSerializerDetail(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     """
     Сериализатор, используемый для отображения конкретного фильма желаемого к просмотру
     """
@@ -226,3 +378,71 @@ class MovieToWatchSerializerDetail(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = FilmsToWatch
         fields = ['id', 'user', 'movie']
+
+
+class FilmReferenceSerializer(serializers.Serializer):
+    """
+    Сериализатор ссылки на фильм или сериал по id, используется в пакетных операциях со списками
+    """
+
+    movie = serializers.IntegerField(required=False, allow_null=True)
+    tv = serializers.IntegerField(required=False, allow_null=True)
+
+    def validate(self, attrs):
+        if attrs.get('movie') is None and attrs.get('tv') is None:
+            raise serializers.ValidationError('Укажите фильм или сериал')
+        elif attrs.get('movie') is not None and attrs.get('tv') is not None:
+            raise serializers.ValidationError('Укажите или фильм или сериал')
+        return attrs
+
+
+class WatchedBatchItemSerializer(FilmReferenceSerializer):
+    """
+    Сериализатор фильма или сериала, добавляемого в список просмотренного пакетно
+    """
+
+    score = serializers.DecimalField(
+        max_digits=3, decimal_places=1, min_value=Decimal('0'), max_value=Decimal('10'), required=False, allow_null=True
+    )
+    review = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    Сериализатор пакетного изменения списка: add - добавляемые записи, remove - удаляемые.
+    Существование всех фильмов и сериалов проверяется двумя запросами на всю пачку.
+    Каждый из списков содержит не больше BATCH_MAX_ITEMS записей.
+    """
+
+    add = FilmReferenceSerializer(many=True, required=False, default=list, max_length=BATCH_MAX_ITEMS)
+    remove = FilmReferenceSerializer(many=True, required=False, default=list, max_length=BATCH_MAX_ITEMS)
+
+    def validate(self, attrs):
+        references = attrs['add'] + attrs['remove']
+        errors = []
+        for field, model in (('movie', Movie), ('tv', TV)):
+            ids = {reference[field] for reference in references if reference.get(field) is not None}
+            missing = ids - set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            errors += [f'{field} {pk} не найден' for pk in sorted(missing)]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
+
+    @staticmethod
+    def split(references) -> tuple:
+        """
+        Разделяет ссылки на списки id фильмов и сериалов
+        """
+
+        return (
+            [reference['movie'] for reference in references if reference.get('movie') is not None],
+            [reference['tv'] for reference in references if reference.get('tv') is not None],
+        )
+
+
+class WatchedBatchSerializer(BatchSerializer):
+    """
+    Сериализатор пакетного изменения списка просмотренного
+    """
+
+    add = WatchedBatchItemSerializer(many=True, required=False, default=list, max_length=BATCH_MAX_ITEMS)
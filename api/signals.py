@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from film_library.api.models import TV, Movie, FilmsWatched, FilmsToWatch
+
+
+def create_extensions(using, **kwargs):
+    """
+    Перед применением миграций создаются расширения PostgreSQL, необходимые для индексов и поиска
+    """
+
+    from django.db import connections
+
+    with connections[using].cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Movie)
+@receiver(pre_delete, sender=TV)
+def delete_list_entries(sender, instance, using, **kwargs):
+    """
+    Перед удалением пользователя, фильма или сериала их записи в списках удаляются запросами ListQuerySet.delete,
+    которые вычитают оценки из рейтинга и записи из счётчиков пользователей и ставят в очередь пересчёт строк
+    таблицы рейтингов, - по два запроса на удаляемый объект вместо нескольких запросов на каждую запись.
+    Каскадное удаление записей списков после этого ничего не находит.
+    """
+
+    field = 'user' if sender is User else sender._meta.model_name
+    for model in (FilmsWatched, FilmsToWatch):
+        model.objects.db_manager(using).filter(**{field: instance}).delete()
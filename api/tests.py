@@ -1,3 +1,1157 @@
-from django.test import TestCase
+import asyncio
+import csv
+import importlib
+import io
+import json
+import random
+import threading
+from base64 import b64encode
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, connections, router
+from django.db.models import Count, Sum
+from django.db.models.functions import Now
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from rest_framework.test import APIClient, APITestCase
+from rest_framework.response import Response
+from rest_framework.serializers import ValidationError
+from film_library.api import batch
+from film_library.api.benchmark import endpoint_cases
+from film_library.api.fastpath import FastRows
+from film_library.api.importers import import_films
+from film_library.api.models import (
+    RANKING_JOBS, SCORE_BUCKETS, TV, Movie, FilmRanking, FilmsWatched, FilmsToWatch, Job, UserStats,
+    USER_STATS_COUNTERS, refresh_user_stats,
+)
+from film_library.api.jobs import (
+    JOB_HANDLERS, JOB_LEASE_SECONDS, RECOMMENDATIONS_DELAY_SECONDS, RECOMMENDATIONS_JOB, claim_jobs, prune_jobs,
+    run_jobs,
+)
+from film_library.api.leaderboards import LEADERBOARD_MIN_VOTES, refresh_leaderboards
+from film_library.api.recommendations import build_neighbours
+from film_library.api.routers import ReplicaRoutingMiddleware, read_alias
+from film_library.api.seeding import seed_database
+from film_library.api.serializers import BATCH_MAX_ITEMS
 
-# Create your tests here.
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class QueryCountTest(APITestCase):
+    """
+    Проверка, что количество SQL-запросов списков не зависит от количества записей на странице
+    """
+
+    list_urls = [
+        'movie-list', 'tv-list', 'watched-list', 'movie-watched-list', 'tv-watched-list',
+        'to-watch-list', 'movie-to-watch-list', 'tv-to-watch-list', 'user-list',
+    ]
+
+    expand_urls = [
+        'watched-list', 'movie-watched-list', 'tv-watched-list',
+        'to-watch-list', 'movie-to-watch-list', 'tv-to-watch-list',
+    ]
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_authenticate(self.admin)
+        self.rows = 0
+
+    def add_rows(self, count: int) -> None:
+        """
+        Добавляет count фильмов и сериалов, каждый со своим пользователем, оценкой и записью в списках
+        """
+
+        for i in range(self.rows, self.rows + count):
+            user = User.objects.create(username=f'user{i}')
+            movie = Movie.objects.create(title=f'movie{i}', year=2000, added_by=user)
+            tv = TV.objects.create(title=f'tv{i}', year=2000, added_by=user)
+            watched_movie = Movie.objects.create(title=f'watched movie{i}', year=2000, added_by=user)
+            watched_tv = TV.objects.create(title=f'watched tv{i}', year=2000, added_by=user)
+            FilmsWatched.objects.create(user=self.admin, movie=watched_movie, score=Decimal('7.5'))
+            FilmsWatched.objects.create(user=self.admin, tv=watched_tv, score=Decimal('6.0'))
+            FilmsWatched.objects.create(user=user, movie=movie, score=Decimal('5.0'))
+            FilmsToWatch.objects.create(user=self.admin, movie=movie)
+            FilmsToWatch.objects.create(user=self.admin, tv=tv)
+        self.rows += count
+
+    def count_queries(self, url: str) -> int:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def get_urls(self) -> list:
+        return ([reverse(name) for name in self.list_urls] + [reverse('user-list') + '?summary=true']
+                + [reverse(name) + '?expand=film' for name in self.expand_urls])
+
+    def test_list_query_count_is_constant(self):
+        self.add_rows(1)
+        expected = {url: self.count_queries(url) for url in self.get_urls()}
+
+        self.add_rows(4)
+        for url in self.get_urls():
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), expected[url])
+
+    def test_user_summary_counts(self):
+        self.add_rows(2)
+        fields = ['tv_added', 'movies_added', 'films_watched', 'films_to_watch']
+        users = {
+            user['username']: [user[field] for field in fields]
+            for user in self.client.get(reverse('user-list') + '?summary=true').data['results']
+        }
+        self.assertEqual(users, {'admin': [0, 0, 4, 4], 'user0': [2, 2, 1, 0], 'user1': [2, 2, 1, 0]})
+
+
+class BatchTest(APITestCase):
+    """
+    Проверка пакетного изменения списков: количество запросов не зависит от размера пачки,
+    правила те же, что и для одиночных записей
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+        self.movies = [Movie.objects.create(title=f'фильм {i}', year=2000, added_by=self.user) for i in range(6)]
+        self.show = TV.objects.create(title='сериал', year=2000, added_by=self.user)
+
+    def post(self, name: str, data: dict):
+        return self.client.post(reverse(name), data, format='json')
+
+    def count_queries(self, name: str, data: dict) -> int:
+        with CaptureQueriesContext(connection) as context:
+            response = self.post(name, data)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_query_count_is_constant(self):
+        for name, remove in (('to-watch-batch', 'watched-batch'), ('watched-batch', 'to-watch-batch')):
+            with self.subTest(url=name):
+                small = self.count_queries(name, {'add': [{'movie': self.movies[0].pk}, {'tv': self.show.pk}]})
+                large = self.count_queries(
+                    name, {'add': [{'movie': movie.pk} for movie in self.movies[1:]] + [{'tv': self.show.pk}]}
+                )
+                self.assertEqual(small, large)
+                self.post(name, {'remove': [{'movie': movie.pk} for movie in self.movies] + [{'tv': self.show.pk}]})
+
+    def test_list_rules(self):
+        self.post('to-watch-batch', {'add': [{'movie': movie.pk} for movie in self.movies[:2]]})
+        response = self.post('watched-batch', {'add': [{'movie': self.movies[0].pk, 'score': '8.5'}]})
+        self.assertEqual(response.data, {'added': 1, 'removed': 0})
+        self.assertEqual(list(FilmsToWatch.objects.values_list('movie', flat=True)), [self.movies[1].pk])
+        self.assertEqual(Movie.objects.get(pk=self.movies[0].pk).score_sum, Decimal('8.5'))
+
+        response = self.post('to-watch-batch', {
+            'add': [{'movie': self.movies[0].pk}, {'tv': self.show.pk}], 'remove': [{'movie': self.movies[1].pk}],
+        })
+        self.assertEqual(response.data, {'added': 1, 'removed': 1, 'rejected': [{'movie': self.movies[0].pk}]})
+        self.assertEqual(list(FilmsToWatch.objects.values_list('tv', flat=True)), [self.show.pk])
+
+        response = self.post('watched-batch', {'remove': [{'movie': self.movies[0].pk}]})
+        self.assertEqual(response.data, {'added': 0, 'removed': 1})
+        self.assertEqual(Movie.objects.get(pk=self.movies[0].pk).score_count, 0)
+
+    def test_validation(self):
+        invalid = [
+            {'add': [{'movie': self.movies[0].pk, 'tv': self.show.pk}]},
+            {'add': [{}]},
+            {'add': [{'movie': self.movies[0].pk, 'score': '10.5'}]},
+            {'remove': [{'movie': 0}]},
+            {'add': [{'movie': self.movies[0].pk}] * (BATCH_MAX_ITEMS + 1)},
+        ]
+        for data in invalid:
+            with self.subTest(data=str(data)[:100]):
+                self.assertEqual(self.post('watched-batch', data).status_code, 400)
+        self.assertEqual(self.post('to-watch-batch', {'add': [{'tv': 0}]}).status_code, 400)
+        self.assertFalse(FilmsWatched.objects.exists())
+        self.assertFalse(FilmsToWatch.objects.exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class FastReadPathTest(APITestCase):
+    """
+    Проверка, что быстрый путь чтения списков отдаёт побайтно тот же ответ, что и сериализаторы DRF
+    """
+
+    urls = [
+        '/movie/', '/movie/?page=2', '/movie/?pagination=cursor', '/movie/?search=фильм', '/movie/?genre=drama',
+        '/tv/', '/watched-list/', '/watched-list/?page=2', '/watched-list/?pagination=cursor',
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='пользователь\u2028', password='admin')
+        self.client.force_authenticate(self.user)
+        other = User.objects.create(username='other')
+        for i in range(15):
+            movie = Movie.objects.create(
+                title=f'фильм «{i}» "{i}"', year=2000 + i, genre=['drama', 'ужасы'] if i % 2 else None,
+                duration=i if i % 3 else None, added_by=self.user
+            )
+            tv = TV.objects.create(title=f'tv {i}', year=2000, number_of_episodes=i + 1, added_by=other)
+            FilmsWatched.objects.create(
+                user=self.user, movie=movie, score=Decimal(i % 10) + Decimal('0.5') if i % 4 else None,
+                review='рецензия\n' if i % 2 else None
+            )
+            FilmsWatched.objects.create(user=other, movie=movie, score=Decimal('3.3'))
+            FilmsWatched.objects.create(user=self.user, tv=tv, score=Decimal('1.1'))
+
+    def test_fast_path_is_byte_identical(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                fast = self.client.get(url, HTTP_ACCEPT='application/json')
+                with override_settings(FAST_READ_PATH=False):
+                    slow = self.client.get(url, HTTP_ACCEPT='application/json')
+                self.assertEqual(fast.status_code, 200)
+                self.assertNotIsInstance(fast, Response)
+                self.assertEqual(fast.content, slow.content)
+                self.assertEqual(fast['Content-Type'], slow['Content-Type'])
+                self.assertEqual(fast['ETag'], slow['ETag'])
+
+    def test_list_requests_use_fast_path(self):
+        for url in ('/movie/', '/movie/?fields=id'):
+            patch = mock.patch.object(FastRows, 'rows', autospec=True, side_effect=FastRows.rows)
+            with self.subTest(url=url), patch as rows:
+                self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json').status_code, 200)
+                self.assertEqual(rows.called, 'fields' not in url)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class KeysetPaginationTest(APITestCase):
+    """
+    Проверка пагинации по ключу (?pagination=cursor): обход вперёд и назад при одинаковых названиях,
+    ссылки на крайних страницах, неверный курсор и отключение пагинации по ключу при поиске
+    """
+
+    def setUp(self):
+        user = User.objects.create_user(username='user', password='user')
+        for i in range(25):
+            Movie.objects.create(title=f'фильм {i % 4}', year=2000, added_by=user)
+        self.expected = list(Movie.objects.order_by('title', 'id').values_list('id', flat=True))
+
+    def walk(self, url: str, link: str) -> tuple:
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append(data)
+            url = data[link]
+        return pages, [int(item['id'].rstrip('/').rsplit('/', 1)[1]) for page in pages for item in page['results']]
+
+    def test_round_trip(self):
+        pages, ids = self.walk(reverse('movie-list') + '?pagination=cursor', 'next')
+        self.assertEqual(ids, self.expected)
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 5])
+        self.assertIsNone(pages[0]['previous'])
+        self.assertIsNone(pages[-1]['next'])
+        self.assertNotIn('count', pages[0])
+
+        pages, _ = self.walk(pages[-1]['previous'], 'previous')
+        ids = [int(item['id'].rstrip('/').rsplit('/', 1)[1]) for page in reversed(pages) for item in page['results']]
+        self.assertEqual(ids, self.expected[:20])
+        self.assertIsNone(pages[-1]['previous'])
+        self.assertIsNotNone(pages[-1]['next'])
+
+    def test_invalid_cursor(self):
+        cursors = ['не курсор', 'YWJj'] + [b64encode(raw).decode() for raw in (
+            b'[1]', b'{"v": [1], "r": 0}', b'{"v": ["a", "x"], "r": 0}', b'{"v": [{"a": 1}, 1], "r": 0}'
+        )]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(reverse('movie-list'), {'cursor': cursor}).status_code, 404)
+
+    def test_search_uses_page_numbers(self):
+        Movie.objects.create(title='другое', year=2000, added_by=User.objects.get())
+        data = self.client.get(reverse('movie-list') + '?pagination=cursor&search=фильм').json()
+        self.assertEqual(data['count'], 25)
+        self.assertEqual(len(data['results']), 10)
+        self.assertIn('page=2', data['next'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class ConditionalListTest(APITestCase):
+    """
+    Проверка ETag списков: версия строится по записям выбранной страницы без агрегации всего списка
+    и зависит от параметров представления, как и версия отдельной записи
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_authenticate(self.user)
+        for i in range(15):
+            movie = Movie.objects.create(title=f'movie {i:02}', year=2000, added_by=self.user)
+            FilmsWatched.objects.create(user=self.user, movie=movie, score=Decimal(i % 10))
+
+    def test_etag_follows_page(self):
+        urls = ['/watched-list/', '/watched-list/?page=2', '/watched-list/?fields=id', '/watched-list/?expand=film']
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        self.assertEqual(len(set(etags.values())), len(urls))
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(urls[0], HTTP_IF_NONE_MATCH=etags[urls[0]])
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in context.captured_queries if 'MAX(' in query['sql']])
+
+        # Изменение записи второй страницы не меняет версию первой, изменение фильма - версию с ?expand=film
+        last = FilmsWatched.objects.order_by('id').last()
+        FilmsWatched.objects.filter(pk=last.pk).update(review='рецензия', updated_at=Now())
+        self.assertEqual(self.client.get(urls[0], HTTP_IF_NONE_MATCH=etags[urls[0]]).status_code, 304)
+        self.assertEqual(self.client.get(urls[1], HTTP_IF_NONE_MATCH=etags[urls[1]]).status_code, 200)
+        Movie.objects.filter(pk=FilmsWatched.objects.order_by('id')[0].movie_id).update(updated_at=Now())
+        self.assertEqual(self.client.get(urls[3], HTTP_IF_NONE_MATCH=etags[urls[3]]).status_code, 200)
+
+    def test_detail_etag_follows_params(self):
+        url = reverse('watched-detail', args=[FilmsWatched.objects.order_by('id')[0].pk])
+        full = self.client.get(url)
+        sparse = self.client.get(url + '?fields=score')
+        self.assertNotEqual(full['ETag'], sparse['ETag'])
+        self.assertEqual(self.client.get(url + '?fields=score', HTTP_IF_NONE_MATCH=full['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(url + '?fields=score', HTTP_IF_NONE_MATCH=sparse['ETag']).status_code, 304)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class SparseFieldsTest(APITestCase):
+    """
+    Проверка параметров ?fields= и ?omit=: состав полей ответа и сужение запросов к БД
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_authenticate(self.user)
+        self.movie = Movie.objects.create(title='фильм', year=2000, genre=['drama'], added_by=self.user)
+        FilmsWatched.objects.create(user=self.user, movie=self.movie, score=Decimal('7'))
+
+    def get(self, url: str):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json(), ' '.join(query['sql'] for query in context.captured_queries)
+
+    def test_output_keys(self):
+        detail = reverse('movie-detail', args=[self.movie.pk])
+        cases = {
+            '/movie/?fields=id,title': {'id', 'title'},
+            '/movie/?omit=rating,added_by': {'id', 'title', 'year', 'genre', 'duration'},
+            '/movie/?fields=title,year&omit=year': {'title'},
+            detail + '?fields=title': {'title'},
+            reverse('movie-stats', args=[self.movie.pk]) + '?fields=votes,rating': {'votes', 'rating'},
+            reverse('user-stats', args=[self.user.pk]) + '?fields=username,score_count': {'username', 'score_count'},
+        }
+        for url, keys in cases.items():
+            with self.subTest(url=url):
+                data = self.get(url)[0]
+                self.assertEqual(set(data['results'][0] if 'results' in data else data), keys)
+
+    def test_queryset_is_narrowed(self):
+        score_sum = f'"{Movie._meta.db_table}"."score_sum"'
+        user_table = f'"{User._meta.db_table}"'
+        sql = self.get('/movie/')[1]
+        self.assertIn(score_sum, sql)
+        self.assertIn(user_table, sql)
+        # Без rating не загружаются столбцы оценки, без added_by - JOIN с пользователями
+        sql = self.get('/movie/?fields=id,title')[1]
+        self.assertNotIn(score_sum, sql)
+        self.assertNotIn(user_table, sql)
+
+        # Списки ссылок пользователя подгружаются prefetch, невыводимые списки не запрашиваются
+        self.assertIn(f'"{Movie._meta.db_table}"', self.get('/user/')[1])
+        self.assertNotIn(f'"{Movie._meta.db_table}"', self.get('/user/?fields=id,username')[1])
+
+        # Жанры статистики пользователя считаются отдельным запросом только если выводятся
+        url = reverse('user-stats', args=[self.user.pk])
+        self.assertIn(f'"{Movie._meta.db_table}"', self.get(url)[1])
+        self.assertNotIn(f'"{Movie._meta.db_table}"', self.get(url + '?omit=top_genres')[1])
+
+    def test_unknown_names_are_ignored(self):
+        full = set(self.get('/movie/')[0]['results'][0])
+        self.assertEqual(set(self.get('/movie/?omit=nothing')[0]['results'][0]), full)
+        self.assertEqual(set(self.get('/movie/?fields=title,nothing')[0]['results'][0]), {'title'})
+        self.assertEqual(self.get('/movie/?fields=nothing')[0]['results'], [{}])
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'response-cache-test',
+}})
+class ResponseCacheTest(APITestCase):
+    """
+    Проверка кэша ответов каталога: повторный запрос читается из кэша после проверок аутентификации,
+    изменения списков и импорт делают недействительными ответы со списком и с изменённой записью
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_authenticate(self.user)
+        self.movie = Movie.objects.create(title='фильм', year=2000, added_by=self.user)
+        self.urls = [reverse('movie-list'), reverse('movie-detail', kwargs={'pk': self.movie.pk})]
+
+    def get(self) -> list:
+        return [self.client.get(url, HTTP_ACCEPT='application/json').json() for url in self.urls]
+
+    def test_cache_hit(self):
+        expected = self.get()
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get(), expected)
+        self.assertEqual(context.captured_queries, [])
+
+        # Ответ из кэша не отменяет аутентификацию: неверный пароль отклоняется
+        self.client.force_authenticate(None)
+        credentials = b64encode(b'admin:wrong').decode()
+        response = self.client.get(
+            self.urls[0], HTTP_ACCEPT='application/json', HTTP_AUTHORIZATION=f'Basic {credentials}'
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalidation_on_commit(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('watched-batch'), {'add': [{'movie': self.movie.pk, 'score': 8}]}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([data['rating'] for data in (self.get()[0]['results'][0], self.get()[1])], [8.0, 8.0])
+
+        watched = FilmsWatched.objects.get(movie=self.movie)
+        watched.score = Decimal(4)
+        with self.captureOnCommitCallbacks(execute=True):
+            watched.save()
+        self.assertEqual(self.get()[1]['rating'], 4.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.generic(
+                'POST', reverse('movie-import'), json.dumps({'title': 'новый', 'year': 2001}, ensure_ascii=False),
+                content_type='application/x-ndjson'
+            ).getvalue()
+        self.assertEqual(self.get()[0]['count'], 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class ImportTest(APITestCase):
+    """
+    Проверка массового импорта: корректные строки добавляются, ошибочные (в том числе отклонённые БД)
+    попадают в отчёт и не прерывают импорт остальных
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_authenticate(self.user)
+
+    def post(self, lines: list, content_type: str = 'application/x-ndjson') -> list:
+        response = self.client.generic('POST', reverse('movie-import'), '\n'.join(lines), content_type=content_type)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in response.getvalue().decode().splitlines()]
+
+    def test_valid_rows(self):
+        reports = self.post([
+            json.dumps({'title': 'фильм', 'year': 2000, 'genre': ['drama'], 'duration': 90}),
+            json.dumps({'title': 'другой фильм', 'year': 2001}),
+        ])
+        self.assertEqual(reports, [{'created': 2, 'failed': 0}])
+        self.assertEqual(list(Movie.objects.search('другой').values_list('title', flat=True)), ['другой фильм'])
+
+        reports = self.post(['title,year,genre', 'csv,2002,drama;ужасы'], content_type='text/csv')
+        self.assertEqual(reports, [{'created': 1, 'failed': 0}])
+        self.assertEqual(Movie.objects.get(title='csv').genre, ['drama', 'ужасы'])
+
+    def test_invalid_rows(self):
+        rows = [
+            '{не json', '[1]', {'title': 'жанр строкой', 'year': 2000, 'genre': 'drama'},
+            {'title': 'жанр числом', 'year': 2000, 'genre': 5}, {'title': {'a': 1}, 'year': 2000},
+            {'title': 'год', 'year': 1500}, {'title': 'длительность', 'year': 2000, 'duration': 10 ** 30},
+            {'year': 2000},
+        ]
+        reports = self.post([row if isinstance(row, str) else json.dumps(row) for row in rows])
+        self.assertEqual([report.get('line') for report in reports], [*range(1, len(rows) + 1), None])
+        self.assertEqual(reports[-1], {'created': 0, 'failed': len(rows)})
+        self.assertEqual(reports[2]['errors'], {'genre': ['Ожидается список строк']})
+        self.assertFalse(Movie.objects.exists())
+
+    def test_mixed_batch(self):
+        # Символ NUL проходит валидаторы модели, но отклоняется БД: пачка с ним добавляется по одной строке
+        rows = [{'title': f'фильм {i}', 'year': 2000} for i in range(5)]
+        rows[1]['title'] = 'nul\u0000'
+        rows[3]['year'] = 3000
+        lines = [(number, row, None) for number, row in enumerate(rows, start=1)]
+        reports = list(import_films(Movie, lines, added_by=self.user, batch_size=2))
+        self.assertEqual([report.get('line') for report in reports], [2, 4, None])
+        self.assertEqual(reports[-1], {'created': 3, 'failed': 2})
+        self.assertEqual(sorted(Movie.objects.values_list('title', flat=True)), ['фильм 0', 'фильм 2', 'фильм 4'])
+
+
+class ExportTest(APITestCase):
+    """
+    Проверка потоковой выгрузки списков в NDJSON и CSV
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+        other = User.objects.create_user(username='other', password='other')
+        for i in range(5):
+            movie = Movie.objects.create(title=f'фильм {i}', year=2000 + i, added_by=self.user)
+            tv = TV.objects.create(title=f'tv, "{i}"', year=2010, added_by=self.user)
+            FilmsWatched.objects.create(user=self.user, movie=movie, score=Decimal('7.5'), review='хорошо,\n"да"')
+            FilmsToWatch.objects.create(user=self.user, tv=tv)
+            FilmsWatched.objects.create(user=other, movie=movie)
+
+    def test_ndjson(self):
+        response = self.client.get(reverse('watched-export'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(
+            {key: rows[0][key] for key in ('type', 'title', 'year', 'score', 'review')},
+            {'type': 'movie', 'title': 'фильм 0', 'year': 2000, 'score': '7.5', 'review': 'хорошо,\n"да"'}
+        )
+
+    def test_csv(self):
+        response = self.client.get(reverse('to-watch-export') + '?format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['id', 'type', 'film', 'title', 'year', 'updated_at'])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][1:5], ['tv', str(TV.objects.get(title='tv, "0"').pk), 'tv, "0"', '2010'])
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse('watched-export')).status_code, 403)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class FilmStatsTest(APITestCase):
+    """
+    Проверка статистики оценок: гистограмма и количество отзывов обновляются при добавлении, изменении
+    и удалении записей любым способом и совпадают с полным пересчётом
+    """
+
+    def test_stats(self):
+        users = [User.objects.create_user(username=f'user{i}', password='user') for i in range(4)]
+        movie = Movie.objects.create(title='фильм', year=2000, added_by=users[0])
+        FilmsWatched.objects.create(user=users[0], movie=movie, score=Decimal('7.5'), review='отзыв')
+        FilmsWatched.objects.create(user=users[1], movie=movie, score=Decimal('10'))
+        FilmsWatched.objects.watch(users[2].pk, 'movie_id', {movie.pk: (Decimal('3'), 'отзыв')})
+        FilmsWatched.objects.watch(users[3].pk, 'movie_id', {movie.pk: (Decimal('4'), '')})
+        watched = FilmsWatched.objects.get(user=users[1])
+        watched.score = Decimal('8.5')
+        watched.save()
+        FilmsWatched.objects.unwatch(users[3].pk, 'movie_id', [movie.pk])
+
+        data = self.client.get(reverse('movie-stats', args=[movie.pk])).data
+        self.assertEqual((data['votes'], data['reviews'], data['median']), (3, 2, Decimal('7.5')))
+        self.assertEqual({score: count for score, count in data['histogram'].items() if count},
+                         {'3.0': 1, '7.5': 1, '8.5': 1})
+
+        FilmsWatched.objects.filter(user=users[0]).delete()
+        maintained = Movie.objects.values_list('score_histogram', 'review_count').get()
+        Movie.objects.all().refresh_ratings()
+        self.assertEqual(maintained, Movie.objects.values_list('score_histogram', 'review_count').get())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class RatingMaintenanceTest(APITestCase):
+    """
+    Проверка, что рейтинг фильмов и счётчики пользователей после добавления, изменения и удаления записей
+    любым способом, в том числе каскадного, совпадают с полным пересчётом командой rebuild_ratings,
+    а каскадное удаление выполняется постоянным количеством запросов
+    """
+
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'user{i}', password='user') for i in range(4)]
+        self.movies = [Movie.objects.create(title=f'фильм {i}', year=2000, added_by=self.users[0]) for i in range(6)]
+        self.show = TV.objects.create(title='сериал', year=2000, added_by=self.users[0])
+
+    def state(self) -> tuple:
+        empty = [0] * SCORE_BUCKETS
+        films = [
+            (model._meta.model_name, pk, score_sum, score_count, histogram or empty, reviews)
+            for model in (Movie, TV)
+            for pk, score_sum, score_count, histogram, reviews in model.objects.order_by('pk').values_list(
+                'pk', 'score_sum', 'score_count', 'score_histogram', 'review_count'
+            )
+        ]
+        stats = {row[0]: row[1:] for row in UserStats.objects.values_list('user', *USER_STATS_COUNTERS)}
+        return films, stats
+
+    def assert_consistent(self) -> None:
+        films, stats = self.state()
+        call_command('rebuild_ratings', stdout=io.StringIO())
+        rebuilt_films, rebuilt_stats = self.state()
+        self.assertEqual(films, rebuilt_films)
+        for user, counters in rebuilt_stats.items():
+            self.assertEqual(stats.get(user, (0,) * len(USER_STATS_COUNTERS)), counters)
+
+    def test_create_update_delete(self):
+        first, second, third, _ = self.users
+        FilmsWatched.objects.create(user=first, movie=self.movies[0], score=Decimal('7.5'), review='отзыв')
+        FilmsWatched.objects.create(user=second, movie=self.movies[0], score=Decimal('4'))
+        FilmsWatched.objects.create(user=second, tv=self.show, score=Decimal('9'), review='отзыв')
+        FilmsToWatch.objects.create(user=third, movie=self.movies[0])
+        FilmsToWatch.objects.create(user=third, tv=self.show)
+        self.assert_consistent()
+
+        watched = FilmsWatched.objects.get(user=second, movie=self.movies[0])
+        watched.score, watched.review = Decimal('6.5'), 'новый отзыв'
+        watched.save()
+        FilmsWatched.objects.create(user=third, movie=self.movies[0], score=Decimal('2'))
+        self.assert_consistent()
+
+        FilmsWatched.objects.get(user=first).delete()
+        FilmsWatched.objects.filter(tv=self.show).delete()
+        FilmsToWatch.objects.filter(user=third).delete()
+        self.assert_consistent()
+
+    def count_delete_queries(self, obj) -> int:
+        with CaptureQueriesContext(connection) as context:
+            obj.delete()
+        return len(context.captured_queries)
+
+    def test_cascade_delete(self):
+        for i, user in enumerate(self.users):
+            rows = 1 if i % 2 == 0 else len(self.movies)
+            for movie in self.movies[:rows]:
+                FilmsWatched.objects.create(user=user, movie=movie, score=Decimal(i + 5), review='отзыв')
+            FilmsToWatch.objects.create(user=user, tv=self.show)
+
+        self.assertEqual(self.count_delete_queries(self.users[2]), self.count_delete_queries(self.users[3]))
+        self.assert_consistent()
+
+        self.assertEqual(FilmsWatched.objects.filter(movie=self.movies[0]).count(), 2)
+        self.assertEqual(self.count_delete_queries(self.movies[0]), self.count_delete_queries(self.movies[1]))
+        self.assertEqual(self.count_delete_queries(self.show), self.count_delete_queries(self.movies[2]))
+        self.assert_consistent()
+        self.assertEqual(UserStats.objects.get(user=self.users[1]).movies_watched, len(self.movies) - 3)
+
+    def test_rebuild_ratings(self):
+        FilmsWatched.objects.create(user=self.users[0], movie=self.movies[0], score=Decimal('7.5'), review='отзыв')
+        FilmsWatched.objects.create(user=self.users[1], movie=self.movies[0], score=Decimal('5'))
+        Movie.objects.filter(pk=self.movies[0].pk).update(score_sum=0, score_count=0, score_histogram=None,
+                                                           review_count=0)
+        UserStats.objects.filter(user=self.users[0]).update(movies_watched=0, score_sum=0, score_count=0)
+
+        call_command('rebuild_ratings', stdout=io.StringIO())
+        movie = Movie.objects.get(pk=self.movies[0].pk)
+        self.assertEqual((movie.score_sum, movie.score_count, movie.review_count), (Decimal('12.5'), 2, 1))
+        self.assertEqual(movie.score_median, Decimal('6.25'))
+        stats = UserStats.objects.get(user=self.users[0])
+        self.assertEqual((stats.movies_watched, stats.score_sum, stats.score_count), (1, Decimal('7.5'), 1))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class LeaderboardTest(APITestCase):
+    """
+    Проверка лидербордов: байесовская оценка, минимальное количество оценок и фильтры
+    """
+
+    def setUp(self):
+        users = [User.objects.create_user(username=f'user{i}', password='user') for i in range(LEADERBOARD_MIN_VOTES)]
+        self.popular = Movie.objects.create(title='популярный', year=1995, genre=['drama'], added_by=users[0])
+        self.single = Movie.objects.create(title='одна оценка', year=2005, genre=['drama'], added_by=users[0])
+        self.show = TV.objects.create(title='сериал', year=1995, genre=['comedy'], added_by=users[0])
+        for user in users:
+            FilmsWatched.objects.create(user=user, movie=self.popular, score=Decimal('8'))
+            FilmsToWatch.objects.create(user=user, tv=self.show)
+        FilmsWatched.objects.create(user=users[0], movie=self.single, score=Decimal('10'))
+
+    def test_leaderboards(self):
+        refresh_leaderboards()
+        top = self.client.get(reverse('leaderboard', args=['top-rated'])).data['results']
+        self.assertEqual([item['movie']['title'] for item in top], ['популярный'])
+        mean = (8 * LEADERBOARD_MIN_VOTES + 10) / (LEADERBOARD_MIN_VOTES + 1)
+        self.assertAlmostEqual(top[0]['bayesian_rating'], (LEADERBOARD_MIN_VOTES * mean + 80) / 20)
+
+        watched = self.client.get(reverse('leaderboard', args=['most-watched']) + '?year_max=2000').data['results']
+        self.assertEqual([item['watched_count'] for item in watched], [LEADERBOARD_MIN_VOTES])
+        wanted = self.client.get(reverse('leaderboard', args=['most-wanted']) + '?type=tv&genre=comedy')
+        self.assertEqual([item['tv']['title'] for item in wanted.data['results']], ['сериал'])
+        self.assertEqual(self.client.get(reverse('leaderboard', args=['unknown'])).status_code, 404)
+
+
+class RecommendationsTest(APITestCase):
+    """
+    Проверка рекомендаций: похожие по оценкам фильмы рекомендуются, просмотренные и желаемые к просмотру - нет
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='user')
+        self.client.force_authenticate(self.user)
+        self.movies = [Movie.objects.create(title=f'фильм {i}', year=2000, added_by=self.user) for i in range(4)]
+        # Фильмы 0 и 1 нравятся и не нравятся одним и тем же пользователям, фильм 2 - наоборот
+        for i in range(6):
+            other = User.objects.create_user(username=f'user{i}', password='user')
+            liked = i % 2 == 0
+            for movie, score in zip(self.movies, ('9' if liked else '3', '9' if liked else '3', '3' if liked else '9')):
+                FilmsWatched.objects.create(user=other, movie=movie, score=Decimal(score))
+        FilmsWatched.objects.create(user=self.user, movie=self.movies[0], score=Decimal('9'))
+        FilmsWatched.objects.create(user=self.user, movie=self.movies[3], score=Decimal('5'))
+
+    def test_recommendations(self):
+        build_neighbours()
+        response = self.client.get(reverse('recommendations'))
+        self.assertEqual(
+            [item['title'] for item in response.data], ['фильм 1'],
+        )
+        self.assertGreater(response.data[0]['predicted_score'], 7)
+
+        FilmsToWatch.objects.create(user=self.user, movie=self.movies[1])
+        self.assertEqual(self.client.get(reverse('recommendations')).data, [])
+
+    def test_rebuild_job(self):
+        # Пересчёт рейтингов после изменения оценок ставит в очередь одно отложенное обновление таблицы соседей
+        self.assertEqual(run_jobs(), (4, 0))
+        job = Job.objects.get()
+        self.assertEqual((job.kind, job.key), (RECOMMENDATIONS_JOB, RECOMMENDATIONS_JOB))
+        self.assertEqual(run_jobs(), (0, 0))
+
+        Job.objects.update(run_after=Now() - timedelta(seconds=RECOMMENDATIONS_DELAY_SECONDS))
+        self.assertEqual(run_jobs(), (1, 0))
+        self.assertEqual([item['title'] for item in self.client.get(reverse('recommendations')).data], ['фильм 1'])
+
+
+class UserStatsTest(APITestCase):
+    """
+    Проверка статистики пользователя: счётчики обновляются при изменении списков любым способом,
+    статистика доступна только самому пользователю и суперпользователям
+    """
+
+    def test_stats(self):
+        user, other = (User.objects.create_user(username=name, password='user') for name in ('user', 'other'))
+        movies = [Movie.objects.create(title=f'фильм {i}', year=2000, genre=['drama'], added_by=user) for i in range(3)]
+        show = TV.objects.create(title='сериал', year=2000, genre=['comedy', 'drama'], added_by=user)
+        self.client.force_authenticate(user)
+        url = reverse('user-stats', args=[user.pk])
+        self.assertEqual(self.client.get(url).data['movies_watched'], 0)
+
+        batch.add_to_watch(user, [movie.pk for movie in movies], [show.pk])
+        batch.add_watched(user, [{'movie': movies[0].pk, 'score': Decimal('8')}, {'tv': show.pk}])
+        FilmsWatched.objects.create(user=user, movie=movies[1], score=Decimal('5'))
+        FilmsWatched.objects.filter(user=user, tv=show).update(score=Decimal('9.5'))
+        FilmsWatched.objects.get(user=user, movie=movies[1]).delete()
+        data = self.client.get(url).data
+        counters = ('movies_watched', 'tv_watched', 'score_count', 'movies_to_watch', 'tv_to_watch')
+        self.assertEqual([data[field] for field in counters], [1, 1, 2, 1, 0])
+        self.assertEqual(data['average_score'], Decimal('8.75'))
+        self.assertEqual(data['top_genres'], [{'genre': 'drama', 'count': 2}, {'genre': 'comedy', 'count': 1}])
+
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class JobQueueTest(APITestCase):
+    """
+    Проверка очереди фоновых заданий: изменения списков ставят в очередь пересчёт строк таблицы рейтингов,
+    одинаковые задания объединяются, ошибка обработчика откладывает задание до повторной попытки,
+    после последней попытки, в том числе после истечения аренды, задание хранится до удаления prune_jobs
+    """
+
+    def test_jobs(self):
+        user, other = (User.objects.create_user(username=name, password='user') for name in ('user', 'other'))
+        movie = Movie.objects.create(title='фильм', year=2000, added_by=user)
+        show = TV.objects.create(title='сериал', year=2000, added_by=user)
+        batch.add_to_watch(user, [movie.pk], [show.pk])
+        batch.add_watched(user, [{'movie': movie.pk, 'score': Decimal('8')}])
+        FilmsWatched.objects.create(user=other, movie=movie)
+        self.assertEqual(
+            sorted(Job.objects.values_list('kind', 'key')),
+            [(RANKING_JOBS['movie_id'], str(movie.pk)), (RANKING_JOBS['tv_id'], str(show.pk))],
+        )
+
+        self.assertEqual(run_jobs(), (2, 0))
+        rankings = Job.objects.exclude(kind=RECOMMENDATIONS_JOB)
+        self.assertEqual(FilmRanking.objects.get(movie=movie).watched_count, 2)
+        self.assertEqual(FilmRanking.objects.get(tv=show).to_watch_count, 1)
+
+        def fail(keys):
+            raise RuntimeError('ошибка')
+
+        FilmsWatched.objects.filter(user=other).delete()
+        with mock.patch.dict(JOB_HANDLERS, {RANKING_JOBS['movie_id']: fail}):
+            self.assertEqual(run_jobs(), (0, 1))
+        job = rankings.get()
+        self.assertEqual((job.attempts, job.last_error, job.claimed_at), (1, 'RuntimeError: ошибка', None))
+        self.assertEqual(run_jobs(), (0, 0))
+
+        # Новое изменение объединяется с отложенным заданием, и оно выполняется сразу
+        Job.objects.enqueue(RANKING_JOBS['movie_id'], [movie.pk])
+        self.assertEqual(rankings.get().attempts, 1)
+        self.assertEqual(run_jobs(), (1, 0))
+        self.assertEqual(FilmRanking.objects.get(movie=movie).watched_count, 1)
+
+        Job.objects.enqueue(RANKING_JOBS['movie_id'], [movie.pk])
+        with mock.patch.dict(JOB_HANDLERS, {RANKING_JOBS['movie_id']: fail}):
+            with mock.patch('film_library.api.jobs.JOB_MAX_ATTEMPTS', 1):
+                self.assertEqual(run_jobs(), (0, 1))
+        self.assertIsNotNone(rankings.get().failed_at)
+        Job.objects.enqueue(RANKING_JOBS['movie_id'], [movie.pk])
+        self.assertEqual(rankings.filter(failed_at__isnull=True).count(), 1)
+        self.assertEqual(prune_jobs(days=0), 1)
+        self.assertEqual(run_jobs(), (1, 0))
+
+    def test_expired_lease_uses_attempts(self):
+        Job.objects.enqueue(RANKING_JOBS['movie_id'], ['1'])
+        with mock.patch('film_library.api.jobs.JOB_MAX_ATTEMPTS', 2):
+            # Обработчик останавливается, не завершив задание, и аренда истекает
+            for attempts in (1, 2):
+                self.assertEqual([job[3] for job in claim_jobs(10)], [attempts])
+                self.assertEqual(claim_jobs(10), [])
+                Job.objects.update(run_after=Now() - timedelta(seconds=JOB_LEASE_SECONDS))
+            self.assertEqual(claim_jobs(10), [])
+        job = Job.objects.get()
+        self.assertEqual(job.attempts, 2)
+        self.assertIsNotNone(job.failed_at)
+        self.assertEqual(run_jobs(), (0, 0))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class ListTransitionRaceTest(TransactionTestCase):
+    """
+    Параллельные переносы одних и тех же фильмов между списками просмотренного и желаемого к просмотру:
+    запись не должна оказаться в обоих списках или задвоиться, рейтинг должен совпадать с оценками
+    """
+
+    threads = 8
+    iterations = 25
+
+    def setUp(self):
+        self.user = User.objects.create(username='user')
+        self.movies = [Movie.objects.create(title=f'movie{i}', year=2000, added_by=self.user) for i in range(3)]
+        self.tv = TV.objects.create(title='tv', year=2000, added_by=self.user)
+
+    def worker(self, seed: int, errors: list) -> None:
+        rnd = random.Random(seed)
+        try:
+            for _ in range(self.iterations):
+                movie = rnd.choice(self.movies)
+                score = Decimal(rnd.randint(0, 100)) / 10
+                action = rnd.randrange(5)
+                try:
+                    if action == 0:
+                        FilmsWatched.objects.create(user=self.user, movie=movie, score=score)
+                    elif action == 1:
+                        FilmsToWatch.objects.create(user=self.user, movie=movie)
+                    elif action == 2:
+                        batch.add_watched(self.user, [{'movie': movie.pk, 'score': score}, {'tv': self.tv.pk}])
+                    elif action == 3:
+                        batch.remove_watched(self.user, [movie.pk], [self.tv.pk])
+                    else:
+                        batch.add_to_watch(self.user, [m.pk for m in self.movies], [self.tv.pk])
+                except ValidationError:
+                    pass
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    def test_concurrent_transitions(self):
+        errors = []
+        workers = [threading.Thread(target=self.worker, args=(seed, errors)) for seed in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+
+        for column in ('movie', 'tv'):
+            watched = set(FilmsWatched.objects.filter(**{f'{column}__isnull': False}).values_list(column, flat=True))
+            to_watch = set(FilmsToWatch.objects.filter(**{f'{column}__isnull': False}).values_list(column, flat=True))
+            self.assertEqual(watched & to_watch, set())
+            for model in (FilmsWatched, FilmsToWatch):
+                duplicates = model.objects.filter(**{f'{column}__isnull': False}).values(column).annotate(
+                    rows=Count('pk')
+                ).filter(rows__gt=1)
+                self.assertFalse(duplicates.exists())
+
+        for film in [*Movie.objects.all(), *TV.objects.all()]:
+            scores = FilmsWatched.objects.filter(**{type(film)._meta.model_name: film}).aggregate(
+                total=Sum('score'), count=Count('score')
+            )
+            self.assertEqual(film.score_sum, scores['total'] or 0)
+            self.assertEqual(film.score_count, scores['count'])
+
+        stats = UserStats.objects.get(user=self.user)
+        refresh_user_stats([self.user.pk])
+        self.assertEqual(
+            [getattr(stats, field) for field in USER_STATS_COUNTERS],
+            list(UserStats.objects.values_list(*USER_STATS_COUNTERS).get(user=self.user)),
+        )
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class AsyncReadViewsTest(TransactionTestCase):
+    """
+    Проверка, что асинхронные представления (ASGI-запросы) отдают те же ответы, что и синхронные.
+    Асинхронные представления создаются только с ASYNC_READ_VIEWS = True, поэтому на время теста URL загружаются заново
+    """
+
+    @staticmethod
+    def reload_urls():
+        importlib.reload(importlib.import_module('film_library.api.urls'))
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    urls = [
+        '/movie/', '/movie/?page=2', '/movie/?page=last', '/movie/?page=9', '/movie/?pagination=cursor',
+        '/tv/?search=tv', '/search/?search=movie', '/watched-list/', '/watched-list/?expand=film',
+        '/to-watch-list/tv/?fields=id',
+    ]
+
+    def setUp(self):
+        # У каждого вызова async_to_sync свой пул потоков, поэтому постоянные соединения его потоков
+        # оставались бы открытыми после теста: в тесте соединения закрываются после каждого вызова
+        patcher = mock.patch.dict(connection.settings_dict, {'CONN_MAX_AGE': 0})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/movie/').func))
+        with override_settings(ASYNC_READ_VIEWS=True):
+            self.reload_urls()
+        self.addCleanup(self.reload_urls)
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/movie/').func))
+
+        self.user = User.objects.create_superuser(username='admin', password='admin')
+        self.client.force_login(self.user)
+        self.async_client.cookies = self.client.cookies
+        for i in range(15):
+            movie = Movie.objects.create(title=f'movie {i}', year=2000, duration=i, added_by=self.user)
+            tv = TV.objects.create(title=f'tv {i}', year=2000, number_of_episodes=i + 1, added_by=self.user)
+            FilmsWatched.objects.create(user=self.user, movie=movie, score=Decimal(i % 10))
+            FilmsToWatch.objects.create(user=self.user, tv=tv)
+        self.urls = self.urls + [reverse('movie-detail', kwargs={'pk': movie.pk}), '/movie/0/']
+
+    def async_get(self, url: str, **headers):
+        async def get():
+            return await self.async_client.get(url, **headers)
+
+        return async_to_sync(get)()
+
+    def test_async_responses_match_sync(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.async_get(url, accept='application/json')
+                expected = self.client.get(url, HTTP_ACCEPT='application/json')
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.content, expected.content)
+                self.assertEqual(response.get('ETag'), expected.get('ETag'))
+
+    def test_conditional_get(self):
+        for url in ['/movie/', self.urls[-2]]:
+            with self.subTest(url=url):
+                etag = self.async_get(url)['ETag']
+                response = self.async_get(url, **{'if-none-match': etag})
+                self.assertEqual(response.status_code, 304)
+
+
+@override_settings(
+    REPLICA_DATABASES=['replica1', 'replica2'],
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class ReplicaRoutingTest(SimpleTestCase):
+    """
+    Проверка маршрутизации чтения: GET и HEAD читают с реплик, после успешного изменяющего запроса
+    клиент читает с основной БД, сессии всегда читаются с основной БД
+    """
+
+    def route(self, method: str, status: int = 200, **headers) -> dict:
+        routes = {}
+
+        def view(request):
+            routes.update(movie=router.db_for_read(Movie), session=router.db_for_read(Session))
+            return HttpResponse(status=status)
+
+        ReplicaRoutingMiddleware(view)(RequestFactory().generic(method, '/', **headers))
+        self.assertIsNone(read_alias.get())
+        return routes
+
+    def test_routing(self):
+        replicas = settings.REPLICA_DATABASES
+        user, other = {'HTTP_AUTHORIZATION': 'Basic dXNlcjp1c2Vy'}, {'HTTP_AUTHORIZATION': 'Basic b3RoZXI6b3RoZXI='}
+        self.assertIn(self.route('GET', **user)['movie'], replicas)
+        self.assertEqual(self.route('GET', **user)['session'], 'default')
+        self.assertEqual(self.route('POST', status=400, **user)['movie'], 'default')
+        self.assertIn(self.route('HEAD', **user)['movie'], replicas)
+
+        self.route('POST', status=201, **user)
+        self.assertEqual(self.route('GET', **user)['movie'], 'default')
+        self.assertIn(self.route('GET', **other)['movie'], replicas)
+
+
+@skipUnless('replica1' in settings.DATABASES, 'реплика не настроена (db_replicas в config.py)')
+@override_settings(
+    REPLICA_DATABASES=['replica1'],
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class ReplicaReadTest(TransactionTestCase):
+    """
+    Проверка чтения с реплики через второй алиас БД: каталог читается с реплики,
+    список просмотренного сразу после добавления фильма - с основной БД, изменения - только в основную БД
+    """
+
+    databases = '__all__'
+
+    def test_replica_reads(self):
+        user = User.objects.create_user(username='user', password='user')
+        movie = Movie.objects.create(title='фильм', year=2000, added_by=user)
+        self.client.force_login(user)
+
+        with CaptureQueriesContext(connections['replica1']) as replica:
+            self.assertEqual(self.client.get(reverse('movie-detail', args=[movie.pk])).status_code, 200)
+        self.assertTrue(replica.captured_queries)
+
+        response = self.client.post(reverse('watched-batch'), {'add': [{'movie': movie.pk}], 'remove': []},
+                                    content_type='application/json')
+        self.assertLess(response.status_code, 400)
+        with CaptureQueriesContext(connections['replica1']) as replica:
+            self.assertEqual(self.client.get(reverse('watched-list')).json()['count'], 1)
+        self.assertFalse(replica.captured_queries)
+
+        # Изменение фильма и постановка задания в очередь выполняются в БД для записи,
+        # даже если чтение текущего запроса направлено на реплику
+        token = read_alias.set('replica1')
+        try:
+            with CaptureQueriesContext(connections['replica1']) as replica:
+                movie.title = 'новое название'
+                movie.save()
+        finally:
+            read_alias.reset(token)
+        self.assertFalse(replica.captured_queries)
+        self.assertTrue(Job.objects.using('default').filter(key=str(movie.pk)).exists())
+
+
+class SeedDatabaseTest(APITestCase):
+    """
+    Проверка заполнения синтетическим набором данных непустой БД, последовательность id которой
+    опережает наибольший id (удалён последний фильм)
+    """
+
+    def test_seed_non_empty_database(self):
+        user = User.objects.create_user(username='user', password='user')
+        old_movie = Movie.objects.create(title='фильм', year=2000, added_by=user)
+        Movie.objects.create(title='удалённый фильм', year=2000, added_by=user).delete()
+        old_tv = TV.objects.create(title='сериал', year=2000, added_by=user)
+        FilmsWatched.objects.create(user=user, movie=old_movie, score=Decimal('7'))
+
+        counts = seed_database(users=20, movies=30, tv=30, watched=8, to_watch=4, seed=1)
+        self.assertEqual((Movie.objects.count(), TV.objects.count()), (31, 31))
+        self.assertEqual(FilmsWatched.objects.count(), counts['watched'] + 1)
+        self.assertEqual(FilmsToWatch.objects.count(), counts['to_watch'])
+
+        for model in (FilmsWatched, FilmsToWatch):
+            self.assertFalse(model.objects.filter(movie__isnull=True, tv__isnull=True).exists())
+            self.assertFalse(model.objects.filter(movie__isnull=False, tv__isnull=False).exists())
+            self.assertFalse(model.objects.exclude(user=user).filter(movie=old_movie).exists())
+            self.assertFalse(model.objects.exclude(user=user).filter(tv=old_tv).exists())
+        for column in ('movie', 'tv'):
+            watched = FilmsWatched.objects.filter(**{f'{column}__isnull': False}).values_list('user', column)
+            to_watch = FilmsToWatch.objects.filter(**{f'{column}__isnull': False}).values_list('user', column)
+            self.assertEqual(set(watched) & set(to_watch), set())
+
+        movie = Movie.objects.exclude(pk=old_movie.pk).filter(score_count__gt=0).first()
+        scores = FilmsWatched.objects.filter(movie=movie).aggregate(total=Sum('score'), count=Count('score'))
+        self.assertEqual((movie.score_sum, movie.score_count), (scores['total'], scores['count']))
+        self.assertGreater(Movie.objects.create(title='новый фильм', year=2000, added_by=user).pk, movie.pk)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class IndexUsageTest(TransactionTestCase):
+    """
+    Проверка индексов: EXPLAIN каждого запроса к БД, который выполняют запросы бенчмарка, на наборе данных
+    реалистичного размера. Последовательное чтение таблицы допускается только без условия и без LIMIT,
+    то есть для агрегатов по всей таблице (количество записей каталога, жанры), и для хеш-таблицы
+    соединения (например пользователи, добавившие найденные фильмы). Фильтр по редкому жанру должен
+    использовать GIN-индекс жанров.
+    """
+
+    client_class = APIClient
+    reset_sequences = True
+
+    # Запросы, для которых последовательное чтение - лучший план: последняя страница по номеру (OFFSET до конца
+    # таблицы) и фильтры, под которые попадает большая часть каталога (слова названий и жанры набора данных).
+    # Поиск и фильтр по жанру проверяются отдельно по редкому слову и редкому жанру
+    skipped_cases = {'movie-list-last-page', 'movie-list-genre', 'movie-list-search', 'search'}
+
+    def setUp(self):
+        seed_database(users=10000, movies=20000, tv=20000, watched=20, to_watch=5)
+        Movie.objects.create(title='редкое название', year=2000, genre=['редкий'], added_by=User.objects.first())
+        Movie.objects.refresh_search_vectors()
+        refresh_leaderboards()
+        try:
+            build_neighbours(full=True)
+        except ImproperlyConfigured:
+            pass
+        # Очередь заданий с отставанием обработчика: ожидающие задания ищутся по индексу
+        Job.objects.enqueue(RANKING_JOBS['movie_id'], Movie.objects.values_list('pk', flat=True))
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM ANALYZE')
+
+        heaviest = FilmsWatched.objects.values('user').annotate(rows=Count('pk')).order_by('-rows', 'user')[0]
+        User.objects.filter(pk=heaviest['user']).update(is_superuser=True, is_staff=True)
+        self.user = User.objects.get(pk=heaviest['user'])
+        self.client.force_authenticate(self.user)
+
+    def sequential_scans(self, sql: str) -> list:
+        # Пакетные операции отправляют блокировку и основной запрос одной командой, EXPLAIN - по одному запросу
+        nodes = []
+        with connection.cursor() as cursor:
+            for statement in filter(None, (part.strip() for part in sql.split(';\n'))):
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + statement)
+                nodes.append((cursor.fetchone()[0][0]['Plan'], False))
+
+        scans = []
+        while nodes:
+            node, limited = nodes.pop()
+            if node['Node Type'] == 'Hash':
+                continue
+            if node['Node Type'] == 'Seq Scan' and (limited or 'Filter' in node):
+                scans.append(node['Relation Name'])
+            limited = limited or node['Node Type'] == 'Limit'
+            nodes.extend((child, limited) for child in node.get('Plans', []))
+        return scans
+
+    def index_names(self, sql: str) -> set:
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            nodes = [cursor.fetchone()[0][0]['Plan']]
+        names = set()
+        while nodes:
+            node = nodes.pop()
+            names.add(node.get('Index Name'))
+            nodes.extend(node.get('Plans', []))
+        return names
+
+    def test_no_sequential_scans(self):
+        cases = [case for case in endpoint_cases(self.user) if case[0] not in self.skipped_cases]
+        cases += [(name, 'GET', reverse(name) + '?search=редкое', None, None) for name in ('movie-list', 'search')]
+        cases += [('movie-list', 'GET', reverse('movie-list') + '?genre=редкий', None, None)]
+
+        for name, method, url, data, content_type in cases:
+            with CaptureQueriesContext(connection) as context:
+                if method == 'GET':
+                    response = self.client.get(url)
+                else:
+                    response = self.client.generic(method, url, data, content_type=content_type)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertLess(response.status_code, 400, name)
+
+            for query in context.captured_queries:
+                if not query['sql'].lstrip().startswith(('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')):
+                    continue
+                with self.subTest(case=name, sql=query['sql'][:200]):
+                    self.assertEqual(self.sequential_scans(query['sql']), [])
+
+        # Фильтр по редкому жанру читает фильмы по GIN-индексу жанров
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('movie-list') + '?genre=редкий', HTTP_ACCEPT='application/json')
+        self.assertEqual([movie['title'] for movie in response.json()['results']], ['редкое название'])
+        genre_index = f'{Movie._meta.model_name}_genre_idx'
+        self.assertTrue([
+            query for query in context.captured_queries
+            if query['sql'].lstrip().startswith('SELECT') and genre_index in self.index_names(query['sql'])
+        ])
@@ -9,16 +9,29 @@ urlpatterns = [
     path('user/watched-list/<pk>/', views.AllUsersWatchedDetail.as_view(), name='user-watched-list'),
     path('user/to-watch-list/<pk>/', views.AllUsersToWatchDetail.as_view(), name='user-to-watch-list'),
     path('user/<pk>/', views.UserDetail.as_view(), name='user-detail'),
+    path('user/<int:pk>/stats/', views.UserStatsDetail.as_view(), name='user-stats'),
     path('movie/', views.MovieList.as_view(), name='movie-list'),
+    path('movie/import/', views.MovieImport.as_view(), name='movie-import'),
     path('movie/<pk>/', views.MovieDetail.as_view(), name='movie-detail'),
+    path('movie/<pk>/stats/', views.MovieStats.as_view(), name='movie-stats'),
     path('tv/', views.TVList.as_view(), name='tv-list'),
+    path('tv/import/', views.TVImport.as_view(), name='tv-import'),
     path('tv/<pk>/', views.TVDetail.as_view(), name='tv-detail'),
+    path('tv/<pk>/stats/', views.TVStats.as_view(), name='tv-stats'),
+    path('search/', views.SearchList.as_view(), name='search'),
+    path('genres/', views.genre_facets, name='genre-facets'),
+    path('recommendations/', views.recommendations, name='recommendations'),
+    path('leaderboard/<board>/', views.Leaderboard.as_view(), name='leaderboard'),
     path('watched-list/', views.WatchedList.as_view(), name='watched-list'),
     path('watched-list/movie/', views.MovieWatchedList.as_view(), name='movie-watched-list'),
     path('watched-list/tv/', views.TVWatchedList.as_view(), name='tv-watched-list'),
+    path('watched-list/batch/', views.WatchedBatch.as_view(), name='watched-batch'),
+    path('watched-list/export/', views.WatchedExport.as_view(), name='watched-export'),
     path('watched-list/<pk>/', views.WatchedDetail.as_view(), name='watched-detail'),
     path('to-watch-list/', views.ToWatchList.as_view(), name='to-watch-list'),
     path('to-watch-list/movie/', views.MovieToWatchList.as_view(), name='movie-to-watch-list'),
     path('to-watch-list/tv/', views.TVToWatchList.as_view(), name='tv-to-watch-list'),
+    path('to-watch-list/batch/', views.ToWatchBatch.as_view(), name='to-watch-batch'),
+    path('to-watch-list/export/', views.ToWatchExport.as_view(), name='to-watch-export'),
     path('to-watch-list/<pk>/', views.ToWatchDetail.as_view(), name='to-watch-detail'),
 ]
@@ -1,15 +1,232 @@
 from rest_framework import generics
 from rest_framework import permissions
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
+from rest_framework.views import APIView
+import json
 from django.contrib.auth.models import User
-from film_library.api.models import TV, Movie, FilmsWatched, FilmsToWatch
+from django.db import connections, router, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Prefetch, Value
+from django.db.models.query import ModelIterable
+from django.db.models.functions import Coalesce
+from film_library.api.models import TV, Movie, FilmRanking, FilmsWatched, FilmsToWatch, UserStats, genre_counts
 import film_library.api.serializers as ser
-from film_library.api.permissions import IsSuperuser, IsSuperuserOrReadOnly, IsCreatorOrReadOnly
+from film_library.api.permissions import IsSuperuser, IsSuperuserOrReadOnly, IsCreatorOrReadOnly, IsSelfOrSuperuser
+from film_library.api.filters import FilmTypeFilter, GenreFilter, TitleSearchFilter, YearRangeFilter
+from film_library.api.asynchronous import AsyncDetailMixin, AsyncListMixin, iterate_in_thread
+from film_library.api.cache import cache_response, cache_view, invalidate_films
+from film_library.api.conditional import ConditionalDetailMixin, ConditionalListMixin
+from film_library.api.fastpath import FastRows, fast_path_enabled
+from film_library.api.exporters import TO_WATCH_COLUMNS, WATCHED_COLUMNS, CSVRenderer, NDJSONRenderer, export_rows
+from film_library.api.leaderboards import BOARDS, RANKING_COLUMNS
+from film_library.api.recommendations import recommended_films
+from film_library.api.importers import import_films, read_csv, read_ndjson
+from film_library.api import batch
+
+# Поля, которые загружаются из БД для сериализации фильмов и сериалов.
+# Рейтинг вычисляется из score_sum и score_count, имя добавившего пользователя берётся через select_related.
+FILMS_FIELDS = ['id', 'title', 'year', 'genre', 'score_sum', 'score_count', 'updated_at', 'added_by__username']
+MOVIE_FIELDS = FILMS_FIELDS + ['duration']
+TV_FIELDS = FILMS_FIELDS + ['number_of_episodes', 'avg_episode_duration']
+
+# Количество самых частых жанров в статистике пользователя
+USER_TOP_GENRES = 5
+
+
+def added_counts(user_ids) -> dict:
+    """
+    Количество добавленных сериалов и фильмов для каждого из пользователей user_ids
+    одним запросом с GROUP BY: {id пользователя: (сериалов, фильмов)}
+    """
+
+    tv, movies = TV._meta.db_table, Movie._meta.db_table
+    with connections[router.db_for_read(TV)].cursor() as cursor:
+        cursor.execute(f"""
+            SELECT added_by_id, COUNT(*) FILTER (WHERE kind = 'tv'), COUNT(*) FILTER (WHERE kind = 'movie')
+            FROM (
+                SELECT added_by_id, 'tv' AS kind FROM {tv} WHERE added_by_id = ANY(%(users)s)
+                UNION ALL
+                SELECT added_by_id, 'movie' FROM {movies} WHERE added_by_id = ANY(%(users)s)
+            ) AS films
+            GROUP BY added_by_id
+        """, {'users': list(user_ids)})
+        return {user_id: (tv_count, movie_count) for user_id, tv_count, movie_count in cursor.fetchall()}
+
+
+# Поля фильма или сериала, которые встраиваются в записи списков при ?expand=film
+FILM_SUMMARY_FIELDS = ['id', 'title', 'year', 'genre', 'score_sum', 'score_count']
+
+
+def expanded_films(queryset, expand: bool):
+    """
+    Подгружает одним JOIN фильм и сериал записей списка, если они встраиваются в ответ,
+    вместе со временем их изменения для ETag
+    """
+
+    if not expand:
+        return queryset
+    return queryset.select_related('tv', 'movie').only(
+        *queryset.query.deferred_loading[0],
+        *[f'{relation}__{field}' for relation in ('tv', 'movie') for field in (*FILM_SUMMARY_FIELDS, 'updated_at')]
+    )
+
+
+def watched_queryset(expand: bool = False):
+    """
+    Queryset просмотренных фильмов и сериалов для списков и отдельных записей.
+    Имя пользователя подгружается одним JOIN, для ссылок на фильм и сериал достаточно внешних ключей.
+    """
+
+    return expanded_films(FilmsWatched.objects.select_related('user').only(
+        'id', 'tv_id', 'movie_id', 'score', 'review', 'updated_at', 'user__username'
+    ), expand)
+
+
+def to_watch_queryset(expand: bool = False):
+    """
+    Queryset фильмов и сериалов желаемых к просмотру для списков и отдельных записей.
+    """
+
+    return expanded_films(FilmsToWatch.objects.select_related('user').only(
+        'id', 'tv_id', 'movie_id', 'updated_at', 'user__username'
+    ), expand)
+
+
+class SparseFieldsMixin:
+    """
+    Сужение queryset под поля, выбранные параметрами ?fields= и ?omit=.
+    Столбцы невыводимых полей не загружаются (defer), связанные записи и списки невыводимых полей
+    не подгружаются (JOIN и prefetch убираются).
+    Для вычисляемых полей столбцы, из которых они вычисляются, указываются в computed_sources.
+    """
+
+    computed_sources = {'rating': ('score_sum', 'score_count')}
+
+    def is_sparse(self) -> bool:
+        params = self.request.query_params
+        return self.request.method in permissions.SAFE_METHODS and bool(params.get('fields') or params.get('omit'))
+
+    def omitted_fields(self) -> dict:
+        """
+        Поля сериализатора, которые не выводятся в ответе
+        """
+
+        if not hasattr(self, '_omitted_fields'):
+            fields = self.get_serializer_class()().get_fields()
+            kept = set(ser.sparse_field_names(self.request, fields))
+            self._omitted_fields = {name: field for name, field in fields.items() if name not in kept}
+        return self._omitted_fields
+
+    def filter_queryset(self, queryset):
+        queryset = super(SparseFieldsMixin, self).filter_queryset(queryset)
+        if not self.is_sparse() or not issubclass(queryset._iterable_class, ModelIterable):
+            return queryset
+
+        deferred, unjoined = [], set()
+        omitted = self.omitted_fields()
+        for name, field in omitted.items():
+            if name in self.computed_sources:
+                deferred += self.computed_sources[name]
+                continue
+            source = (field.source or name).split('.')
+            try:
+                model_field = queryset.model._meta.get_field(source[0])
+            except FieldDoesNotExist:
+                continue
+            # Внешние ключи не откладываются: они нужны для ссылок и select_related
+            if model_field.concrete and not model_field.is_relation:
+                deferred.append(source[0])
+            elif model_field.is_relation and len(source) == 2:
+                deferred.append('__'.join(source))
+                unjoined.add(source[0])
+
+        joined = queryset.query.select_related
+        if unjoined and isinstance(joined, dict):
+            relations = [relation for relation in joined if relation not in unjoined]
+            queryset = queryset.select_related(None)
+            if relations:
+                queryset = queryset.select_related(*relations)
+
+        lookups = queryset._prefetch_related_lookups
+        kept_lookups = [
+            lookup for lookup in lookups
+            if (lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup) not in omitted
+        ]
+        if len(kept_lookups) != len(lookups):
+            queryset = queryset.prefetch_related(None).prefetch_related(*kept_lookups)
+        return queryset.defer(*deferred) if deferred else queryset
+
+
+class FastListMixin:
+    """
+    Быстрый путь чтения списков: записи строятся из .values() через FastRows и рендерятся orjson,
+    без объектов моделей, сериализаторов и reverse() на каждую ссылку. Ответ побайтно совпадает с обычным.
+    Используется для JSON без отступов и без параметров, меняющих набор полей (?fields=, ?omit=, ?expand=),
+    в остальных случаях список строится обычным способом.
+    Работает вместе с ConditionalListMixin: построитель записей выбирается в prepare_list,
+    ответ строится в list_response, в том числе асинхронными представлениями (AsyncListMixin).
+    """
+
+    fast_path_exclude_params = ('fields', 'omit', 'expand')
+
+    def use_fast_path(self) -> bool:
+        return (
+            fast_path_enabled()
+            and self.request.accepted_media_type == JSONRenderer.media_type
+            and isinstance(self.request.accepted_renderer, JSONRenderer)
+            and not any(param in self.request.query_params for param in self.fast_path_exclude_params)
+        )
+
+    def get_fast_rows(self):
+        """
+        Построитель записей быстрого пути или None, если список строится обычным способом
+        """
+
+        if not self.use_fast_path():
+            return None
+        fast = FastRows(self.get_serializer_class(), self.request)
+        return fast if fast.supported else None
+
+    def fast_response(self, fast, rows, paginated: bool):
+        data = self.get_paginated_response(fast.rows(rows)).data if paginated else fast.rows(rows)
+        return HttpResponse(fast.render(data), content_type=JSONRenderer.media_type)
+
+
+class ExpandFilmMixin:
+    """
+    Встраивание фильмов и сериалов в записи списков параметром ?expand=film.
+    Вместо ссылок на фильм или сериал в ответ попадают название, год, жанры и рейтинг,
+    которые загружаются тем же запросом, что и записи списка.
+    Версия записи для ETag учитывает время изменения встроенного фильма, в том числе его рейтинга.
+    """
+
+    expand_query_param = 'expand'
+
+    def expand_film(self) -> bool:
+        if self.request.method not in permissions.SAFE_METHODS:
+            return False
+        return 'film' in self.request.query_params.get(self.expand_query_param, '').split(',')
+
+    def get_serializer_context(self):
+        context = super(ExpandFilmMixin, self).get_serializer_context()
+        context['expand_film'] = self.expand_film()
+        return context
+
+    def get_row_version(self, row) -> tuple:
+        version = super(ExpandFilmMixin, self).get_row_version(row)
+        if not self.expand_film():
+            return version
+        film = row.movie if row.movie_id is not None else row.tv
+        return (*version, film.updated_at if film is not None else None)
 
 
 @api_view(['GET'])
+@cache_response('root')
 def api_root(request, format=None):
     """
     Стартовая страница с ссылками на другие страницы.
@@ -25,30 +242,137 @@ def api_root(request, format=None):
         'your tv and movie to watch list': reverse('to-watch-list', request=request, format=format),
         'your tv to watch list': reverse('tv-to-watch-list', request=request, format=format),
         'your movie to watch list': reverse('movie-to-watch-list', request=request, format=format),
+        'export your watched list': reverse('watched-export', request=request, format=format),
+        'export your to watch list': reverse('to-watch-export', request=request, format=format),
         'users list (only for admin)': reverse('user-list', request=request, format=format),
+        'search movies and tv': reverse('search', request=request, format=format),
+        'genres': reverse('genre-facets', request=request, format=format),
+        'recommendations for you': reverse('recommendations', request=request, format=format),
+        'top rated leaderboard': reverse('leaderboard', args=['top-rated'], request=request, format=format),
+        'most watched leaderboard': reverse('leaderboard', args=['most-watched'], request=request, format=format),
+        'most wanted leaderboard': reverse('leaderboard', args=['most-wanted'], request=request, format=format),
     })
 
 
-class UserList(generics.ListCreateAPIView):
+@api_view(['GET'])
+@cache_response('movie-list', 'tv-list')
+def genre_facets(request, format=None):
+    """
+    Количество фильмов и сериалов по жанрам для фильтров каталога.
+    Параметр ?type=movie или ?type=tv ограничивает подсчёт одним каталогом,
+    параметры search и genre учитываются так же, как в списках.
+    """
+
+    querysets = {'movie': Movie.objects.all(), 'tv': TV.objects.all()}
+    selected = request.query_params.get('type')
+    if selected in querysets:
+        querysets = {selected: querysets[selected]}
+
+    catalogs = []
+    for queryset in querysets.values():
+        for backend in (TitleSearchFilter, GenreFilter):
+            queryset = backend().filter_queryset(request, queryset, None)
+        catalogs.append(queryset)
+
+    return Response([{'genre': genre, 'count': count} for genre, count in genre_counts(*catalogs)])
+
+
+# Количество рекомендаций по умолчанию и наибольшее значение параметра ?limit=
+RECOMMENDATIONS_LIMIT = 20
+MAX_RECOMMENDATIONS_LIMIT = 100
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def recommendations(request, format=None):
+    """
+    Рекомендации фильмов и сериалов текущему пользователю по его оценкам и таблице похожих фильмов.
+    Просмотренные и желаемые к просмотру фильмы и сериалы не рекомендуются.
+    Параметр ?limit= - количество рекомендаций.
+    """
+
+    try:
+        limit = int(request.query_params.get('limit', RECOMMENDATIONS_LIMIT))
+    except ValueError:
+        raise ValidationError({'limit': 'Ожидается целое число'})
+    limit = min(max(limit, 1), MAX_RECOMMENDATIONS_LIMIT)
+
+    serializers = {'movie': ser.MovieSummarySerializer, 'tv': ser.TVSummarySerializer}
+    context = {'request': request}
+    return Response([
+        {'type': kind, **serializers[kind](film, context=context).data, 'predicted_score': round(predicted, 1)}
+        for kind, film, predicted in recommended_films(request.user.pk, limit)
+    ])
+
+
+class UserList(SparseFieldsMixin, generics.ListCreateAPIView):
     """
     Представление для вывода списка пользователей.
+    С параметром ?summary=true вместо списков ссылок выводится количество записей в каждом списке.
     """
 
-    queryset = User.objects.all()
     permission_classes = [IsSuperuser]
 
+    def is_summary(self) -> bool:
+        return self.request.query_params.get('summary', '').lower() in ('1', 'true', 'yes')
+
+    def get_queryset(self):
+        """
+        Связанные записи подгружаются отдельным запросом на каждый список, загружаются только ключи.
+        В режиме summary количество записей в списках читается из счётчиков UserStats через JOIN,
+        количество добавленных фильмов и сериалов считается для страницы в get_serializer.
+        """
+
+        queryset = User.objects.order_by('pk')
+
+        if self.request.method == 'GET' and self.is_summary():
+            counts = {
+                'films_watched_count': F('stats__movies_watched') + F('stats__tv_watched'),
+                'films_to_watch_count': F('stats__movies_to_watch') + F('stats__tv_to_watch'),
+            }
+            omitted = self.omitted_fields() if self.is_sparse() else {}
+            return queryset.annotate(**{
+                name: Coalesce(count, 0) for name, count in counts.items()
+                if name.replace('_count', '') not in omitted
+            })
+
+        return queryset.prefetch_related(
+            Prefetch('tv_added', queryset=TV.objects.only('id', 'added_by')),
+            Prefetch('movies_added', queryset=Movie.objects.only('id', 'added_by')),
+            Prefetch('films_watched', queryset=FilmsWatched.objects.only('id', 'user')),
+            Prefetch('films_to_watch', queryset=FilmsToWatch.objects.only('id', 'user')),
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        """
+        В режиме summary количество добавленных фильмов и сериалов считается одним запросом для выводимых
+        пользователей, если эти поля не исключены параметрами ?fields= и ?omit=
+        """
+
+        if args and kwargs.get('many') and self.request.method == 'GET' and self.is_summary():
+            users = list(args[0])
+            omitted = self.omitted_fields() if self.is_sparse() else {}
+            if users and not {'tv_added', 'movies_added'} <= set(omitted):
+                counts = added_counts(user.pk for user in users)
+                for user in users:
+                    user.tv_added_count, user.movies_added_count = counts.get(user.pk, (0, 0))
+            args = (users, *args[1:])
+        return super(UserList, self).get_serializer(*args, **kwargs)
+
     def get_serializer_class(self):
         """
         В зависимости от метода вызываются разные сериализаторы.
         """
 
         if self.request.method == 'GET':
+            if self.is_summary():
+                return ser.UserSerializerSummary
             return ser.UserSerializerList
         elif self.request.method == 'POST':
             return ser.UserSerializerCreateDetail
 
 
-class UserDetail(generics.RetrieveUpdateDestroyAPIView):
+class UserDetail(SparseFieldsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Представление для вывода каждого отдельного пользователя.
     """
@@ -58,59 +382,228 @@ class UserDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsSuperuser]
 
 
-class MovieList(generics.ListCreateAPIView):
+class UserStatsDetail(generics.RetrieveAPIView):
+    """
+    Статистика пользователя для него самого и суперпользователей. Количество записей в списках и оценок
+    хранится в записи UserStats и обновляется при каждом изменении списков, жанры считаются одним запросом.
+    Для пользователя, который ещё не менял списки, выводятся нули.
+    """
+
+    serializer_class = ser.UserStatsSerializer
+    permission_classes = [permissions.IsAuthenticated, IsSelfOrSuperuser]
+
+    def get_object(self):
+        user = generics.get_object_or_404(User.objects.select_related('stats'), pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, user)
+        try:
+            return user.stats
+        except UserStats.DoesNotExist:
+            return UserStats(user=user)
+
+    def get_serializer_context(self):
+        return {**super(UserStatsDetail, self).get_serializer_context(), 'top_genres': USER_TOP_GENRES}
+
+
+@cache_view('movie-list')
+class MovieList(SparseFieldsMixin, FastListMixin, AsyncListMixin, ConditionalListMixin, generics.ListCreateAPIView):
     """
     Представление для вывода списка фильмов.
     """
 
-    queryset = Movie.objects.all()
+    queryset = Movie.objects.select_related('added_by').only(*MOVIE_FIELDS)
     serializer_class = ser.MovieSerializerList
     permission_classes = [IsSuperuserOrReadOnly]
+    filter_backends = [TitleSearchFilter, GenreFilter]
+    keyset_ordering = ('title', 'id')
 
     def perform_create(self, serializer):
-        serializer.save(added_by=self.request.user)
+        instance = serializer.save(added_by=self.request.user)
+        invalidate_films('movie', instance.pk)
 
 
-class MovieDetail(generics.RetrieveUpdateDestroyAPIView):
+@cache_view('movie:{pk}', 'movie-all')
+class MovieDetail(SparseFieldsMixin, AsyncDetailMixin, ConditionalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Представление для вывода каждого отдельного фильма.
     """
 
-    queryset = Movie.objects.all()
+    queryset = Movie.objects.select_related('added_by').only(*MOVIE_FIELDS)
     serializer_class = ser.MovieSerializerDetail
     permission_classes = [IsSuperuserOrReadOnly]
 
     def perform_create(self, serializer):
         serializer.save(added_by=self.request.user)
 
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        invalidate_films('movie', instance.pk)
+
+    def perform_destroy(self, instance):
+        pk = instance.pk
+        instance.delete()
+        invalidate_films('movie', pk)
 
-class TVList(generics.ListCreateAPIView):
+
+@cache_view('tv-list')
+class TVList(SparseFieldsMixin, FastListMixin, AsyncListMixin, ConditionalListMixin, generics.ListCreateAPIView):
     """
     Представление для вывода списка сериалов.
     """
 
-    queryset = TV.objects.all()
+    queryset = TV.objects.select_related('added_by').only(*TV_FIELDS)
     serializer_class = ser.TVSerializerList
     permission_classes = [IsSuperuserOrReadOnly]
+    filter_backends = [TitleSearchFilter, GenreFilter]
+    keyset_ordering = ('title', 'id')
 
     def perform_create(self, serializer):
-        serializer.save(added_by=self.request.user)
+        instance = serializer.save(added_by=self.request.user)
+        invalidate_films('tv', instance.pk)
 
 
-class TVDetail(generics.RetrieveUpdateDestroyAPIView):
+@cache_view('tv:{pk}', 'tv-all')
+class TVDetail(SparseFieldsMixin, AsyncDetailMixin, ConditionalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Представление для вывода каждого отдельного сериала.
     """
 
-    queryset = TV.objects.all()
+    queryset = TV.objects.select_related('added_by').only(*TV_FIELDS)
     serializer_class = ser.TVSerializerDetail
     permission_classes = [IsSuperuserOrReadOnly]
 
     def perform_create(self, serializer):
         serializer.save(added_by=self.request.user)
 
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        invalidate_films('tv', instance.pk)
+
+    def perform_destroy(self, instance):
+        pk = instance.pk
+        instance.delete()
+        invalidate_films('tv', pk)
+
+
+class FilmStats(ConditionalDetailMixin, generics.RetrieveAPIView):
+    """
+    Статистика оценок фильма или сериала. Гистограмма, количество оценок и отзывов хранятся в самой записи
+    и обновляются при каждом изменении списка просмотренного, поэтому ответ строится по одной записи.
+    """
+
+    serializer_class = ser.FilmStatsSerializer
+    permission_classes = [IsSuperuserOrReadOnly]
+    model = None
+
+    def get_queryset(self):
+        return self.model.objects.only('score_sum', 'score_count', 'score_histogram', 'review_count', 'updated_at')
+
+
+@cache_view('movie:{pk}', 'movie-all')
+class MovieStats(FilmStats):
+    """
+    Статистика оценок фильма
+    """
+
+    model = Movie
+
+
+@cache_view('tv:{pk}', 'tv-all')
+class TVStats(FilmStats):
+    """
+    Статистика оценок сериала
+    """
+
+    model = TV
+
+
+class FilmsImport(APIView):
+    """
+    Массовый импорт фильмов или сериалов, только для суперпользователей.
+    Тело запроса - NDJSON (по объекту на строку) или CSV с заголовком (Content-Type: text/csv),
+    читается построчно и добавляется в БД пачками.
+    Ответ - NDJSON: по строке на каждую ошибочную запись и итоговая строка с количеством добавленных записей.
+    Импорт выполняется по мере отправки ответа, под ASGI - в отдельном потоке (iterate_in_thread).
+    """
+
+    permission_classes = [IsSuperuser]
+    model = None
+
+    def post(self, request, format=None):
+        lines = (line.decode('utf-8') for line in (request.stream or ()))
+        if request.content_type.startswith('text/csv'):
+            rows = read_csv(lines)
+        else:
+            rows = read_ndjson(lines)
+
+        reports = import_films(self.model, rows, added_by=request.user)
+        return StreamingHttpResponse(
+            iterate_in_thread(json.dumps(report, ensure_ascii=False) + '\n' for report in reports),
+            content_type='application/x-ndjson'
+        )
+
+
+class MovieImport(FilmsImport):
+    """
+    Представление для массового импорта фильмов.
+    """
+
+    model = Movie
+
+
+class TVImport(FilmsImport):
+    """
+    Представление для массового импорта сериалов.
+    """
+
+    model = TV
+
+
+@cache_view('movie-list', 'tv-list')
+class SearchList(SparseFieldsMixin, AsyncListMixin, ConditionalListMixin, generics.ListAPIView):
+    """
+    Представление для поиска по названию одновременно среди фильмов и сериалов.
+    Результаты упорядочены по релевантности.
+    """
+
+    serializer_class = ser.SearchResultSerializer
+    permission_classes = [IsSuperuserOrReadOnly]
+    version_fields = ('kind', 'pk', 'updated_at')
+
+    def get_queryset(self):
+        text = TitleSearchFilter().get_search_text(self.request)
+        if not text:
+            return Movie.objects.none().values()
+
+        fields = ['pk', 'title', 'year', 'genre', 'rank', 'similarity', 'kind', 'updated_at']
+        movies = Movie.objects.search(text).annotate(kind=Value('movie')).order_by().values(*fields)
+        tv = TV.objects.search(text).annotate(kind=Value('tv')).order_by().values(*fields)
+        return movies.union(tv, all=True).order_by('-rank', '-similarity', 'title', 'pk')
+
 
-class WatchedList(generics.ListAPIView):
+@cache_view('leaderboard', 'movie-list', 'tv-list')
+class Leaderboard(SparseFieldsMixin, generics.ListAPIView):
+    """
+    Лидерборды фильмов и сериалов: top-rated (по байесовской средней оценке, только с достаточным
+    количеством оценок), most-watched (по количеству просмотревших) и most-wanted (по количеству желающих
+    посмотреть). Читаются из таблицы рейтингов, которую обновляет команда refresh_leaderboards.
+    Фильтры: ?type=movie или ?type=tv, ?genre=, ?year_min= и ?year_max=.
+    """
+
+    serializer_class = ser.LeaderboardSerializer
+    permission_classes = [IsSuperuserOrReadOnly]
+    filter_backends = [FilmTypeFilter, GenreFilter, YearRangeFilter]
+
+    def get_queryset(self):
+        board = self.kwargs['board']
+        if board not in BOARDS:
+            raise NotFound('Лидерборд не найден')
+        ordering, condition = BOARDS[board]
+        queryset = FilmRanking.objects.filter(**condition).only('movie_id', 'tv_id', *RANKING_COLUMNS)
+        return expanded_films(queryset, expand=True).order_by(*ordering)
+
+
+class WatchedList(SparseFieldsMixin, FastListMixin, AsyncListMixin, ExpandFilmMixin, ConditionalListMixin,
+                  generics.ListAPIView):
     """
     Представление для вывода списка просмотренных фильмов и сериалов.
     Для каждого пользователя выводятся свои просмотренные фильмы и сериалы.
@@ -118,12 +611,76 @@ class WatchedList(generics.ListAPIView):
 
     serializer_class = ser.WatchedSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('id',)
 
     def get_queryset(self):
-        return FilmsWatched.objects.filter(user=self.request.user)
+        return watched_queryset(self.expand_film()).filter(user=self.request.user)
+
+
+class ListExport(APIView):
+    """
+    Потоковая выгрузка всего списка текущего пользователя в NDJSON (по умолчанию) или CSV
+    (?format=csv или заголовок Accept: text/csv). Записи читаются из БД серверным курсором по мере отправки ответа.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+    model = None
+    columns = None
+    filename = None
 
+    def get(self, request, format=None):
+        renderer = request.accepted_renderer
+        rows = export_rows(self.model.objects.filter(user=request.user), self.columns)
+        response = StreamingHttpResponse(
+            iterate_in_thread(renderer.stream(self.columns, rows)),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.filename}.{renderer.format}"'
+        return response
 
-class WatchedDetail(generics.RetrieveUpdateDestroyAPIView):
+
+class WatchedExport(ListExport):
+    """
+    Выгрузка списка просмотренных фильмов и сериалов с оценками и рецензиями.
+    """
+
+    model = FilmsWatched
+    columns = WATCHED_COLUMNS
+    filename = 'watched'
+
+
+class ToWatchExport(ListExport):
+    """
+    Выгрузка списка фильмов и сериалов желаемых к просмотру.
+    """
+
+    model = FilmsToWatch
+    columns = TO_WATCH_COLUMNS
+    filename = 'to-watch'
+
+
+class WatchedBatch(APIView):
+    """
+    Пакетное изменение списка просмотренных фильмов и сериалов текущего пользователя.
+    Тело запроса: {"add": [{"movie": id, "score": 8.5, "review": "..."}, {"tv": id}], "remove": [{"movie": id}]}.
+    Все изменения выполняются в одной транзакции постоянным количеством запросов.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = ser.WatchedBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            removed = batch.remove_watched(request.user, *serializer.split(serializer.validated_data['remove']))
+            added = batch.add_watched(request.user, serializer.validated_data['add'])
+
+        return Response({'added': added, 'removed': removed})
+
+
+class WatchedDetail(SparseFieldsMixin, ConditionalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Представление для вывода каждого отдельного просмотренного фильма или сериала.
     Для каждого пользователя выводятся свои просмотренные фильмы и сериалы, также
@@ -133,7 +690,7 @@ class WatchedDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticated, IsCreatorOrReadOnly]
 
     def get_queryset(self):
-        return FilmsWatched.objects.filter(user=self.request.user)
+        return watched_queryset().filter(user=self.request.user)
 
     def get_serializer_class(self):
         """
@@ -155,10 +712,11 @@ class AllUsersWatchedDetail(WatchedDetail):
     """
 
     def get_queryset(self):
-        return FilmsWatched.objects.all()
+        return watched_queryset()
 
 
-class TVWatchedList(generics.ListCreateAPIView):
+class TVWatchedList(SparseFieldsMixin, AsyncListMixin, ExpandFilmMixin, ConditionalListMixin,
+                    generics.ListCreateAPIView):
     """
     Представление для вывода списка просмотренных сериалов.
     Для каждого пользователя выводятся свои просмотренные сериалы.
@@ -166,15 +724,17 @@ class TVWatchedList(generics.ListCreateAPIView):
 
     serializer_class = ser.TVWatchedSerializerList
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('id',)
 
     def get_queryset(self):
-        return FilmsWatched.objects.filter(tv__isnull=False, user=self.request.user)
+        return watched_queryset(self.expand_film()).filter(tv__isnull=False, user=self.request.user)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-class MovieWatchedList(generics.ListCreateAPIView):
+class MovieWatchedList(SparseFieldsMixin, AsyncListMixin, ExpandFilmMixin, ConditionalListMixin,
+                       generics.ListCreateAPIView):
     """
     Представление для вывода списка просмотренных фильмов.
     Для каждого пользователя выводятся свои просмотренные фильмы.
@@ -182,15 +742,16 @@ class MovieWatchedList(generics.ListCreateAPIView):
 
     serializer_class = ser.MovieWatchedSerializerList
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('id',)
 
     def get_queryset(self):
-        return FilmsWatched.objects.filter(movie__isnull=False, user=self.request.user)
+        return watched_queryset(self.expand_film()).filter(movie__isnull=False, user=self.request.user)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-class ToWatchList(generics.ListAPIView):
+class ToWatchList(SparseFieldsMixin, AsyncListMixin, ExpandFilmMixin, ConditionalListMixin, generics.ListAPIView):
     """
     Представление для вывода списка фильмов и сериалов желаемых к просмотру.
     Для каждого пользователя выводятся свои фильмы и сериалы желаемые к просмотру.
@@ -198,12 +759,33 @@ class ToWatchList(generics.ListAPIView):
 
     serializer_class = ser.ToWatchSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('id',)
 
     def get_queryset(self):
-        return FilmsToWatch.objects.filter(user=self.request.user)
+        return to_watch_queryset(self.expand_film()).filter(user=self.request.user)
+
+
+class ToWatchBatch(APIView):
+    """
+    Пакетное изменение списка фильмов и сериалов желаемых к просмотру текущего пользователя.
+    Тело запроса: {"add": [{"movie": id}, {"tv": id}], "remove": [{"tv": id}]}.
+    Уже просмотренные фильмы и сериалы не добавляются и перечисляются в поле rejected ответа.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = ser.BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            removed = batch.remove_to_watch(request.user, *serializer.split(serializer.validated_data['remove']))
+            added, rejected = batch.add_to_watch(request.user, *serializer.split(serializer.validated_data['add']))
+
+        return Response({'added': added, 'removed': removed, 'rejected': rejected})
 
 
-class ToWatchDetail(generics.RetrieveUpdateDestroyAPIView):
+class ToWatchDetail(SparseFieldsMixin, ConditionalDetailMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Представление для вывода каждого отдельного фильма или сериала желаемого к просмотру.
     Для каждого пользователя выводятся свои фильмы и сериалы желаемые к просмотру, также
@@ -213,7 +795,7 @@ class ToWatchDetail(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticated, IsCreatorOrReadOnly]
 
     def get_queryset(self):
-        return FilmsToWatch.objects.filter(user=self.request.user)
+        return to_watch_queryset().filter(user=self.request.user)
 
     def get_serializer_class(self):
         obj = FilmsToWatch.objects.filter(pk=int(self.kwargs['pk']))
@@ -231,10 +813,11 @@ class AllUsersToWatchDetail(ToWatchDetail):
     """
 
     def get_queryset(self):
-        return FilmsToWatch.objects.all()
+        return to_watch_queryset()
 
 
-class TVToWatchList(generics.ListCreateAPIView):
+class TVToWatchList(SparseFieldsMixin, AsyncListMixin, ExpandFilmMixin, ConditionalListMixin,
+                    generics.ListCreateAPIView):
     """
     Представление для вывода списка сериалов желаемых к просмотру.
     Для каждого пользователя выводятся свои сериалы желаемые к просмотру.
@@ -242,15 +825,17 @@ class TVToWatchList(generics.ListCreateAPIView):
 
     serializer_class = ser.TVToWatchSerializerList
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('id',)
 
     def get_queryset(self):
-        return FilmsToWatch.objects.filter(tv__isnull=False, user=self.request.user)
+        return to_watch_queryset(self.expand_film()).filter(tv__isnull=False, user=self.request.user)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-class MovieToWatchList(generics.ListCreateAPIView):
+class MovieToWatchList(SparseFieldsMixin, AsyncListMixin, ExpandFilmMixin, ConditionalListMixin,
+                       generics.ListCreateAPIView):
     """
     Представление для вывода списка фильмов желаемых к просмотру.
     Для каждого пользователя выводятся свои фильмы желаемые к просмотру.
@@ -258,9 +843,10 @@ class MovieToWatchList(generics.ListCreateAPIView):
 
     serializer_class = ser.MovieToWatchSerializerList
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('id',)
 
     def get_queryset(self):
-        return FilmsToWatch.objects.filter(movie__isnull=False, user=self.request.user)
+        return to_watch_queryset(self.expand_film()).filter(movie__isnull=False, user=self.request.user)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -13,6 +13,11 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 from pathlib import Path
 from film_library.config import key, db_name, db_user, db_password
 
+try:
+    from film_library.config import db_replicas
+except ImportError:
+    db_replicas = []
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -38,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'film_library.api.apps.ApiConfig',
 ]
@@ -48,6 +54,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'film_library.api.routers.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,6 +83,8 @@ WSGI_APPLICATION = 'film_library.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# Соединения с БД постоянные (CONN_MAX_AGE, с): под ASGI запросы к БД выполняются в пуле потоков,
+# и без постоянных соединений каждый вызов из асинхронного представления открывал бы новое соединение.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -84,9 +93,52 @@ DATABASES = {
         'PASSWORD': db_password,
         'HOST': '127.0.0.1',
         'PORT': '5432',
+        'CONN_MAX_AGE': 60,
     }
 }
 
+# Реплики только для чтения: db_replicas в config.py - список адресов 'host:port'.
+# GET и HEAD запросы читают с реплик (film_library.api.routers), запись и остальные запросы - основная БД.
+# Для локальной проверки достаточно указать адрес самой основной БД, тогда у неё появится второй алиас.
+# В тестах реплики подключаются к тестовой основной БД (MIRROR).
+for number, address in enumerate(db_replicas, 1):
+    replica_host, _, replica_port = address.partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or '5432',
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['film_library.api.routers.PrimaryReplicaRouter']
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+
+# Время (с), в течение которого после изменяющего запроса клиент читает с основной БД
+REPLICA_STICKY_SECONDS = 10
+
+# Асинхронные представления чтения (api/asynchronous.py). Включаются только при запуске под ASGI (asgi.py),
+# под WSGI (wsgi.py, runserver) каждый запрос к ним проходил бы через async_to_sync
+ASYNC_READ_VIEWS = False
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Кэш в памяти процесса вытесняет давно не использованные записи при превышении MAX_ENTRIES.
+# В production несколько процессов должны использовать общий кэш, например
+# 'django.core.cache.backends.redis.RedisCache' с 'LOCATION': 'redis://127.0.0.1:6379'.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+RESPONSE_CACHE_ALIAS = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -130,6 +182,6 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'film_library.api.pagination.PageNumberOrKeysetPagination',
     'PAGE_SIZE': 10
 }